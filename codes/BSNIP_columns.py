@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import cPickle
+
+import numpy as np
+
+import cached_loader
+from ragged_array import Ragged_Array
+
+def is_missing(value):
+    return value is None or (isinstance(value, float) and np.isnan(value))
+
+def get_column_kind(values):
+    """Classify the values of a column by how they are stored:
+    'array' for numeric scalars, 'string' for strings (possibly with missing
+    entries), 'ragged' for 1-D numeric arrays of varying length and 'object'
+    for anything else, which is pickled.
+    """
+    if values.dtype.kind in 'biuf':
+        return 'array'
+    present = [value for value in values if not is_missing(value)]
+    if not present:
+        return 'object'
+    if all([isinstance(value, basestring) for value in present]):
+        return 'string'
+    if all([isinstance(value, np.ndarray) and value.ndim == 1
+            and value.dtype.kind in 'biuf' for value in present]):
+        return 'ragged'
+    return 'object'
+
+def write_column(fpath, name, values):
+    kind = get_column_kind(values)
+    if kind == 'array':
+        np.save(fpath + name + '.npy', values)
+    elif kind == 'string':
+        mask = np.array([is_missing(value) for value in values], dtype=bool)
+        np.save(fpath + name + '.npy', np.array(
+          [('' if missing else value)
+           for value, missing in zip(values, mask)]))
+        np.save(fpath + name + '.mask.npy', mask)
+    elif kind == 'ragged':
+        Ragged_Array.from_arrays(values).save(fpath + name)
+    else:
+        with open(fpath + name + '.pkl', 'wb') as out:
+            cPickle.dump(list(values), out, protocol=cPickle.HIGHEST_PROTOCOL)
+    return kind
+
+def read_array_column(fpath):
+    return np.load(fpath, mmap_mode='r')
+
+def read_string_column(fpath):
+    values = np.load(fpath).astype(object)
+    values[np.load(fpath[:-len('.npy')] + '.mask.npy')] = np.nan
+    return values
+
+def read_ragged_column(fpath):
+    return Ragged_Array.load(fpath[:-len('.offsets.npy')]).to_object_array()
+
+def read_object_column(fpath):
+    with open(fpath, 'rb') as inp:
+        list_values = cPickle.load(inp)
+    values = np.empty(len(list_values), dtype=object)
+    values[:] = list_values
+    return values
+
+#Suffix of the file identifying a column of each kind in 'cached_loader',
+#and the reader of the column from the path of that file.
+column_readers = {'array': ('.npy', read_array_column),
+                  'string': ('.npy', read_string_column),
+                  'ragged': ('.offsets.npy', read_ragged_column),
+                  'object': ('.pkl', read_object_column)}
+
+def read_column(fpath, name, kind):
+    """Read-only values of a column, which are only read once per process
+    (see 'cached_loader').
+    """
+    suffix, reader = column_readers[kind]
+    return cached_loader.load(fpath + name + suffix, reader)
+
+def write_columns(df, fpath, arrays=None):
+    """Write a dataframe as one file per column, under the directory fpath.
+
+    Parameters
+    ----------
+    df : ~pandas dataframe
+        Dataframe to be written. Column names are used as file names.
+    fpath : ~str
+        Output directory, e.g. './../OUTPUT_FILES/BSNIP.cols/'.
+    arrays : ~dict
+        Additional columns given as Ragged_Array objects, with one row per
+        row of df. If given, all the columns are stored in alphabetical
+        order, as in a dataframe built from a list of dictionaries. Default
+        is None.
+
+    Notes
+    -----
+    Scalar columns are stored as .npy files, which can be memory-mapped.
+    Strings are stored with a mask of missing (nan) entries, and so is the
+    index if it is not numeric. Columns holding
+    a spectrum array per row are stored as a single concatenated .npy array
+    plus the offsets of each row, so that the spectra never need to be read
+    to access the scalar columns. The directory is written under a temporary
+    name first and only replaces a previous output once complete.
+    """
+    tmp_fp = fpath.rstrip('/') + '.tmp/'
+    if os.path.exists(tmp_fp):
+        shutil.rmtree(tmp_fp)
+    os.makedirs(tmp_fp)
+
+    columns = []
+    for name in df.columns:
+        columns.append((name, write_column(tmp_fp, name, df[name].values)))
+    if arrays is not None:
+        for name in sorted(arrays.keys()):
+            arrays[name].save(tmp_fp + name)
+            columns.append((name, 'ragged'))
+        columns.sort()
+    #The index is stored like a column, so that e.g. string indexes do not
+    #need to be pickled inside the .npy file.
+    index_kind = write_column(tmp_fp, 'index', df.index.values)
+    with open(tmp_fp + 'columns.pkl', 'wb') as out:
+        cPickle.dump({'columns': columns, 'index': index_kind}, out,
+                     protocol=cPickle.HIGHEST_PROTOCOL)
+
+    if os.path.exists(fpath):
+        shutil.rmtree(fpath)
+    os.rename(tmp_fp, fpath)
+
+def get_output_path(filename):
+    """Path of the output read by 'read_columns', i.e. '<filename>.cols/'
+    if it exists and '<filename>.pkl' otherwise.
+    """
+    if os.path.isdir(filename + '.cols/'):
+        return filename + '.cols/'
+    return filename + '.pkl'
+
+def read_columns(filename, columns=None, skip_missing=False):
+    """Read some of the columns of a BSNIP output.
+
+    Parameters
+    ----------
+    filename : ~str
+        Path of the output, without extension, e.g. './../OUTPUT_FILES/BSNIP'.
+        Columns are read from '<filename>.cols/' if it exists, otherwise from
+        the '<filename>.pkl' dataframe.
+    columns : ~list
+        Names of the columns to be read. Default is None, which reads all of
+        them.
+    skip_missing : ~bool
+        If True, requested columns which do not exist are left out of the
+        returned dataframe. Otherwise (default) a KeyError is raised.
+
+    Returns
+    -------
+    Dataframe containing the requested columns. Spectrum arrays are views of
+    a memory-mapped file (see 'Ragged_Array'), which are only read from disk
+    when accessed. Each column (or a '<filename>.pkl' dataframe) is only
+    read once per process (see 'cached_loader') and a copy is returned.
+    """
+    #Imported here, so that importing the plotting scripts does not.
+    import pandas as pd
+    fpath = filename + '.cols/'
+    if not os.path.isdir(fpath):
+        df = cached_loader.load(filename + '.pkl', pd.read_pickle)
+        if columns is None:
+            return df.copy()
+        if skip_missing:
+            columns = [name for name in columns if name in df.columns]
+        return df[columns]
+
+    header = cached_loader.load(fpath + 'columns.pkl')
+    stored = header['columns']
+    kinds = dict(stored)
+    if columns is None:
+        columns = [name for (name, kind) in stored]
+    missing = [name for name in columns if name not in kinds]
+    if skip_missing:
+        columns = [name for name in columns if name in kinds]
+    elif missing:
+        raise KeyError('Columns not in ' + fpath + ': ' + ', '.join(missing))
+
+    data = dict((name, read_column(fpath, name, kinds[name]))
+                for name in columns)
+    index = np.array(read_column(fpath, 'index', header['index']))
+    return pd.DataFrame(data, index=index, columns=columns)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import cPickle
+
+import numpy as np
+import pandas as pd
+
+from BSNIP_columns import write_columns
+
+def parse_shard(shard):
+    """Convert 'i/n' (or a tuple (i, n)) into (i, n), with 0 <= i < n."""
+    if isinstance(shard, basestring):
+        try:
+            i, n = [int(value) for value in shard.split('/')]
+        except ValueError:
+            raise ValueError('shard must be given as i/n, e.g. 0/8.')
+    else:
+        i, n = shard
+    if not 0 <= i < n:
+        raise ValueError('Shard ' + str(i) + '/' + str(n) + ' is not valid.'
+                         + ' Shards are numbered from 0 to n-1.')
+    return i, n
+
+def get_shard_filename(filename, shard):
+    i, n = shard
+    return filename + '.shard-' + str(i) + '-of-' + str(n)
+
+def assign_shards(IDs, costs, n):
+    """Assign each spectrum to one of n shards, balancing the total cost.
+    Spectra are taken from the most to the least expensive and each is
+    assigned to the shard with the lowest cost so far (longest processing
+    time first). Ties are broken by ID and by shard number, so that every
+    process computes the same assignment.
+
+    Returns
+    -------
+    Array with the shard of each spectrum.
+    """
+    order = sorted(range(len(IDs)), key=lambda k: (-costs[k], IDs[k]))
+    loads = np.zeros(n)
+    assignment = np.zeros(len(IDs), dtype=int)
+    for k in order:
+        i = int(np.argmin(loads))
+        assignment[k] = i
+        loads[i] += costs[k]
+    return assignment
+
+def merge_shards(filename, n, output_format='both',
+                 out_fp='./../OUTPUT_FILES/'):
+    """Check that the shards of a BSNIP run are complete and assemble them
+    into the same output as an unsharded run.
+
+    Parameters
+    ----------
+    filename : ~str
+        Name of the BSNIP run, e.g. 'BSNIP'.
+    n : ~int
+        Number of shards.
+    output_format : ~str
+        'pickle', 'columns' or 'both', as in BSNIP_Database.
+    out_fp : ~str
+        Directory containing the shard files.
+
+    Notes
+    -----
+    A ValueError is raised if a shard file is missing, if the shards were
+    computed from different catalogs or if an ID is missing from every shard
+    or present in more than one. Spectra whose computation failed are
+    reported, but do not prevent the merge.
+    """
+    print '\n*MERGING ' + str(n) + ' BSNIP SHARDS.'
+    shards, missing_files = [], []
+    for i in range(n):
+        fpath = out_fp + get_shard_filename(filename, (i, n)) + '.pkl'
+        if not os.path.isfile(fpath):
+            missing_files.append(fpath)
+            continue
+        with open(fpath, 'rb') as inp:
+            shards.append(cPickle.load(inp))
+    if missing_files:
+        raise ValueError('Missing shard files:\n' + '\n'.join(missing_files))
+
+    catalog_IDs = shards[0]['catalog_IDs']
+    if any([shard['catalog_IDs'] != catalog_IDs for shard in shards]):
+        raise ValueError('Shards were computed from different catalogs.')
+
+    #Every ID of the catalog must be assigned to exactly one shard, and
+    #computed at most once.
+    counts = dict((ID, 0) for ID in catalog_IDs)
+    unknown, N_failed = [], 0
+    for shard in shards:
+        computed = (shard['df']['ID'].tolist() if 'ID' in shard['df'].columns
+                    else [])
+        for ID in shard['IDs']:
+            if ID in counts:
+                counts[ID] += 1
+            else:
+                unknown.append(ID)
+        for ID in set(computed) - set(shard['IDs']):
+            unknown.append(ID)
+        seen = set()
+        for ID in computed:
+            if ID in seen and ID in counts:
+                counts[ID] += 1
+            seen.add(ID)
+
+        N_failed += len(shard['failed'])
+        for index, error in shard['failed']:
+            print ('  -WARNING: INDEX ' + str(index) + ' (shard '
+                   + str(shard['shard'][0]) + ') failed: '
+                   + error.strip().split('\n')[-1])
+
+    missing = [ID for ID in catalog_IDs if counts[ID] == 0]
+    duplicated = [ID for ID in catalog_IDs if counts[ID] > 1]
+    if missing or duplicated or unknown:
+        raise ValueError(
+          'Incomplete merge. Missing IDs: ' + ', '.join(missing)
+          + '. Duplicated IDs: ' + ', '.join(duplicated)
+          + '. IDs not in the catalog: ' + ', '.join(unknown) + '.')
+
+    df = pd.concat([shard['df'] for shard in shards], sort=False)
+    df = df[sorted(df.columns)].sort_index()
+    print ('  -MERGED: ' + str(len(df)) + ' spectra, ' + str(N_failed)
+           + ' failed.')
+
+    if output_format in ['pickle', 'both']:
+        df.to_pickle(out_fp + filename + '.pkl')
+    if output_format in ['columns', 'both']:
+        write_columns(df, out_fp + filename + '.cols/')
+    if any([shard['sweep'] is not None for shard in shards]):
+        sweep = pd.concat([shard['sweep'] for shard in shards], sort=False)
+        #Same row order as in an unsharded run.
+        position = dict((ID, i) for i, ID in enumerate(catalog_IDs))
+        sweep = sweep.iloc[sorted(
+          range(len(sweep)), key=lambda k: (position[sweep.index[k][0]],
+                                            sweep.index[k][1]))]
+        sweep[sorted(sweep.columns)].to_pickle(
+          out_fp + filename + '_sweep.pkl')
+    return df
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] != 'merge':
+        print 'Usage: python BSNIP_shards.py merge n [filename]'
+        sys.exit(1)
+    filename = sys.argv[3] if len(sys.argv) > 3 else 'BSNIP'
+    merge_shards(filename, int(sys.argv[2]))
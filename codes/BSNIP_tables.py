@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+import os
+import re
+import hashlib
+import cPickle
+
+import numpy as np
+import pandas as pd
+
+#Column specifications of the BSNIP tables. Each column is given as
+#(name, first character, last character, characters removed, empty as nan).
+SNID_spec = ('SNID', 3, 9, ' \n', False)
+
+feature_quantities = [
+  ('flux_b', 18, 24), ('flux_r', 32, 38), ('pEW', 46, 51),
+  ('pEW_unc', 53, 57), ('velocity', 73, 78), ('velocity_unc', 80, 84),
+  ('depth', 86, 91), ('depth_unc', 93, 98), ('FWHM', 100, 105),
+  ('FWHM_unc', 107, 110)]
+
+table_specs = {
+  'table1': ('paper_I/table1.dat', [
+    SNID_spec,
+    ('subtype', 10, 18, ' ', True),
+    ('host_morphology', 50, 57, ' ', True),
+    ('host_redshift', 57, 63, ' ', True),
+    ('foreground_extinction', 63, 69, ' ', True)]),
+
+  'table2': ('paper_I/table2.dat', [
+    SNID_spec,
+    ('reliable', 9, 10, ' ', False),
+    ('date', 11, 25, ' /', False),
+    ('phase', 37, 44, ' ', True),
+    ('wavelength_min', 47, 52, ' ', False),
+    ('wavelength_max', 52, 59, ' ', False),
+    ('flux_correction', 115, 116, ' ', False)]),
+
+  'tablea1': ('paper_II/tablea1.dat', [
+    SNID_spec,
+    ('subtype_II', 75, 82, ' \n', True),
+    ('type_Benetti', 83, 89, ' \r\n', True),
+    ('type_Branch', 90, 92, ' \n', True),
+    ('type_Wang', 93, 95, ' \n', True)])}
+
+for i in range(9):
+    table_specs['tableb' + str(i + 1)] = (
+      'paper_II/tableb' + str(i + 1) + '.dat',
+      [SNID_spec, ('phase', 11, 17, ' \n', True)]
+      + [(quantity, first, last, ' \n', True)
+         for (quantity, first, last) in feature_quantities])
+
+def read_fixed_width(fpath, columns):
+    """Read a fixed width table. Every column is sliced from all the rows at
+    once, using pandas' vectorized string methods.
+    """
+    with open(fpath, 'r') as f:
+        rows = pd.Series(f.readlines())
+
+    data = {}
+    for (name, first, last, remove, empty_as_nan) in columns:
+        values = rows.str.slice(first, last).str.replace(
+          '[' + re.escape(remove) + ']', '')
+        if empty_as_nan:
+            values = values.where(values != '', np.nan)
+        data[name] = values
+    df = pd.DataFrame(data, columns=[column[0] for column in columns])
+    df['SNID'] = 'SN' + df['SNID'].str.upper()
+    return df
+
+def read_feature_tables(BSNIP_fp):
+    """Read tables b1-b9 of paper II into a single long format dataframe,
+    with one row per (SNID, phase, feature, quantity).
+    """
+    list_df = []
+    for i in range(9):
+        key = str(i + 1)
+        fname, columns = table_specs['tableb' + key]
+        df = pd.melt(read_fixed_width(BSNIP_fp + fname, columns),
+                     id_vars=['SNID', 'phase'], var_name='quantity')
+        df['feature'] = key
+        list_df.append(df)
+    return pd.concat(list_df, ignore_index=True)
+
+def pivot_features(df_long):
+    """Convert the long format features into one row per (SNID, phase) and
+    one column per feature quantity, e.g. 'BSNIP_pEW_f7'.
+
+    Notes
+    -----
+    A table may list the same (SNID, phase) more than once. Only the first
+    row is kept and the repeated ones are reported, since merging them
+    would duplicate the spectra of that object.
+    """
+    df = df_long.copy()
+    df['column'] = 'BSNIP_' + df['quantity'] + '_f' + df['feature']
+    duplicated = df.duplicated(subset=['SNID', 'phase', 'column'])
+    if duplicated.any():
+        repeated = df[duplicated].drop_duplicates(
+          subset=['SNID', 'phase', 'feature'])
+        for (SNID, phase, feature) in zip(
+          repeated['SNID'], repeated['phase'], repeated['feature']):
+            print ('  -WARNING: ' + SNID + ' at phase ' + str(phase)
+                   + ' is repeated in table b' + feature
+                   + '. Keeping the first row.')
+        df = df[~duplicated]
+    df = df.set_index(['SNID', 'phase', 'column'])['value'].unstack('column')
+    columns = ['BSNIP_' + quantity + '_f' + str(i + 1) for i in range(9)
+               for (quantity, first, last) in feature_quantities]
+    return df.reindex(columns=columns).reset_index()
+
+#Increase when the parsing changes in a way not captured by table_specs.
+tables_version = 1
+
+def compute_checksums(BSNIP_fp):
+    """Checksums of the table files, plus one of the column specifications
+    and tables_version, so that the cache is rebuilt when either changes.
+    """
+    checksums = {'table_specs': hashlib.md5(repr(sorted(
+      table_specs.items()))).hexdigest(), 'version': tables_version}
+    for name, (fname, columns) in table_specs.items():
+        with open(BSNIP_fp + fname, 'rb') as f:
+            checksums[fname] = hashlib.md5(f.read()).hexdigest()
+    return checksums
+
+def get_BSNIP_tables(BSNIP_fp, cache_fp):
+    """Return the parsed BSNIP tables. These are read from a cache file if
+    the checksums of all the table files, of the column specifications and
+    the tables_version match those stored in the cache.
+
+    Returns
+    -------
+    Dictionary containing a dataframe for 'table1', 'table2', 'tablea1' and
+    'features' (long format, see read_feature_tables).
+    """
+    checksums = compute_checksums(BSNIP_fp)
+    if os.path.isfile(cache_fp):
+        with open(cache_fp, 'rb') as inp:
+            cache = cPickle.load(inp)
+        if cache['checksums'] == checksums:
+            return cache['tables']
+
+    tables = {'features': read_feature_tables(BSNIP_fp)}
+    for name in ['table1', 'table2', 'tablea1']:
+        fname, columns = table_specs[name]
+        tables[name] = read_fixed_width(BSNIP_fp + fname, columns)
+
+    cache_dir = os.path.dirname(cache_fp)
+    if cache_dir and not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    #Write to a temporary file first, since several processes (e.g. shards)
+    #may be reading or writing the cache at the same time.
+    tmp_fp = cache_fp + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp_fp, 'wb') as out:
+        cPickle.dump({'checksums': checksums, 'tables': tables}, out,
+                     protocol=cPickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_fp, cache_fp)
+    return tables
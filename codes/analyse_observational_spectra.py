@@ -2,6 +2,7 @@
 
 import os                                                               
 import sys
+import time
 
 import pickle
 import numpy as np
@@ -9,6 +10,13 @@ import pandas as pd
 
 import tardis.tardistools.compute_features as cp
 
+from batch_features import Batch_Uncertainty
+from window_sweep import compute_window_sweep, make_sweep_table
+
+#Features whose error bars are plotted (pEW_unc_f6 and pEW_unc_f7, see
+#plot_branch.py). Only these are computed in the 'adaptive' mode.
+adaptive_features = ['6', '7']
+
 class Analyse_Observational(object):
     """Takes observed spectra data (usually from WISEREP) and process it
     using the 'compute_features' package under tardistools.
@@ -19,14 +27,57 @@ class Analyse_Observational(object):
         Dictionary containing the following keys:
         'filenames', 'host_redshift', 'phase', 't_exp', 'L_bol' and
         'extinction'
+        
+    uncertainties : ~str
+        'loop' (default) uses 'Compute_Uncertainty' in tardistools, while
+        'batched' uses the vectorized Monte Carlo in 'batch_features'.
+        'adaptive' is like 'batched', but only for the
+        'adaptive_features', and stops drawing realizations by the rtol
+        criterion of 'Batch_Uncertainty' (N_MC_runs is the cap). How close
+        either mode comes to 'loop' on these spectra has not been measured;
+        'compare_uncertainty_modes' does that. The published files are
+        computed with 'loop'.
+        
+    rtol : ~float
+        Relative tolerance used by the 'adaptive' mode.
+        
+    smoothing_windows : ~list
+        If given, the features are also computed for each of these smoothing
+        windows and written to a table indexed by (filename, window), next
+        to the output .pkl file. Default is None.
     """
-    def __init__(self, filename, redshift):                            
+    def __init__(self, filename, redshift, uncertainties='loop', rtol=0.03,
+                 smoothing_windows=None, run=True):
         self.filename = filename
         self.redshift = redshift
-        self.analyse_observation_spectra()
-
-    def analyse_observation_spectra(self):
-        
+        self.uncertainties = uncertainties
+        self.rtol = rtol
+        self.smoothing_windows = smoothing_windows
+        if run:
+            self.analyse_observation_spectra()
+
+    def compute_uncertainties(self, D, smoothing_window):
+        if self.uncertainties == 'batched':
+            D = Batch_Uncertainty(
+              D=D, smoothing_window=smoothing_window,
+              N_MC_runs=3000).run_uncertainties()
+        elif self.uncertainties == 'adaptive':
+            D = Batch_Uncertainty(
+              D=D, smoothing_window=smoothing_window, N_MC_runs=3000,
+              chunk_size=100, rtol=self.rtol,
+              features=adaptive_features).run_uncertainties()
+            print ('  -MC runs per feature: ' + ', '.join(
+              ['f' + key + '=' + str(D['N_MC_runs_f' + key])
+               for key in adaptive_features]))
+        else:
+            D = cp.Compute_Uncertainty(
+              D=D, smoothing_window=smoothing_window,
+              N_MC_runs=3000).run_uncertainties()
+        return D
+
+    def compute_features(self):
+        """Read the spectrum and compute its features, without uncertainties.
+        """
         path_data = './../INPUT_FILES/observational_spectra/'
         
         wavelength, flux = [], []
@@ -46,14 +97,24 @@ class Analyse_Observational(object):
                 flux.append(f)                      
 
         #Call routines to compute features and uncertainties.
-        D = cp.Analyse_Spectra(
+        return cp.Analyse_Spectra(
           wavelength=np.asarray(wavelength),
           flux=np.asarray(flux),
           redshift=self.redshift, extinction=0.,
           smoothing_window=21, deredshift_and_normalize=True).run_analysis()            
 
-        D = cp.Compute_Uncertainty(
-          D=D, smoothing_window=21, N_MC_runs=3000).run_uncertainties() 
+    def analyse_observation_spectra(self):
+        
+        path_data = './../INPUT_FILES/observational_spectra/'
+        D = self.compute_uncertainties(self.compute_features(), 21)
+
+        #Features for other smoothing windows, from the same de-redshifted
+        #and normalized spectrum.
+        if self.smoothing_windows is not None:
+            sweep = make_sweep_table([self.filename], [compute_window_sweep(
+              D, self.smoothing_windows, self.compute_uncertainties)])
+            sweep.to_pickle(
+              path_data + self.filename.split('.dat')[0] + '_sweep.pkl')
 
         outfile = path_data + self.filename.split('.')[0] + '.png'
         cp.Plot_Spectra(D, outfile=outfile, show_fig=False, save_fig=True)                                
@@ -65,6 +126,51 @@ class Analyse_Observational(object):
         with open(outfile, 'w') as out_pkl:
             pickle.dump(D, out_pkl, protocol=pickle.HIGHEST_PROTOCOL)
      
+def compare_uncertainty_modes(files, modes=['loop', 'adaptive'],
+                              rtol=0.03):
+    """Compare the run time and the uncertainties of the
+    'adaptive_features' between uncertainty modes.
+
+    Parameters
+    ----------
+    files : ~list
+        (filename, redshift) of each observed spectrum.
+    modes : ~list
+        Modes compared, see 'Analyse_Observational'. The first one is the
+        reference.
+    rtol : ~float
+        Relative tolerance of the 'adaptive' mode.
+
+    Returns
+    -------
+    Dataframe with one row per file and mode, containing the run time (s)
+    of the uncertainties, the pEW and velocity uncertainties and their
+    relative difference to the reference mode.
+    """
+    rows = []
+    for filename, redshift in files:
+        D_features, reference = None, None
+        for mode in modes:
+            analysis = Analyse_Observational(filename, redshift, mode, rtol,
+                                             run=False)
+            if D_features is None:
+                D_features = analysis.compute_features()
+            time_start = time.time()
+            D = analysis.compute_uncertainties(dict(D_features), 21)
+            row = {'filename': filename, 'mode': mode,
+                   'time': time.time() - time_start}
+            for key in adaptive_features:
+                for var in ['pEW', 'velocity']:
+                    name = var + '_unc_f' + key
+                    row[name] = D[name]
+                    if reference is not None:
+                        diff = abs(D[name] - reference[name])
+                        row[name + '_rel_diff'] = diff / abs(reference[name])
+            if reference is None:
+                reference = row
+            rows.append(row)
+    return pd.DataFrame(rows)
+
 files_11fe = ['2011fe/2011_08_25.dat', '2011fe/2011_08_28.dat',
               '2011fe/2011_08_31.dat', '2011fe/2011_09_03.dat',
               '2011fe/2011_09_07.dat', '2011fe/2011_09_10.dat',
@@ -78,13 +184,21 @@ files_05bl = ['2005bl/2005_04_16.dat', '2005bl/2005_04_17.dat',
 redshift_11fe = 0.
 redshift_05bl = 0.02406
 
-#Note, the observed spectra is corrected for redshift, while the synthetic
-#spectra is reddened to match the observed extinction.
-for inp_file in files_11fe:
-   Analyse_Observational(filename=inp_file, redshift=redshift_11fe)
-
-for inp_file in files_05bl:                                                         
-   Analyse_Observational(filename=inp_file, redshift=redshift_05bl)
-
-
-
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'compare':
+        #Measure the 'adaptive' mode against 'loop' on every file, e.g.
+        #python analyse_observational_spectra.py compare
+        comparison = compare_uncertainty_modes(
+          [(fname, redshift_11fe) for fname in files_11fe]
+          + [(fname, redshift_05bl) for fname in files_05bl])
+        print comparison.to_string()
+        comparison.to_csv('./../OUTPUT_FILES/uncertainty_modes.csv')
+        sys.exit(0)
+
+    #Note, the observed spectra is corrected for redshift, while the synthetic
+    #spectra is reddened to match the observed extinction.
+    for inp_file in files_11fe:
+       Analyse_Observational(filename=inp_file, redshift=redshift_11fe)
+
+    for inp_file in files_05bl:                                                         
+       Analyse_Observational(filename=inp_file, redshift=redshift_05bl)
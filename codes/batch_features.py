@@ -0,0 +1,748 @@
+#!/usr/bin/env python
+
+import sys
+
+import numpy as np
+import pandas as pd
+from scipy.signal import savgol_filter
+from astropy import constants as const
+
+#Boundaries of the regions where the pseudo-continuum maxima are searched for.
+#See Table 1 in Silverman et al 2012. Multiplets use the mean rest wavelength.
+feature_windows = {
+  '1': {'rest': np.mean([3934.75, 3969.55]),
+        'blue': (3400., 3800.), 'red': (3800., 4100.)},
+  '2': {'rest': 4026.19, 'blue': (3850., 4000.), 'red': (4000., 4150.)},
+  '3': {'rest': 4351., 'blue': (4000., 4150.), 'red': (4350., 4700.)},
+  '4': {'rest': 4805., 'blue': (4350., 4700.), 'red': (5050., 5600.)},
+  '5': {'rest': 5051., 'blue': (5100., 5300.), 'red': (5450., 5700.)},
+  '6': {'rest': 5972., 'blue': (5400., 5700.), 'red': (5750., 6000.)},
+  '7': {'rest': 6355., 'blue': (5750., 6060.), 'red': (6200., 6600.)},
+  '8': {'rest': 7773., 'blue': (6800., 7450.), 'red': (7500., 8100.)},
+  '9': {'rest': np.mean([8498., 8542., 8662.]),
+        'blue': (7500., 8100.), 'red': (8200., 8900.)}}
+
+feature_keys = [str(i + 1) for i in range(9)]
+
+#Default rest frame grid of the native engine, covering all feature regions.
+default_grid = np.arange(3300., 9000., 1.)
+
+c_kms = const.c.to('km/s').value
+
+#Largest differences accepted by 'check_validation', per quantity, between
+#two sets of features (e.g. the native engine and 'Analyse_Spectra').
+#Velocities are in 10^3 km/s. These are provisional: they are to be replaced
+#by the differences measured between the two engines on the BSNIP spectra,
+#'python batch_features.py validate BSNIP 51'.
+validation_tolerances = {
+  'pEW': {'N_mismatch': 0, 'median_rel': 0.02, 'max_rel': 0.1},
+  'velocity': {'N_mismatch': 0, 'median_abs': 0.1, 'max_abs': 0.5},
+  'depth': {'N_mismatch': 0, 'median_abs': 0.01, 'max_abs': 0.05}}
+
+#Same, between the uncertainties of 'Batch_Uncertainty' and of
+#'Compute_Uncertainty' (see 'validate_uncertainties'). Both are Monte Carlo
+#estimates, which differ by about sqrt(1 / 2N) even for the same noise model.
+uncertainty_tolerances = {
+  'pEW_unc': {'N_mismatch': 0, 'median_rel': 0.1, 'max_rel': 0.25},
+  'velocity_unc': {'N_mismatch': 0, 'median_rel': 0.1, 'max_rel': 0.25}}
+
+def resample_block(list_wavelength, list_flux, wavelength_grid):
+    """Linear interpolation of each spectrum onto a common wavelength grid.
+
+    Returns
+    -------
+    (N, pixels) array, with nan where the grid is outside the wavelength range
+    of a spectrum.
+    """
+    block = np.full((len(list_flux), len(wavelength_grid)), np.nan)
+    for i, (wavelength, flux) in enumerate(zip(list_wavelength, list_flux)):
+        block[i, :] = np.interp(wavelength_grid, wavelength, flux,
+                                left=np.nan, right=np.nan)
+    return block
+
+def smooth_block(flux_block, smoothing_window, smoothing_order=3):
+    """Savitzky-Golay smoothing applied to every row of a (N, pixels) array."""
+    return savgol_filter(flux_block, smoothing_window, smoothing_order,
+                         axis=-1)
+
+def compute_flux_rms(flux, flux_smoothed, smoothing_window):
+    """Running rms of the residuals (flux - smoothed flux), computed over the
+    same number of pixels as the smoothing window. This is used as the noise
+    of each pixel in the Monte Carlo realizations.
+    """
+    residual_sq = (np.asarray(flux) - np.asarray(flux_smoothed))**2.
+    kernel = np.ones(smoothing_window) / float(smoothing_window)
+
+    #Normalize by the number of pixels actually covered near the edges.
+    coverage = np.convolve(np.ones(len(residual_sq)), kernel, mode='same')
+    return np.sqrt(np.convolve(residual_sq, kernel, mode='same') / coverage)
+
+def compute_feature_block(wavelength, flux, flux_smoothed, key):
+    """Compute the pEW, velocity and depth of a feature for every row of a
+    block of spectra sharing the same wavelength array.
+
+    Parameters
+    ----------
+    wavelength : ~np.array
+        Rest frame wavelength, common to all rows.
+    flux : ~np.array
+        (N, pixels) array of normalized fluxes.
+    flux_smoothed : ~np.array
+        (N, pixels) array of smoothed fluxes.
+    key : ~str
+        Feature number, from '1' to '9'.
+
+    Returns
+    -------
+    Dictionary with arrays of length N for 'pEW', 'velocity' (in 10^3 km/s),
+    'depth', 'FWHM' and 'flag', plus the wavelength and smoothed flux of the
+    pseudo-continuum end points ('wavelength_b', 'flux_b', 'wavelength_r' and
+    'flux_r'). The flag is 1 if a pseudo-continuum point lies on the edge of
+    its region. Values are nan if the spectrum does not cover the feature,
+    i.e. if any flux in the span of the two regions is nan.
+    """
+    window = feature_windows[key]
+    N = flux.shape[0]
+    out = dict((var, np.full(N, np.nan)) for var in [
+      'pEW', 'velocity', 'depth', 'FWHM', 'wavelength_b', 'flux_b',
+      'wavelength_r', 'flux_r'])
+    out['flag'] = np.ones(N)
+
+    blue = np.where((wavelength >= window['blue'][0])
+                    & (wavelength <= window['blue'][1]))[0]
+    red = np.where((wavelength >= window['red'][0])
+                   & (wavelength <= window['red'][1]))[0]
+    if len(blue) < 3 or len(red) < 3:
+        return out
+
+    #Only the columns spanned by the feature in any of the rows are used.
+    cols = np.arange(blue[0], red[-1] + 1)
+    w = wavelength[cols]
+    f = flux[:, cols]
+    f_smot = flux_smoothed[:, cols]
+    covered = np.all(np.isfinite(f) & np.isfinite(f_smot), axis=1)
+
+    #Pseudo-continuum end points are the maxima of the smoothed flux in the
+    #blue and red regions.
+    rows = np.arange(N)
+    finite_smoothed = np.where(np.isfinite(flux_smoothed), flux_smoothed,
+                               -np.inf)
+    idx_b = blue[np.argmax(finite_smoothed[:, blue], axis=1)]
+    idx_r = red[np.argmax(finite_smoothed[:, red], axis=1)]
+
+    out['flag'] = ((idx_b == blue[0]) | (idx_b == blue[-1])
+                   | (idx_r == red[0]) | (idx_r == red[-1])).astype(float)
+
+    w_b, w_r = wavelength[idx_b], wavelength[idx_r]
+    f_b, f_r = flux_smoothed[rows, idx_b], flux_smoothed[rows, idx_r]
+    slope = np.where(w_r > w_b, (f_r - f_b) / np.where(w_r > w_b, w_r - w_b,
+                     1.), 0.)
+    pseudo_flux = f_b[:, None] + slope[:, None] * (w[None, :] - w_b[:, None])
+
+    inside = ((cols[None, :] >= idx_b[:, None])
+              & (cols[None, :] <= idx_r[:, None]))
+
+    delta_wavelength = np.gradient(w)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out['pEW'] = np.sum(np.where(
+          inside, (1. - f / pseudo_flux) * delta_wavelength[None, :], 0.),
+          axis=1)
+
+        #Velocity and depth are measured at the minimum of the smoothed flux.
+        idx_min = np.argmin(np.where(inside, f_smot, np.inf), axis=1)
+        ratio = (w[idx_min] / window['rest'])**2.
+        out['velocity'] = c_kms * (ratio - 1.) / (ratio + 1.) / 1.e3
+        out['depth'] = (1. - f_smot[rows, idx_min]
+                        / pseudo_flux[rows, idx_min])
+
+        #FWHM is the distance between the points, on either side of the
+        #minimum, where the smoothed flux crosses half the depth below the
+        #pseudo-continuum. Crossings are interpolated between pixels.
+        level = 1. - out['depth'] / 2.
+        ratio_flux = f_smot / pseudo_flux
+        position = np.arange(len(cols))[None, :]
+        above = inside & (ratio_flux >= level[:, None])
+        j_b = np.max(np.where(above & (position < idx_min[:, None]),
+                              position, -1), axis=1)
+        j_r = np.min(np.where(above & (position > idx_min[:, None]),
+                              position, len(cols)), axis=1)
+        found = (j_b >= 0) & (j_r < len(cols))
+        j_b = np.clip(j_b, 0, len(cols) - 2)
+        j_r = np.clip(j_r, 1, len(cols) - 1)
+        w_half_b = interpolate_crossing(w, ratio_flux, j_b, j_b + 1, level)
+        w_half_r = interpolate_crossing(w, ratio_flux, j_r - 1, j_r, level)
+        out['FWHM'] = np.where(found, w_half_r - w_half_b, np.nan)
+
+    out['wavelength_b'], out['flux_b'] = w_b, f_b
+    out['wavelength_r'], out['flux_r'] = w_r, f_r
+
+    for var in out.keys():
+        out[var] = np.where(covered, out[var], 1. if var == 'flag' else np.nan)
+    return out
+
+def interpolate_crossing(w, y, j_1, j_2, level):
+    """Wavelength where y crosses level between columns j_1 and j_2 of each
+    row, by linear interpolation.
+    """
+    rows = np.arange(y.shape[0])
+    y_1, y_2 = y[rows, j_1], y[rows, j_2]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = np.where(y_2 != y_1, (level - y_1) / (y_2 - y_1), 0.5)
+    return w[j_1] + np.clip(fraction, 0., 1.) * (w[j_2] - w[j_1])
+
+class Batch_Uncertainty(object):
+    """Compute the uncertainty of the spectral features through Monte Carlo
+    realizations of the noise. Unlike 'Compute_Uncertainty' in tardistools,
+    all the realizations of a spectrum are stored as a 2-D (runs x pixels)
+    array and analysed with array operations.
+
+    Parameters
+    ----------
+    D : ~dict
+        Dictionary returned by 'Analyse_Spectra'. Must contain the
+        'wavelength_corr' and 'flux_normalized' keys.
+    smoothing_window : ~int
+        Savitzky-Golay window, in pixels. Should match the value used to
+        compute the features.
+    N_MC_runs : ~int
+        Number of noise realizations.
+    chunk_size : ~int
+        Maximum number of realizations held in memory at once.
+    seed : ~int
+        Seed of the random number generator. Default is None.
+    features : ~list
+        Features (e.g. ['6', '7']) for which uncertainties are computed.
+        Default is None, which uses all nine features.
+    rtol : ~float
+        If given, realizations are drawn in chunks until the uncertainty of
+        every quantity of a feature changes by less than rtol (relative)
+        between consecutive chunks and its relative standard error is also
+        below rtol. N_MC_runs is then the upper limit and the number of runs
+        used for each feature is stored as 'N_MC_runs_f<n>'.
+        Default is None, which always does N_MC_runs runs.
+    min_runs : ~int
+        Minimum number of runs before convergence is checked. Only used if
+        rtol is given.
+
+    Notes
+    -----
+    The realizations are drawn around the smoothed spectrum, using the running
+    rms of the residuals as the noise of each pixel. The uncertainty of each
+    quantity is the standard deviation across realizations and is stored under
+    the same keys used by 'Compute_Uncertainty' (e.g. 'pEW_unc_f7').
+    The features of each realization are measured by 'compute_feature_block',
+    not by 'Analyse_Spectra', so the two modes are not interchangeable until
+    they agree on reference spectra (see 'validate_uncertainties').
+    """
+
+    def __init__(self, D, smoothing_window=21, N_MC_runs=3000,
+                 chunk_size=500, seed=None, features=None, rtol=None,
+                 min_runs=300):
+        self.D = D
+        self.smoothing_window = smoothing_window
+        self.N_MC_runs = N_MC_runs
+        self.chunk_size = chunk_size
+        self.features = feature_keys if features is None else features
+        self.rtol = rtol
+        self.min_runs = min_runs
+        self.random = np.random.RandomState(seed)
+
+        self.wavelength = np.asarray(D['wavelength_corr']).astype(np.float)
+        self.flux = np.asarray(D['flux_normalized']).astype(np.float)
+        self.flux_smoothed = smooth_block(self.flux, self.smoothing_window)
+        self.flux_rms = compute_flux_rms(self.flux, self.flux_smoothed,
+                                         self.smoothing_window)
+
+    def compute_mock_block(self, N):
+        """Return N noise realizations, as observed and smoothed fluxes."""
+        mock_flux = (self.flux_smoothed[None, :] + self.flux_rms[None, :]
+                     * self.random.standard_normal((N, len(self.flux))))
+        return mock_flux, smooth_block(mock_flux, self.smoothing_window)
+
+    def compute_chunk(self, N, keys):
+        """Analyse N realizations and return the features of every run."""
+        mock_flux, mock_smoothed = self.compute_mock_block(N)
+        return dict((key, compute_feature_block(
+          self.wavelength, mock_flux, mock_smoothed, key)) for key in keys)
+
+    def compute_std(self, samples):
+        """Standard deviation of each quantity over the runs done so far."""
+        std = {}
+        for var, chunks in samples.items():
+            values = np.concatenate(chunks)
+            if np.all(np.isnan(values)):
+                std[var] = np.nan
+            else:
+                std[var] = np.nanstd(values)
+        return std
+
+    def compute_std_error(self, samples):
+        """Relative standard error of the standard deviation of each quantity,
+        sqrt((kurtosis - 1) / 4N), which is sqrt(1 / 2N) for gaussian noise.
+        """
+        std_error = {}
+        for var, chunks in samples.items():
+            values = np.concatenate(chunks)
+            values = values[~np.isnan(values)]
+            m2 = np.mean((values - np.mean(values))**2.) if len(values) else 0.
+            if m2 > 0.:
+                kurtosis = np.mean((values - np.mean(values))**4.) / m2**2.
+                std_error[var] = np.sqrt(max(kurtosis - 1., 0.)
+                                         / (4. * len(values)))
+            else:
+                std_error[var] = 0.
+        return std_error
+
+    def is_stable(self, std_old, std_new, std_error):
+        """Check whether every quantity changed by less than rtol since the
+        last chunk and whether its expected fluctuation is below rtol.
+        """
+        for var in std_new.keys():
+            old, new = std_old[var], std_new[var]
+            if np.isnan(old) and np.isnan(new):
+                continue
+            if not abs(new - old) <= self.rtol * abs(old):
+                return False
+            if std_error[var] > self.rtol:
+                return False
+        return True
+
+    def run_uncertainties(self):
+        samples = dict((key, {'pEW': [], 'velocity': [], 'depth': []})
+                       for key in self.features)
+        std_previous, N_converged = {}, {}
+
+        N_done = 0
+        while (N_done < self.N_MC_runs
+               and len(N_converged) < len(self.features)):
+            
+            #Features which have already converged are no longer computed.
+            keys = [key for key in self.features if key not in N_converged]
+            N = min(self.chunk_size, self.N_MC_runs - N_done)
+            for key, out in self.compute_chunk(N, keys).items():
+                for var in samples[key].keys():
+                    samples[key][var].append(out[var])
+            N_done += N
+
+            if self.rtol is not None and N_done >= self.min_runs:
+                for key in keys:
+                    std = self.compute_std(samples[key])
+                    if (key in std_previous and self.is_stable(
+                      std_previous[key], std,
+                      self.compute_std_error(samples[key]))):
+                        N_converged[key] = N_done
+                    std_previous[key] = std
+
+        for key in self.features:
+            for var, std in self.compute_std(samples[key]).items():
+                self.D[var + '_unc_f' + key] = std
+            if self.rtol is not None:
+                self.D['N_MC_runs_f' + key] = N_converged.get(key, N_done)
+
+        return self.D
+
+class Batch_Features(object):
+    """Compute the features of a batch of spectra at once. This is a native
+    alternative to calling 'Analyse_Spectra' in tardistools for every
+    spectrum: the spectra are resampled onto a common rest frame grid and the
+    nine features of every spectrum are measured with array operations over
+    the resulting (spectra x pixels) array (see 'compute_feature_block').
+
+    Parameters
+    ----------
+    list_wavelength : ~list
+        Wavelength array of each spectrum.
+    list_flux : ~list
+        Flux array of each spectrum.
+    list_redshift : ~list
+        Redshift of each spectrum. Default is None (zero for all spectra).
+    smoothing_window : ~int
+        Savitzky-Golay window, in pixels of each spectrum.
+    wavelength_grid : ~np.array
+        Common rest frame grid. Default is None, which uses 'default_grid'.
+    deredshift_and_normalize : ~bool
+        If True (default), each spectrum is de-redshifted and divided by its
+        mean flux. If False, the spectra are taken to be de-redshifted and
+        normalized already, e.g. the 'wavelength_corr' and 'flux_normalized'
+        arrays of a previous analysis.
+
+    Notes
+    -----
+    Each spectrum is smoothed on its own pixels, so that smoothing_window has
+    the same meaning as in 'Analyse_Spectra', and both the flux and the
+    smoothed flux are then interpolated onto the grid. The features do not
+    depend on the normalization, since every quantity is measured relative to
+    the pseudo-continuum. Spectra shorter than the smoothing window get nan
+    features.
+    """
+
+    def __init__(self, list_wavelength, list_flux, list_redshift=None,
+                 smoothing_window=21, wavelength_grid=None,
+                 deredshift_and_normalize=True):
+        self.list_wavelength = list_wavelength
+        self.list_flux = list_flux
+        if list_redshift is None:
+            list_redshift = [0.] * len(list_flux)
+        self.list_redshift = list_redshift
+        self.smoothing_window = smoothing_window
+        if wavelength_grid is None:
+            wavelength_grid = default_grid
+        self.wavelength_grid = np.asarray(wavelength_grid, dtype=float)
+        self.deredshift_and_normalize = deredshift_and_normalize
+
+    def prepare_spectrum(self, wavelength, flux, redshift):
+        """De-redshift, normalize and smooth a spectrum on its own pixels."""
+        wavelength = np.asarray(wavelength).astype(np.float)
+        flux = np.asarray(flux).astype(np.float)
+        if self.deredshift_and_normalize:
+            wavelength = wavelength / (1. + redshift)
+            flux = flux / np.mean(flux)
+        if len(flux) > self.smoothing_window:
+            flux_smoothed = smooth_block(flux, self.smoothing_window)
+        else:
+            flux_smoothed = np.full(len(flux), np.nan)
+        return wavelength, flux, flux_smoothed
+
+    def run_analysis(self):
+        """Return a list with one dictionary per spectrum, with the same keys
+        as the output of 'Analyse_Spectra' (e.g. 'wavelength_corr',
+        'flux_normalized', 'flux_smoothed', 'pEW_f7', 'pEW_flag_f7') plus
+        'FWHM_f<n>' and the pseudo-continuum end points (e.g.
+        'wavelength_b_f7', 'flux_r_f7').
+        """
+        list_D = []
+        for wavelength, flux, redshift in zip(
+          self.list_wavelength, self.list_flux, self.list_redshift):
+            wavelength, flux, flux_smoothed = self.prepare_spectrum(
+              wavelength, flux, redshift)
+            list_D.append({'wavelength_corr': wavelength,
+                           'flux_normalized': flux,
+                           'flux_smoothed': flux_smoothed})
+        if not list_D:
+            return list_D
+
+        flux_block = resample_block(
+          [D['wavelength_corr'] for D in list_D],
+          [D['flux_normalized'] for D in list_D], self.wavelength_grid)
+        smoothed_block = resample_block(
+          [D['wavelength_corr'] for D in list_D],
+          [D['flux_smoothed'] for D in list_D], self.wavelength_grid)
+
+        for key in feature_keys:
+            out = compute_feature_block(
+              self.wavelength_grid, flux_block, smoothed_block, key)
+            out['pEW_flag'] = out.pop('flag')
+            for var, values in out.items():
+                for D, value in zip(list_D, values):
+                    D[var + '_f' + key] = float(value)
+        return list_D
+
+def compare_features(list_D, list_reference, keys=feature_keys,
+                     variables=['pEW', 'velocity', 'depth']):
+    """Differences between two sets of features of the same spectra. See
+    'validate_engine' for the columns of the returned dataframe.
+    """
+    rows, index = [], []
+    for key in keys:
+        for var in variables:
+            name = var + '_f' + key
+            reference = np.array([D.get(name, np.nan) for D in list_reference],
+                                 dtype=float)
+            values = np.array([D.get(name, np.nan) for D in list_D],
+                              dtype=float)
+            both = np.isfinite(reference) & np.isfinite(values)
+            diff = np.abs(values[both] - reference[both])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                rel_diff = diff / np.abs(reference[both])
+            row = {'N': int(np.sum(both)), 'N_mismatch': int(np.sum(
+              np.isfinite(reference) != np.isfinite(values)))}
+            for label, diffs in [('abs', diff), ('rel', rel_diff)]:
+                diffs = diffs[np.isfinite(diffs)]
+                row['median_' + label] = (np.median(diffs) if len(diffs)
+                                          else np.nan)
+                row['max_' + label] = np.max(diffs) if len(diffs) else np.nan
+            rows.append(row)
+            index.append(name)
+    return pd.DataFrame(rows, index=index, columns=[
+      'N', 'N_mismatch', 'median_abs', 'max_abs', 'median_rel', 'max_rel'])
+
+def validate_engine(list_D, smoothing_window, wavelength_grid=None,
+                    variables=['pEW', 'velocity', 'depth']):
+    """Compare the native engine ('Batch_Features') with the features
+    computed by 'Analyse_Spectra' for a reference set of spectra.
+
+    Parameters
+    ----------
+    list_D : ~list
+        Dictionaries returned by 'Analyse_Spectra', e.g. the rows of the
+        BSNIP output. They must contain 'wavelength_corr', 'flux_normalized'
+        and the features to be compared.
+    smoothing_window : ~int
+        Savitzky-Golay window used to compute the reference features.
+    wavelength_grid : ~np.array
+        Grid of the native engine. Default is None, see 'Batch_Features'.
+    variables : ~list
+        Quantities compared for each feature.
+
+    Returns
+    -------
+    Dataframe with one row per quantity (e.g. 'pEW_f7') containing the number
+    of spectra where both values are finite ('N'), the number where only one
+    of them is ('N_mismatch'), and the median and maximum absolute and
+    relative differences.
+    """
+    list_native = Batch_Features(
+      [D['wavelength_corr'] for D in list_D],
+      [D['flux_normalized'] for D in list_D],
+      smoothing_window=smoothing_window, wavelength_grid=wavelength_grid,
+      deredshift_and_normalize=False).run_analysis()
+    return compare_features(list_native, list_D, variables=variables)
+
+def gaussian(wavelength, center, sigma):
+    return np.exp(-0.5 * ((wavelength - center) / sigma)**2.)
+
+def reference_model(wavelength, p):
+    """Flux of a reference spectrum with parameters p, see
+    'make_reference_spectra'.
+    """
+    continuum = 1. + p['slope'] * (wavelength - p['center'])
+    return continuum * (
+      1. + p['height_b'] * gaussian(wavelength, p['center_b'], p['sigma_b'])
+      + p['height_r'] * gaussian(wavelength, p['center_r'], p['sigma_r'])
+      - p['depth'] * gaussian(wavelength, p['center'], p['sigma']))
+
+def measure_reference_line(wavelength, flux, key):
+    """pEW, velocity and depth of the line of a noiseless reference spectrum
+    sampled on a fine grid, by direct integration.
+    """
+    window = feature_windows[key]
+    idx = []
+    for region in ['blue', 'red']:
+        inside = np.where((wavelength >= window[region][0])
+                          & (wavelength <= window[region][1]))[0]
+        idx.append(inside[np.argmax(flux[inside])])
+    w, f = wavelength[idx[0]:idx[1] + 1], flux[idx[0]:idx[1] + 1]
+    pseudo_flux = f[0] + (f[-1] - f[0]) * (w - w[0]) / (w[-1] - w[0])
+    i_min = np.argmin(f)
+    ratio = (w[i_min] / window['rest'])**2.
+    return {'pEW_f' + key: np.trapz(1. - f / pseudo_flux, w),
+            'velocity_f' + key: c_kms * (ratio - 1.) / (ratio + 1.) / 1.e3,
+            'depth_f' + key: 1. - f[i_min] / pseudo_flux[i_min]}
+
+def make_reference_spectra(key, N_spectra=5, seed=0, noise=0.):
+    """Normalized spectra with a Gaussian absorption line between the
+    pseudo-continuum regions of a feature. The continuum is sloped and has
+    a Gaussian bump inside each region, so that the pseudo-continuum points
+    are the single local maximum of each region rather than its edges.
+
+    Returns
+    -------
+    List of dictionaries with 'wavelength_corr' (1 angstrom pixels),
+    'flux_normalized' and the 'pEW_f<key>', 'velocity_f<key>' and
+    'depth_f<key>' of the line. If noise is given, Gaussian noise with that
+    rms is added to the flux.
+
+    Notes
+    -----
+    The features are measured on the noiseless spectrum sampled every 0.01
+    angstrom (see 'measure_reference_line'), so they do not depend on the
+    pixels or the smoothing of the engine being checked.
+    """
+    rng = np.random.RandomState(seed)
+    window = feature_windows[key]
+    wavelength = np.arange(3300., 9000., 1.)
+    fine_wavelength = np.arange(window['blue'][0], window['red'][1], 0.01)
+    list_D = []
+    for i in range(N_spectra):
+        p = {}
+        for region in ['blue', 'red']:
+            w_1, w_2 = window[region]
+            p['center_' + region[0]] = w_1 + (w_2 - w_1) * rng.uniform(0.3,
+                                                                       0.7)
+            p['height_' + region[0]] = rng.uniform(0.1, 0.3)
+            p['sigma_' + region[0]] = rng.uniform(15., 30.)
+        p['center'] = (0.5 * (p['center_b'] + p['center_r'])
+                       + rng.uniform(-10., 10.))
+        p['slope'] = rng.uniform(-2.e-4, 2.e-4)
+        p['depth'], p['sigma'] = rng.uniform(0.2, 0.6), rng.uniform(10., 18.)
+
+        flux = reference_model(wavelength, p)
+        if noise:
+            flux += noise * rng.standard_normal(len(wavelength))
+        D = {'wavelength_corr': wavelength, 'flux_normalized': flux}
+        D.update(measure_reference_line(
+          fine_wavelength, reference_model(fine_wavelength, p), key))
+        list_D.append(D)
+    return list_D
+
+def validate_reference(analyse, reference=None,
+                       variables=['pEW', 'velocity', 'depth']):
+    """Compare the features measured by an engine on the spectra from
+    'make_reference_spectra', feature by feature.
+
+    Parameters
+    ----------
+    analyse : ~function
+        Takes the list of reference dictionaries and returns a dictionary of
+        features for each, e.g. 'analyse_native'.
+    reference : ~function
+        Same as analyse, for the engine used as reference. Default is None,
+        which compares with the values of 'make_reference_spectra'.
+
+    Returns
+    -------
+    Dataframe as in 'validate_engine'.
+    """
+    list_validation = []
+    for key in feature_keys:
+        list_reference = make_reference_spectra(key)
+        if reference is not None:
+            list_reference = reference(list_reference)
+        list_validation.append(compare_features(
+          analyse(list_reference), list_reference, keys=[key],
+          variables=variables))
+    return pd.concat(list_validation)
+
+def analyse_native(list_D, smoothing_window=21):
+    return Batch_Features(
+      [D['wavelength_corr'] for D in list_D],
+      [D['flux_normalized'] for D in list_D],
+      smoothing_window=smoothing_window,
+      deredshift_and_normalize=False).run_analysis()
+
+def analyse_tardistools(list_D, smoothing_window=21):
+    import tardis.tardistools.compute_features as cp
+    return [cp.Analyse_Spectra(
+      wavelength=D['wavelength_corr'], flux=D['flux_normalized'],
+      redshift=0., extinction=0., smoothing_window=smoothing_window,
+      deredshift_and_normalize=False).run_analysis() for D in list_D]
+
+def validate_uncertainties(list_D, smoothing_window=21, N_MC_runs=1000,
+                           seed=0, keys=feature_keys):
+    """Compare the uncertainties of 'Batch_Uncertainty' with those of
+    'Compute_Uncertainty' in tardistools, for the same spectra.
+
+    Parameters
+    ----------
+    list_D : ~list
+        Dictionaries with the 'wavelength_corr' and 'flux_normalized' of
+        each spectrum, e.g. from 'make_reference_spectra' with noise.
+    smoothing_window : ~int
+        Savitzky-Golay window, in pixels.
+    N_MC_runs : ~int
+        Number of realizations of each engine.
+    seed : ~int
+        Seed of both engines. 'Compute_Uncertainty' draws from the global
+        numpy generator, which is seeded before each spectrum.
+    keys : ~list
+        Features compared.
+
+    Returns
+    -------
+    Dataframe as in 'validate_engine', for 'pEW_unc' and 'velocity_unc',
+    with 'Compute_Uncertainty' as the reference.
+    """
+    import tardis.tardistools.compute_features as cp
+    list_batched, list_reference = [], []
+    for D in list_D:
+        D = cp.Analyse_Spectra(
+          wavelength=D['wavelength_corr'], flux=D['flux_normalized'],
+          redshift=0., extinction=0., smoothing_window=smoothing_window,
+          deredshift_and_normalize=False).run_analysis()
+        np.random.seed(seed)
+        list_reference.append(cp.Compute_Uncertainty(
+          D=dict(D), smoothing_window=smoothing_window,
+          N_MC_runs=N_MC_runs).run_uncertainties())
+        list_batched.append(Batch_Uncertainty(
+          D=dict(D), smoothing_window=smoothing_window, N_MC_runs=N_MC_runs,
+          seed=seed).run_uncertainties())
+    return compare_features(list_batched, list_reference, keys=keys,
+                            variables=['pEW_unc', 'velocity_unc'])
+
+def check_validation(validation, tolerances=validation_tolerances):
+    """Return a list describing every difference in a validation dataframe
+    (see 'validate_engine') that exceeds the tolerances, which are given per
+    quantity (e.g. 'pEW') as in validation_tolerances. An empty list means
+    that the validation passed.
+    """
+    failures = []
+    for name, row in validation.iterrows():
+        var = name.rsplit('_f', 1)[0]
+        for column, tolerance in sorted(tolerances.get(var, {}).items()):
+            if row[column] > tolerance:
+                failures.append(name + ': ' + column + ' = ' + '%.4g'
+                                % row[column] + ' > ' + str(tolerance))
+    return failures
+
+def report_validation(title, validation, out_fp,
+                      tolerances=validation_tolerances):
+    """Print and write a validation dataframe and return its failures."""
+    print '\n*' + title
+    print validation.to_string()
+    validation.to_csv(out_fp)
+    failures = check_validation(validation, tolerances)
+    for failure in failures:
+        print '  -FAILED: ' + failure
+    if not failures:
+        print '  -PASSED.'
+    return failures
+
+if __name__ == '__main__':
+    #Check the native engine against the features of the reference
+    #spectra (and so does Analyse_Spectra, if tardis is available), or
+    #against the features of a BSNIP run, e.g.
+    #python batch_features.py validate
+    #python batch_features.py validate BSNIP 51
+    #The uncertainties of 'Batch_Uncertainty' are checked against
+    #'Compute_Uncertainty' (which requires tardis) on noisy reference
+    #spectra with
+    #python batch_features.py validate uncertainties
+    #The exit status is 1 if any difference exceeds the tolerances.
+    if len(sys.argv) < 2 or sys.argv[1] != 'validate':
+        print 'Usage: python batch_features.py validate [filename] [window]'
+        sys.exit(1)
+    out_fp = './../OUTPUT_FILES/'
+    failures = []
+
+    if sys.argv[2:] == ['uncertainties']:
+        failures += report_validation(
+          'VALIDATING BATCH_UNCERTAINTY AGAINST COMPUTE_UNCERTAINTY.',
+          pd.concat([validate_uncertainties(
+            make_reference_spectra(key, N_spectra=3, noise=0.02),
+            keys=[key]) for key in feature_keys]),
+          out_fp + 'uncertainty_validation.csv', uncertainty_tolerances)
+    elif len(sys.argv) == 2:
+        failures += report_validation(
+          'VALIDATING NATIVE ENGINE ON REFERENCE SPECTRA.',
+          validate_reference(analyse_native),
+          out_fp + 'reference_native_validation.csv')
+        try:
+            import tardis.tardistools.compute_features
+        except ImportError:
+            print '\n*SKIPPING ANALYSE_SPECTRA: tardis is not available.'
+        else:
+            failures += report_validation(
+              'VALIDATING ANALYSE_SPECTRA ON REFERENCE SPECTRA.',
+              validate_reference(analyse_tardistools),
+              out_fp + 'reference_tardistools_validation.csv')
+            failures += report_validation(
+              'VALIDATING NATIVE ENGINE AGAINST ANALYSE_SPECTRA.',
+              validate_reference(analyse_native, analyse_tardistools),
+              out_fp + 'reference_engine_validation.csv')
+    else:
+        from BSNIP_columns import read_columns
+
+        filename = sys.argv[2]
+        smoothing_window = int(sys.argv[3]) if len(sys.argv) > 3 else 51
+        variables = ['pEW', 'velocity', 'depth']
+        df = read_columns(
+          out_fp + filename, skip_missing=True,
+          columns=['wavelength_corr', 'flux_normalized'] + [
+          var + '_f' + key for var in variables for key in feature_keys])
+        list_D = [row for row in df.to_dict('records')
+                  if isinstance(row.get('wavelength_corr'), np.ndarray)]
+        failures += report_validation(
+          'VALIDATING NATIVE ENGINE ON ' + str(len(list_D)) + ' SPECTRA.',
+          validate_engine(list_D, smoothing_window, variables=variables),
+          out_fp + filename + '_engine_validation.csv')
+    sys.exit(1 if failures else 0)
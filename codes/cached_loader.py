@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+
+import os
+import cPickle
+import threading
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+def read_pickle(fpath):
+    with open(fpath, 'rb') as inp:
+        return cPickle.load(inp)
+
+class Frozen_Dict(dict):
+    """Dictionary which cannot be modified. A modifiable copy is obtained
+    with dict(D).
+    """
+
+    def read_only(self, *args, **kwargs):
+        raise TypeError('Cached objects are read-only. Use dict(D) to obtain'
+                        ' a modifiable copy.')
+
+    __setitem__ = __delitem__ = read_only
+    clear = pop = popitem = setdefault = update = read_only
+
+    def __reduce__(self):
+        return (Frozen_Dict, (dict(self),))
+
+def freeze(obj):
+    """Make a loaded object read-only, so that it can be shared by every
+    caller. Dictionaries become 'Frozen_Dict' and numpy arrays (including
+    quantities) are flagged as not writeable, also inside dictionaries,
+    lists and tuples. Other objects (e.g. dataframes) are shared as they are
+    and must not be modified.
+    """
+    if isinstance(obj, np.ndarray):
+        obj.setflags(write=False)
+    elif isinstance(obj, dict):
+        obj = Frozen_Dict((key, freeze(value)) for key, value in obj.items())
+    elif isinstance(obj, tuple):
+        obj = tuple(freeze(value) for value in obj)
+    elif isinstance(obj, list):
+        for i, value in enumerate(obj):
+            obj[i] = freeze(value)
+    return obj
+
+class Cached_Loader(object):
+    """Least recently used cache of the objects read from files.
+
+    Parameters
+    ----------
+    max_bytes : ~float
+        Maximum total size, measured as the size of the files on disk, of the
+        cached objects. When exceeded, the least recently used objects are
+        evicted. Default is 2GB.
+    max_items : ~int
+        Maximum number of cached objects. Default is 512.
+
+    Notes
+    -----
+    Entries are keyed by the absolute path of the file and by the reader
+    used to deserialize it. A file is read again if its modification time or
+    size changed since it was cached. The number of hits, misses and
+    evictions is recorded, see 'get_stats'.
+    """
+
+    def __init__(self, max_bytes=2.e9, max_items=512):
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self.entries = OrderedDict()
+        self.N_bytes = 0
+        self.N_hits, self.N_misses, self.N_evictions = 0, 0, 0
+        self.lock = threading.Lock()
+
+    def load(self, fpath, reader=read_pickle):
+        """Read-only object read from fpath by reader (a function of the
+        path), which is only called if the file is not cached.
+        """
+        stat = os.stat(fpath)
+        key = (os.path.abspath(fpath), reader)
+        signature = (stat.st_mtime, stat.st_size)
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None and entry[0] == signature:
+                self.entries[key] = entry
+                self.N_hits += 1
+                return entry[1]
+            if entry is not None:
+                self.N_bytes -= entry[0][1]
+            self.N_misses += 1
+
+        obj = freeze(reader(fpath))
+        if stat.st_size > self.max_bytes:
+            return obj
+        with self.lock:
+            if key in self.entries:
+                self.N_bytes -= self.entries.pop(key)[0][1]
+            self.entries[key] = (signature, obj)
+            self.N_bytes += stat.st_size
+            while (self.N_bytes > self.max_bytes
+                   or len(self.entries) > self.max_items):
+                self.N_bytes -= self.entries.popitem(last=False)[1][0][1]
+                self.N_evictions += 1
+        return obj
+
+    def get_stats(self):
+        with self.lock:
+            return {'N_hits': self.N_hits, 'N_misses': self.N_misses,
+                    'N_evictions': self.N_evictions,
+                    'N_items': len(self.entries), 'N_bytes': self.N_bytes}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.N_bytes = 0
+
+#Process-wide cache shared by every script.
+loader = Cached_Loader()
+
+def load(fpath, reader=read_pickle):
+    """Read-only object stored in fpath (a pickle by default), which is only
+    deserialized once per process. See 'Cached_Loader'.
+    """
+    return loader.load(fpath, reader)
+
+class Prefetched(object):
+    """Read-only sequence of objects which are being loaded in the
+    background. Accessing an item only waits for that item, so that the
+    first objects can be used while the others are still loading.
+    """
+
+    def __init__(self, results, pool=None):
+        self.results = results
+        self.pool = pool
+
+    def join(self):
+        """Wait until every object is loaded and the loading threads have
+        exited, e.g. before the process is forked.
+        """
+        if self.pool is not None:
+            self.pool.join()
+
+    def __len__(self):
+        return len(self.results)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return Prefetched(self.results[i])
+        return self.results[i].get()
+
+    def __iter__(self):
+        for result in self.results:
+            yield result.get()
+
+def prefetch(fpaths, loader=load, N_threads=8):
+    """Load a list of files on a pool of N_threads threads.
+
+    Parameters
+    ----------
+    fpaths : ~list
+        Paths of the files, all of which are requested at once.
+    loader : ~function
+        Function of the path which returns the loaded object. Default is
+        'load', so that each file is only read once per process.
+    N_threads : ~int
+        Maximum number of files read at the same time.
+
+    Returns
+    -------
+    'Prefetched' sequence with the object loaded from each path, in the
+    same order. Exceptions raised by loader are raised when the item is
+    accessed. The threads exit once every file is loaded; call 'join' on
+    the sequence to wait for them.
+
+    Notes
+    -----
+    Reading from disk (or from a network mount) releases the GIL, so the
+    reads overlap with each other and with the plotting done by the main
+    thread.
+    """
+    #Paths requested more than once are only read once.
+    distinct = list(OrderedDict.fromkeys(fpaths))
+    pool = ThreadPool(max(1, min(N_threads, len(distinct))))
+    results = dict((fpath, pool.apply_async(loader, (fpath,)))
+                   for fpath in distinct)
+    pool.close()
+    return Prefetched([results[fpath] for fpath in fpaths], pool)
+
+def get_stats():
+    return loader.get_stats()
+
+def print_stats():
+    stats = get_stats()
+    print ('  -CACHED LOADER: ' + str(stats['N_hits']) + ' hits, '
+           + str(stats['N_misses']) + ' misses, ' + str(stats['N_evictions'])
+           + ' evictions, ' + str(stats['N_items']) + ' files cached ('
+           + format(stats['N_bytes'] / 1.e6, '.1f') + 'MB).')
@@ -1,22 +1,178 @@
 #!/usr/bin/env python
 
 import os                                                               
+import sys
 import time
+import shutil
+import traceback
+import multiprocessing
+import cPickle
+import zlib
+import argparse
+from functools import partial
 
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib as mpl
 import pandas as pd   
-import csv
 from astropy import constants as const
 from matplotlib.ticker import MultipleLocator
 
-import tardis.tardistools.compute_features as cp
+import batch_features
+import window_sweep
+from batch_features import Batch_Uncertainty, Batch_Features
+from BSNIP_columns import write_columns
+from BSNIP_shards import parse_shard, get_shard_filename, assign_shards
+from BSNIP_tables import get_BSNIP_tables, pivot_features
+from ragged_array import Ragged_Array
+from render_BSNIP_figures import Render_Figures
+from progress_reporter import Progress_Reporter
+from result_cache import Result_Cache, get_analysis_version
+from spectra_store import (Spectra_Store, Lazy_Spectra,
+                           parse_spectrum_filename)
+from stage_timing import Stage_Timer
+from window_sweep import compute_window_sweep, make_sweep_table
 
 mpl.rcParams['mathtext.fontset'] = 'stix'
 mpl.rcParams['mathtext.fontset'] = 'stix'
 mpl.rcParams['font.family'] = 'STIXGeneral'
 
+def add_uncertainties(D, smoothing_window, uncertainties=None,
+                      N_MC_runs=3000, seed=None):
+    """Add the uncertainties of the features to the dictionary returned by
+    'Analyse_Spectra'. uncertainties is None, 'loop' (Compute_Uncertainty in
+    tardistools) or 'batched' (Batch_Uncertainty, using the given seed).
+    """
+    if uncertainties == 'loop':
+        import tardis.tardistools.compute_features as cp
+        D = cp.Compute_Uncertainty(
+          D=D, smoothing_window=smoothing_window,
+          N_MC_runs=N_MC_runs).run_uncertainties() 
+    elif uncertainties == 'batched':
+        D = Batch_Uncertainty(
+          D=D, smoothing_window=smoothing_window, N_MC_runs=N_MC_runs,
+          seed=seed).run_uncertainties()
+    return D
+
+def analyse_spectrum(task, smoothing_window=51, uncertainties=None,
+                     N_MC_runs=3000, smoothing_windows=None):
+    """Compute the features of a single BSNIP spectrum. Defined at the module
+    level so that it can be dispatched to worker processes.
+    
+    Parameters
+    ----------
+    task : ~tuple
+        (index, row) where row is a dictionary containing the BSNIP data.
+    smoothing_window : ~int
+        Savitzky-Golay window, in pixels.
+    uncertainties : ~str
+        None, 'loop' (Compute_Uncertainty in tardistools) or 'batched'
+        (Batch_Uncertainty).
+    N_MC_runs : ~int
+        Number of MC runs used to estimate the uncertainties.
+    smoothing_windows : ~list
+        If given, the features are also computed for each of these windows
+        and stored under 'window_sweep' (see 'compute_window_sweep').
+    
+    Returns
+    -------
+    (index, out_row_dict, error, elapsed). If the computation fails,
+    out_row_dict is None and error contains the traceback. elapsed is the
+    time (s) spent on this spectrum.
+    """
+    #tardis is only imported when needed, so that the native engine can run
+    #without it.
+    import tardis.tardistools.compute_features as cp
+    index, row = task
+    time_start = time.time()
+    try:
+        #Note that the passed extinction is zero. The pEW feature **is**
+        #to be computed without correcting for extinction.
+        out_row_dict = cp.Analyse_Spectra(
+          wavelength=row['wavelength_raw'], flux=row['flux_raw'],
+          redshift=row['host_redshift'], extinction=0., D=row,
+          smoothing_window=smoothing_window,
+          deredshift_and_normalize=True).run_analysis()
+
+        #Compute uncertainties. Seeding by ID keeps the output independent
+        #of 'workers' and of which other spectra are processed (see the
+        #result cache).
+        seed = zlib.crc32(row['ID']) & 0xffffffff
+        out_row_dict = add_uncertainties(
+          out_row_dict, smoothing_window, uncertainties, N_MC_runs, seed)
+
+        #The de-redshifted and normalized spectrum is shared by all windows.
+        if smoothing_windows is not None:
+            out_row_dict['window_sweep'] = compute_window_sweep(
+              out_row_dict, smoothing_windows, partial(
+              add_uncertainties, uncertainties=uncertainties,
+              N_MC_runs=N_MC_runs, seed=seed))
+
+    except Exception:
+        return index, None, traceback.format_exc(), time.time() - time_start
+    return index, out_row_dict, None, time.time() - time_start
+
+def analyse_spectra_native(tasks, smoothing_window=51, uncertainties=None,
+                           N_MC_runs=3000):
+    """Compute the features of a batch of BSNIP spectra with the native
+    engine ('Batch_Features'). Same parameters as 'analyse_spectrum', except
+    that tasks is a list of (index, row).
+
+    Returns
+    -------
+    List with (index, out_row_dict, error, elapsed) for each task. elapsed
+    includes an equal share of the time spent on the whole batch.
+    """
+    time_start = time.time()
+    try:
+        list_D = Batch_Features(
+          [row['wavelength_raw'] for (index, row) in tasks],
+          [row['flux_raw'] for (index, row) in tasks],
+          [row['host_redshift'] for (index, row) in tasks],
+          smoothing_window=smoothing_window).run_analysis()
+    except Exception:
+        #Analyse the spectra one by one, so that only the spectrum which
+        #caused the error is reported as failed.
+        if len(tasks) > 1:
+            return [result for task in tasks for result in
+                    analyse_spectra_native([task], smoothing_window,
+                                           uncertainties, N_MC_runs)]
+        return [(tasks[0][0], None, traceback.format_exc(),
+                 time.time() - time_start)]
+    elapsed_batch = (time.time() - time_start) / len(tasks)
+
+    results = []
+    for (index, row), D in zip(tasks, list_D):
+        time_start = time.time()
+        try:
+            out_row_dict = dict(row)
+            out_row_dict.update(D)
+            out_row_dict = add_uncertainties(
+              out_row_dict, smoothing_window, uncertainties, N_MC_runs,
+              zlib.crc32(row['ID']) & 0xffffffff)
+        except Exception:
+            results.append((index, None, traceback.format_exc(),
+                            elapsed_batch + time.time() - time_start))
+            continue
+        results.append((index, out_row_dict, None,
+                        elapsed_batch + time.time() - time_start))
+    return results
+
+def get_analysis_objects():
+    """Modules and functions whose results are stored in the result cache.
+    See 'result_cache.get_analysis_version'.
+    """
+    return [batch_features, window_sweep, analyse_spectrum,
+            analyse_spectra_native, add_uncertainties]
+
+def is_spectrum_array(value):
+    """Whether a value is stored in a Ragged_Array column of the output."""
+    return (isinstance(value, np.ndarray) and value.ndim == 1
+            and value.dtype.kind in 'biuf')
+
+def pickle_round_trip(obj):
+    return cPickle.loads(cPickle.dumps(obj, protocol=cPickle.HIGHEST_PROTOCOL))
+
 class BSNIP_Database(object):
     """Collects data from the the BSNIP program to create a .pkl file with the
     relevant information. Spectral features are re-computed.
@@ -30,27 +186,135 @@ class BSNIP_Database(object):
         The list contains the index of spectra in BSNIP to be processed.
         Default is None and runs through all objects in BSNIP.
         
+    workers : ~int
+        Number of processes used to compute the spectral features. Default
+        is 1, which runs serially. Results are always collected in the
+        original index order, so the output does not depend on this value.
+        
+    uncertainties : ~str
+        How the feature uncertainties are computed. None (default) skips
+        them, 'loop' uses 'Compute_Uncertainty' in tardistools and 'batched'
+        uses the vectorized Monte Carlo in 'batch_features'. The latter
+        measures the features of each realization with its own
+        pseudo-continuum code (see 'batch_features.compute_feature_block').
+        It becomes the default once it passes 'python batch_features.py
+        validate uncertainties', its comparison with 'Compute_Uncertainty'.
+        
+    N_MC_runs : ~int
+        Number of MC runs used for the uncertainties. Default is 3000.
+        
+    cache : ~bool
+        If True (default), the features computed for each spectrum are
+        stored in a result cache and spectra which are already in the cache
+        are not computed again. See 'result_cache'.
+        
+    output_format : ~str
+        'pickle' writes the whole dataframe to '<filename>.pkl'. 'columns'
+        writes one file per column to '<filename>.cols/', from which
+        individual columns can be read with 'BSNIP_columns.read_columns'.
+        'both' (default) writes both.
+        
+    shard_size : ~int
+        If given, results are written to disk every shard_size spectra (see
+        'compute_observables'), so that memory does not grow with the number
+        of spectra and a failed run can be resumed. Default is None.
+        
+    resume : ~bool
+        If True, shards written by a previous run with the same spectra and
+        parameters are not computed again. Only used if shard_size is given.
+        Default is False.
+        
+    smoothing_windows : ~list
+        If given, the features of every spectrum are also computed for each
+        of these smoothing windows and written to a table indexed by (ID,
+        window), '<filename>_sweep.pkl'. The spectrum is only loaded,
+        de-redshifted and normalized once for all the windows. Default is
+        None.
+        
+    shard : ~str
+        'i/n' only computes the i-th (from 0 to n-1) of n shards of the
+        catalog and writes it to '<filename>.shard-i-of-n.pkl'. Spectra are
+        assigned to shards so that their total number of pixels is balanced.
+        The shards are then combined with 'BSNIP_shards.merge_shards'.
+        Default is None, which computes all the spectra.
+        
+    engine : ~str
+        'tardistools' (default) computes the features of each spectrum with
+        'Analyse_Spectra'. 'native' computes them for batches of
+        native_batch_size spectra at once with 'Batch_Features', which also
+        provides the FWHM of each feature. The two engines can be compared
+        with 'batch_features.validate_engine'. The native engine does not
+        support smoothing_windows. It is not offered on the command line
+        until it passes 'python batch_features.py validate BSNIP 51' on a
+        BSNIP run computed with 'Analyse_Spectra'.
+        
+    batch : ~bool
+        If True, the screen is not cleared and progress is reported as
+        throttled log lines (see 'Progress_Reporter'). Default is None,
+        which uses batch mode unless the output is a terminal.
+        
     Notes
     -----
-    When computing features using our routine, the smoothing window and number
-    of MC runs (used for uncertainties) are currently hard coded in the
-    'compute_observables' functions below. By default:
-    smoothing_window=51, N_MC_runs=3000.
+    When computing features using our routine, the smoothing window is
+    currently hard coded in the constructor. By default: smoothing_window=51.
+    After the features are computed, self.df only holds scalar quantities.
+    Spectrum arrays are kept in self.arrays, one Ragged_Array per quantity
+    with the same row order as self.df (see 'get_output_dataframe').
+    The wall time, CPU time, peak memory and row count of every stage are
+    written to './../OUTPUT_FILES/<filename>_timing.json'.
     """
     
     def __init__(self, filename='BSNIP', subset_objects_idx=None,
-                 make_figures=False):
+                 make_figures=False, workers=1, uncertainties=None,
+                 N_MC_runs=3000, cache=True, output_format='both',
+                 shard_size=None, resume=False, smoothing_windows=None,
+                 shard=None, engine='tardistools', batch=None):
         
+        if engine not in ['tardistools', 'native']:
+            raise ValueError('engine must be "tardistools" or "native".')
+        if engine == 'native' and smoothing_windows is not None:
+            raise ValueError('smoothing_windows requires the tardistools '
+                             'engine.')
+        self.shard = None if shard is None else parse_shard(shard)
+        if self.shard is not None:
+            filename = get_shard_filename(filename, self.shard)
         self.filename = filename
         self.subset_objects_idx = subset_objects_idx
         self.make_figures = make_figures
+        self.workers = workers
+        self.uncertainties = uncertainties
+        self.N_MC_runs = N_MC_runs
+        self.cache = cache
+        self.output_format = output_format
+        self.shard_size = shard_size
+        self.resume = resume
+        self.smoothing_windows = smoothing_windows
+        self.engine = engine
+        self.native_batch_size = 64
+        if batch is None:
+            batch = not sys.stdout.isatty()
+        self.batch = batch
+        self.smoothing_window = 51
+        self.failed = []
                 
-        os.system('clear')      
-        self.time_BSNIP = time.time()
+        if not self.batch:
+            os.system('clear')
+        self.timer = Stage_Timer()
         print '\n*COLLECTING BSNIP DATA.'
         self.BSNIP_fp = './../data/BSNIP_I/'
         self.BSNIP_spectra_fp = self.BSNIP_fp + 'paper_I/Spectra_database/'      
+        self.store_fp = './../OUTPUT_FILES/BSNIP_spectra_store/'
+        self.tables_cache_fp = './../OUTPUT_FILES/BSNIP_tables.pkl'
+        self.result_cache_fp = './../OUTPUT_FILES/BSNIP_result_cache/'
+        self.result_cache = None
+        self.parts_fp = './../OUTPUT_FILES/' + self.filename + '.parts/'
+        self.spectra_files = {}
+        self.spectra = None
+        self.tables = None
         self.df = None
+        self.arrays = {}
+        self.sweep = None
+        self.catalog_IDs, self.shard_IDs = None, None
         
         self.run_BSNIP_database()
    
@@ -68,40 +332,27 @@ class BSNIP_Database(object):
                 os.remove(BSNIP_fp + file_spectra[0:-14] + file_spectra[-4::]) 
 
     #@profile
-    def initialize_dataframe_and_get_spectra(self):
+    def initialize_dataframe(self):
         """Collects information such as the ID and date which are available
-        as part of the BSNIP filenames and information available in the spectra
-        files. Initialises a dictionary where the wavelength, flux, ID and
-        date are stored.
+        as part of the BSNIP filenames. Initialises a dictionary where the ID
+        and date are stored. The spectra themselves are only read after the
+        dataframe has been trimmed, see 'get_spectra'.
+        ---
+        The file of each row is stored in self.spectra_files, keyed by the
+        row index, so that files sharing an ID (SNID|date) each keep their
+        own spectrum. Such IDs are reported.
         """
-        print '  -RUNNING: Retrieving spectra...'  
+        print '  -RUNNING: Initializing dataframe...'  
         list_base, list_index = [], []                                                                
-        for file_spectra in os.listdir(self.BSNIP_spectra_fp):
-            file_name_parts = (file_spectra.rstrip('\n').replace('.flm', '')
-                               .split('-'))
-            try:
-                date = str(format(float(file_name_parts[1]), '.3f'))
-                if len(date) < 7:
-                    date = str(format(float(file_name_parts[2]), '.3f'))
-            except:
-                date = str(format(float(file_name_parts[2]), '.3f')) 
-            SNID = file_name_parts[0].upper()            
-
-            wavelength, flux = [], []
-            with open(self.BSNIP_spectra_fp + file_spectra, 'r') as f:
-                file_contend = csv.reader(f, delimiter=' ')
-                for row in file_contend:
-                    row = filter(None, row)
-                    wavelength.append(float(row[0]))
-                    flux.append(float(row[1]))         
+        for file_spectra in sorted(os.listdir(self.BSNIP_spectra_fp)):
+            SNID, date = parse_spectrum_filename(file_spectra)
             
             #Prep the data that will be stored in the dataframe. In particular,
             #the dataframe indexes will contain the SNID and data to uniquely
             #identify the entries.
             list_index.append(SNID + '|' + date)            
             list_base.append({'SNID': SNID, 'date': date,
-                             'wavelength_raw': np.asarray(wavelength),
-                             'flux_raw': np.asarray(flux)})  
+                              'file': file_spectra})
 
         
         #Set the combination of SNID + date as the dataframe index.
@@ -115,43 +366,37 @@ class BSNIP_Database(object):
         #column, so that the indexes become integers again, but this time in
         #more controlled and ordenated fashion.
         self.df = self.df.reset_index(drop=True)
+        self.spectra_files = self.df.pop('file').to_dict()
+        self.report_duplicate_IDs()
+
+    def report_duplicate_IDs(self):
+        duplicated = self.df['ID'].duplicated(keep=False)
+        for ID in sorted(set(self.df.loc[duplicated, 'ID'])):
+            files = [self.spectra_files[index]
+                     for index in self.df.index[self.df['ID'] == ID]]
+            print ('  -WARNING: ' + ID + ' has several spectrum files ('
+                   + ', '.join(files) + '). Each is kept as a separate row,'
+                   + ' which shifts the phases matched from table 2.')
         
+    def read_tables(self):
+        """Parse the BSNIP tables (or retrieve them from the cache if the
+        table files have not changed). See 'BSNIP_tables'.
+        """
+        print '  -RUNNING: Reading BSNIP tables...'      
+        self.tables = get_BSNIP_tables(self.BSNIP_fp, self.tables_cache_fp)
+
     def read_general_info(self):
         """Get data from table 1 of paper I.
         Includes: subtype, host morfology, host redshift and foreground
         extinction E(B-V). 
         """
         print '  -RUNNING: Retrieving BSNIP spectral data...'      
-        list_base = []
-        with open(self.BSNIP_fp + 'paper_I/table1.dat', 'r') as f:
-            for row in f:
-                
-                SNID = 'SN' + row[3:9].replace(' ', '').upper() 
-                                
-                subtype = row[10:18].replace(' ', '')
-                if subtype == '':
-                    subtype = np.nan                
-                
-                morp = row[50:57].replace(' ', '')
-                if morp == '':
-                    morp = np.nan
-                                    
-                redshift = row[57:63].replace(' ', '')
-                if redshift == '':
-                    redshift = np.nan                
-                else:
-                    redshift = float(redshift) / const.c.to('km/s').value
-                                    
-                extinction = row[63:69].replace(' ', '')
-                if extinction == '':
-                    extinction = np.nan  
-
-                list_base.append({
-                  'SNID': SNID, 'subtype': subtype, 'host_morphology': morp,
-                  'host_redshift': float(redshift),
-                  'foreground_extinction': float(extinction)})
-        
-        df_add_table1 = pd.DataFrame(list_base)
+        df_add_table1 = self.tables['table1'].copy()
+        df_add_table1['host_redshift'] = (
+          df_add_table1['host_redshift'].astype(float)
+          / const.c.to('km/s').value)
+        df_add_table1['foreground_extinction'] = (
+          df_add_table1['foreground_extinction'].astype(float))
         
         self.df = pd.merge(self.df, df_add_table1,
                            on='SNID', how='left').set_index(self.df.index)
@@ -172,38 +417,13 @@ class BSNIP_Database(object):
         But because our routines also sort the table using python, all is fine.
         """
         print '  -RUNNING: Retrieving phases...'      
-        list_base, list_index = [], []                                                                
+        df_add_table2 = self.tables['table2'].copy()
+        df_add_table2['reliable'] = (
+          (df_add_table2['reliable'] == '*').map({True: '0', False: '1'}))
         
-        with open(self.BSNIP_fp + 'paper_I/table2.dat', 'r') as f:
-            for row in f:
-               
-                SNID = 'SN' + row[3:9].replace(' ', '').upper()
-                reliable = row[9:10].replace(' ', '')
-                if reliable == '*':
-                    reliable = '0'
-                else:
-                    reliable = '1'
-                    
-                date = row[11:25].replace(' ', '')
-                date = date.replace('/', '')             
-               
-                phase = row[37:44].replace(' ', '')
-                if phase == '':
-                    phase = np.nan
-                                   
-                wavelength_min = row[47:52].replace(' ', '')            
-                wavelength_max = row[52:59].replace(' ', '')               
-                correction = row[115:116].replace(' ', '')
-              
-                list_index.append(SNID + '|' + date)
-                
-                list_base.append({
-                  'reliable': reliable, 'phase': phase,
-                  'wavelength_min': wavelength_min,
-                  'wavelength_max': wavelength_max,
-                  'flux_correction': correction})
-
-        df_add_table2 = pd.DataFrame(list_base, index=list_index)
+        df_add_table2.index = (df_add_table2['SNID'] + '|'
+                               + df_add_table2['date'])
+        df_add_table2 = df_add_table2.drop(['SNID', 'date'], axis=1)
         df_add_table2 = df_add_table2.sort_index()
         df_add_table2 = df_add_table2.reset_index(drop=True)  
         self.df = self.df.join(df_add_table2)
@@ -213,108 +433,20 @@ class BSNIP_Database(object):
         Includes: Suptype according to Benetti, Branch and Wang schemes.
         """
         print '  -RUNNING: Appending subtypes...'      
-        list_base = []
-        
-        with open(self.BSNIP_fp + 'paper_II/tablea1.dat', 'r') as f:
-            for row in f:
-               
-                SNID = 'SN' + row[3:9].replace(' ', '').replace('\n', '').upper()
-              
-                subtype = row[75:82].replace(' ', '').replace('\n', '')
-                if subtype == '':
-                    subtype = np.nan
-                    
-                type_Benetti = (row[83:89].replace(' ', '').replace('\r', '')
-                                .replace('\n', ''))                
-                if type_Benetti == '':
-                    type_Benetti = np.nan
-
-                type_Branch = row[90:92].replace(' ', '').replace('\n', '')
-                if type_Branch == '':
-                    type_Branch = np.nan
-                                    
-                type_Wang = row[93:95].replace(' ', '').replace('\n', '')
-                if type_Wang == '':
-                    type_Wang = np.nan                 
-                            
-                list_base.append({
-                  'SNID': SNID, 'subtype_II': subtype,
-                  'type_Benetti': type_Benetti,
-                  'type_Branch': type_Branch, 'type_Wang': type_Wang})
-        
-        df_add_tablea1 = pd.DataFrame(list_base)
-        
-        self.df = pd.merge(self.df, df_add_tablea1,
+        self.df = pd.merge(self.df, self.tables['tablea1'],
                            on='SNID', how='left').set_index(self.df.index)         
        
     def read_features(self):
         """Get teh spectral features from table b1-9 of paper II.
         Includes: pEW, velocity, depth, etc...
+        ---
+        The nine tables are stored in a single long format dataframe, which
+        is pivoted so that they can be merged at once.
         """        
         print '  -RUNNING: Appending features...'      
-        phase_list = list(self.df['phase'].tolist())
-        SNID_list = list(self.df['SNID'].tolist())
-                
-        for i in range(9):
-            key = str(i + 1)
-            list_base = []
-            
-            variables = [
-              'SNID', 'phase', 'BSNIP_flux_b_f' + key, 'BSNIP_flux_r_f' + key,
-              'BSNIP_pEW_f' + key, 'BSNIP_pEW_unc_f' + key,
-              'BSNIP_velocity_f' + key, 'BSNIP_velocity_unc_f' + key,
-              'BSNIP_depth_f' + key, 'BSNIP_depth_unc_f' + key,
-              'BSNIP_FWHM_f' + key, 'BSNIP_FWHM_unc_f' + key]
-            
-            with open(self.BSNIP_fp + 'paper_II/tableb' + str(i + 1)
-                      + '.dat', 'r') as f:
-                
-                for row in f:
-                    dv = {}
-                                
-                    dv['SNID'] = ('SN' + row[3:9].replace(' ', '')
-                                  .replace('\n', '').upper())
-                                
-                    dv['phase'] = row[11:17].replace(' ', '').replace('\n', '')
-                    
-                    dv['BSNIP_flux_b_f' + key] = (row[18:24].replace(' ', '')
-                                                .replace('\n', ''))
-                   
-                    dv['BSNIP_flux_r_f' + key] = (row[32:38].replace(' ', '')
-                                                .replace('\n', ''))
-                   
-                    dv['BSNIP_pEW_f' + key]  = (row[46:51].replace(' ', '')
-                                              .replace('\n', ''))
-                   
-                    dv['BSNIP_pEW_unc_f' + key] = (row[53:57].replace(' ', '')
-                                                .replace('\n', '')) 
-                   
-                    dv['BSNIP_velocity_f' + key] = (row[73:78].replace(' ', '')
-                                                  .replace('\n', '')) 
-                   
-                    dv['BSNIP_velocity_unc_f' + key] = (
-                      row[80:84].replace(' ', '').replace('\n', '')) 
-                   
-                    dv['BSNIP_depth_f' + key] = (row[86:91].replace(' ', '')
-                                               .replace('\n', ''))
-                   
-                    dv['BSNIP_depth_unc_f' + key] = (
-                      row[93:98].replace(' ', '').replace('\n', ''))
-                                                   
-                    dv['BSNIP_FWHM_f' + key] = (
-                      row[100:105].replace(' ', '').replace('\n', ''))
-                                              
-                    dv['BSNIP_FWHM_unc_f' + key] = (
-                      row[107:110].replace(' ', '').replace('\n', ''))
-                    
-                    for var in  variables:
-                        if dv[var] == '': dv[var] = np.nan
-                    list_base.append(dv)
-           
-            df_add_tableb = pd.DataFrame(list_base)
-           
-            self.df = pd.merge(self.df, df_add_tableb, on=['SNID','phase'],
-                               how='left').set_index(self.df.index)    
+        df_add_tableb = pivot_features(self.tables['features'])
+        self.df = pd.merge(self.df, df_add_tableb, on=['SNID','phase'],
+                           how='left').set_index(self.df.index)    
         
     def trim_by_phase_and_indexes(self):
         """Remove the spectra whose epoch is nowhere near maximum (i.e. >20d).
@@ -331,62 +463,433 @@ class BSNIP_Database(object):
         self.df = self.df.dropna(subset=['phase'])
         self.df[['phase']] = self.df[['phase']].astype(str)
 
+    def get_spectra(self):
+        """Prepare the loader of the spectra that survived the trimming.
+        Each file is only read when its arrays are first requested.
+        ---
+        When running the whole database, the binary store is (re)built if
+        the spectra files have changed. When running a subset of objects or
+        a shard, an outdated store is not rebuilt (shards may run at the same
+        time) and the spectra needed are read from the text files instead.
+        """
+        print '  -RUNNING: Retrieving spectra...'  
+        store = Spectra_Store(self.BSNIP_spectra_fp, self.store_fp)
+        if self.subset_objects_idx is None and self.shard is None:
+            store.get_spectra()
+        elif store.is_valid():
+            store.load()
+        else:
+            store = None
+        self.spectra = Lazy_Spectra(self.BSNIP_spectra_fp, self.spectra_files,
+                                    store)
+
+    def select_shard(self):
+        """Keep only the spectra assigned to this shard. The assignment only
+        depends on the trimmed catalog, so every shard computes the same one.
+        """
+        if self.shard is None:
+            return
+        i, n = self.shard
+        print '  -SELECTING SHARD ' + str(i) + '/' + str(n) + '...'
+        self.catalog_IDs = self.df['ID'].tolist()
+        costs = [self.spectra.get_N_pixels(index) for index in self.df.index]
+        assignment = assign_shards(self.catalog_IDs, costs, n)
+        self.df = self.df[assignment == i]
+        self.shard_IDs = self.df['ID'].tolist()
+
+    def get_row_dict(self, row):
+        """Dictionary with the data of a row, including its spectrum."""
+        row_dict = row.to_dict()
+        row_dict['wavelength_raw'], row_dict['flux_raw'] = (
+          self.spectra[row.name])
+        return row_dict
+
+
+    def iter_batches(self, tasks):
+        """Group the tasks into lists of native_batch_size tasks."""
+        batch = []
+        for task in tasks:
+            batch.append(task)
+            if len(batch) == self.native_batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
 
     def compute_observables(self):
-        """Use the 'compute_features' routine in 'tardistools' to compute
-        the pEW, velocity and depth of features in BSNIP.
+        """Use the 'compute_features' routine in 'tardistools' (or the
+        native engine, see 'engine') to compute the pEW, velocity and depth
+        of features in BSNIP.
+        ---
+        If shard_size is given, the spectra are processed in shards of that
+        many rows. Each shard is written to './../OUTPUT_FILES/<filename>
+        .parts/' as soon as it is complete and then released from memory.
+        The shards are concatenated once all of them have been computed.
         """
 
         print '  -COMPUTING FEATURES...'       
 
-        #Make directory to store the spectra figures if it does not exist yet.
-        if self.make_figures:
-            top_dir = './../OUTPUT_FILES/' + self.filename + '_FIGURES/'
-            if not os.path.exists(top_dir):
-                os.makedirs(top_dir)
-                
-        out_list_dicts, list_index = [], []
-
+        if self.engine == 'native':
+            analyse_batch = partial(
+              analyse_spectra_native, smoothing_window=self.smoothing_window,
+              uncertainties=self.uncertainties, N_MC_runs=self.N_MC_runs)
+            analyse = lambda task: analyse_batch([task])[0]
+        else:
+            analyse = partial(
+              analyse_spectrum, smoothing_window=self.smoothing_window,
+              uncertainties=self.uncertainties, N_MC_runs=self.N_MC_runs,
+              smoothing_windows=self.smoothing_windows)
+        
+        #Look up every spectrum in the result cache first, so that only the
+        #cache misses are computed. Keys only need the spectrum file's stat,
+        #so the spectra are not read here.
+        version = get_analysis_version(get_analysis_objects())
+        cache, entries = None, []
+        key_parameters = {'smoothing_window': self.smoothing_window,
+                          'uncertainties': self.uncertainties,
+                          'N_MC_runs': self.N_MC_runs}
+        if self.smoothing_windows is not None:
+            key_parameters['smoothing_windows'] = self.smoothing_windows
+        if self.engine != 'tardistools':
+            key_parameters['engine'] = self.engine
+        if self.cache:
+            cache = Result_Cache(self.result_cache_fp, version)
         for index, row in self.df.iterrows():
-                                                
-            print '    -AT INDEX: ' + str(index)
+            key = None
+            if cache is not None:
+                key = cache.make_key(
+                  self.spectra.get_path(index),
+                  host_redshift=row['host_redshift'], ID=row['ID'],
+                  **key_parameters)
+            entries.append((index, key, key is not None and key in cache))
+
+        #Split the rows into shards and find those which were completed by a
+        #previous run.
+        parameters = {'smoothing_window': self.smoothing_window,
+                      'uncertainties': self.uncertainties,
+                      'N_MC_runs': self.N_MC_runs,
+                      'smoothing_windows': self.smoothing_windows,
+                      'engine': self.engine,
+                      'version': version}
+        if self.shard_size is None:
+            shards = [entries]
+        else:
+            shards = [entries[i:i + self.shard_size]
+                      for i in range(0, len(entries), self.shard_size)]
+            if not self.resume and os.path.exists(self.parts_fp):
+                shutil.rmtree(self.parts_fp)
+            if not os.path.exists(self.parts_fp):
+                os.makedirs(self.parts_fp)
+        done = set([i for i, shard in enumerate(shards) if self.resume
+                    and self.is_part_done(i, shard, parameters)])
+        if done:
+            print ('  -RESUMING: ' + str(len(done)) + ' of '
+                   + str(len(shards)) + ' shards already computed.')
+        pending = [entry for i, shard in enumerate(shards) if i not in done
+                   for entry in shard]
+        
+        #Rows are passed as plain dictionaries, so that they can be sent to
+        #the worker processes. imap preserves the order of the input rows.
+        tasks = ((index, self.get_row_dict(self.df.loc[index]))
+                 for (index, key, hit) in pending if not hit)
+        if self.engine == 'native':
+            #The native engine takes batches of spectra, but its results are
+            #still collected one row at a time.
+            analyse_task, tasks = analyse_batch, self.iter_batches(tasks)
+        else:
+            analyse_task = analyse
+        if self.workers > 1:
+            pool = multiprocessing.Pool(processes=self.workers)
+            computed = pool.imap(analyse_task, tasks)
+        else:
+            #Serial runs pass tasks and results through pickle just like the
+            #pool does, so that object sharing between rows (and therefore the
+            #output pickle) is byte-for-byte the same for any 'workers'.
+            pool = None
+            computed = (
+              pickle_round_trip(analyse_task(pickle_round_trip(task)))
+              for task in tasks)
+        if self.engine == 'native':
+            computed = (result for results in computed for result in results)
+
+        #Only the quantities added by the analysis are cached. The BSNIP data
+        #of the row is always taken from the current tables.
+        input_columns = set(self.df.columns) | set(['wavelength_raw',
+                                                    'flux_raw'])
+
+        parts, latencies = [], []
+        time_start = time.time()
+        progress = Progress_Reporter(len(pending), batch=self.batch)
+        
+        #Worker processes are terminated if the loop fails, e.g. while
+        #writing a shard, so that they do not outlive the run.
+        completed = False
+        try:
+            for i_shard, shard in enumerate(shards):
+                if i_shard in done:
+                    parts.append(i_shard)
+                    continue
+
+                part = {'parameters': parameters,
+                        'indexes': [index for (index, key, hit) in shard],
+                        'rows': [], 'row_index': [], 'arrays': {},
+                        'failed': [], 'sweep_IDs': [], 'sweeps': []}
             
-            #Note that the passed extinction is zero. The pEW feature **is**
-            #to be computed without correcting for extinction.
-            out_row_dict = cp.Analyse_Spectra(
-              wavelength=row['wavelength_raw'], flux=row['flux_raw'],
-              redshift=row['host_redshift'], extinction=0., D=row.to_dict(),
-              smoothing_window=51, deredshift_and_normalize=True).run_analysis()
-
-            #Compute uncertainties.
-            #out_row_dict = cp.Compute_Uncertainty(
-            #  D=out_row_dict, smoothing_window=51, N_MC_runs=3000).run_uncertainties() 
-
-            #Make figures.
-            if self.make_figures:
-                fname = top_dir + str(index) + '.png'
-                cp.Plot_Spectra(D=out_row_dict, outfile=fname,
-                                show_fig=False, save_fig=True)
-                    
-            out_list_dicts.append(out_row_dict)
-            list_index.append(index)
-
-        self.df = pd.DataFrame(out_list_dicts, index=list_index)
+                for (index, key, hit) in shard:
+
+                    cached = cache.get(key) if hit else None
+                    if cached is not None:
+                        out_row_dict = self.get_row_dict(self.df.loc[index])
+                        out_row_dict.update(cached)
+                        out_row_dict = pickle_round_trip(out_row_dict)
+                        error = None
+                    elif hit:
+                        #Unreadable cache entry; compute the spectrum here.
+                        task = (index, self.get_row_dict(self.df.loc[index]))
+                        index, out_row_dict, error, elapsed = (
+                          pickle_round_trip(analyse(task)))
+                        latencies.append(elapsed)
+                    else:
+                        index, out_row_dict, error, elapsed = next(computed)
+                        latencies.append(elapsed)
+
+                    progress.update(None if cached is not None else elapsed,
+                                    failed=error is not None)
+                    if error is not None:
+                        part['failed'].append((index, error))
+                        continue
+
+                    if cache is not None and cached is None:
+                        cache.put(key, dict(
+                          (k, v) for k, v in out_row_dict.items()
+                          if k not in input_columns))
+
+                    if self.smoothing_windows is not None:
+                        part['sweep_IDs'].append(out_row_dict['ID'])
+                        part['sweeps'].append(
+                          out_row_dict.pop('window_sweep'))
+                    part['rows'].append(self.store_arrays(
+                      out_row_dict, part['arrays'], len(part['row_index'])))
+                    part['row_index'].append(index)
+
+                if self.shard_size is None:
+                    parts.append(part)
+                else:
+                    self.write_part(i_shard, part)
+                    parts.append(i_shard)
+
+            progress.finish()
+            completed = True
+        finally:
+            if pool is not None:
+                if completed:
+                    pool.close()
+                else:
+                    pool.terminate()
+                pool.join()
+
+        self.result_cache = cache
+        if cache is not None:
+            print ('  -RESULT CACHE: ' + str(cache.N_hits) + ' hits, '
+                   + str(len(pending) - cache.N_hits) + ' computed.')
+
+        self.concatenate_parts(parts)
+        self.report_failures()
+        
+        #Latency of the spectra which were computed (not cached). The
+        #throughput includes all the spectra processed in this stage.
+        self.timer.add_latencies('compute', latencies,
+                                 wall_time=time.time() - time_start,
+                                 N_items=len(pending))
+
+    def get_part_path(self, i_shard):
+        return self.parts_fp + 'part-' + str(i_shard).zfill(5) + '.pkl'
+
+    def write_part(self, i_shard, part):
+        """Write the results of a shard. The parameters and indexes of the
+        shard are stored first, so that 'is_part_done' does not need to read
+        the results.
+        """
+        fpath = self.get_part_path(i_shard)
+        with open(fpath + '.tmp', 'wb') as out:
+            cPickle.dump({'parameters': part['parameters'],
+                          'indexes': part['indexes']}, out,
+                         protocol=cPickle.HIGHEST_PROTOCOL)
+            cPickle.dump(part, out, protocol=cPickle.HIGHEST_PROTOCOL)
+        os.rename(fpath + '.tmp', fpath)
+
+    def read_part(self, i_shard):
+        with open(self.get_part_path(i_shard), 'rb') as inp:
+            cPickle.load(inp)
+            return cPickle.load(inp)
+
+    def is_part_done(self, i_shard, shard, parameters):
+        """Whether a shard was written by a previous run, for the same
+        spectra and parameters.
+        """
+        fpath = self.get_part_path(i_shard)
+        if not os.path.isfile(fpath):
+            return False
+        try:
+            with open(fpath, 'rb') as inp:
+                header = cPickle.load(inp)
+        except (IOError, EOFError, cPickle.UnpicklingError):
+            return False
+        return (header['parameters'] == parameters and header['indexes']
+                == [index for (index, key, hit) in shard])
+
+    def concatenate_parts(self, parts):
+        """Build self.df and self.arrays from the results of every shard.
+        parts contains either the results or the number of a shard on disk.
+        """
+        rows, row_index, list_arrays = [], [], []
+        sweep_IDs, sweeps = [], []
+        for part in parts:
+            if not isinstance(part, dict):
+                part = self.read_part(part)
+            rows += part['rows']
+            row_index += part['row_index']
+            list_arrays.append((len(part['row_index']), part['arrays']))
+            self.failed += part['failed']
+            sweep_IDs += part['sweep_IDs']
+            sweeps += part['sweeps']
+        self.df = pd.DataFrame(rows, index=row_index)
+        if self.smoothing_windows is not None:
+            self.sweep = make_sweep_table(sweep_IDs, sweeps)
+
+        #Quantities missing from a shard are missing for all of its rows.
+        names = set([name for (N, arrays) in list_arrays for name in arrays])
+        self.arrays = {}
+        for name in names:
+            dtype = [arrays[name].dtype for (N, arrays) in list_arrays
+                     if name in arrays][0]
+            self.arrays[name] = Ragged_Array.concatenate(
+              [arrays[name] if name in arrays
+               else Ragged_Array.from_arrays([None] * N, dtype=dtype)
+               for (N, arrays) in list_arrays], dtype=dtype)
+
+    def store_arrays(self, out_row_dict, arrays, N_rows):
+        """Move the spectrum arrays of a row (e.g. 'flux_normalized') into
+        arrays, which holds one Ragged_Array per quantity, and return the
+        remaining scalar quantities. N_rows is the number of rows stored so
+        far; arrays first seen in this row are missing in the previous rows.
+        """
+        for name, value in out_row_dict.items():
+            if is_spectrum_array(value) and name not in arrays:
+                arrays[name] = Ragged_Array.from_arrays([None] * N_rows,
+                                                        dtype=value.dtype)
+        for name, ragged in arrays.items():
+            ragged.append(out_row_dict.pop(name, None))
+        return out_row_dict
+
+    def get_output_dataframe(self):
+        """Dataframe with both the scalar and the array quantities. Arrays
+        are views of the Ragged_Array buffers and are not copied.
+        """
+        df = self.df.copy()
+        for name, ragged in self.arrays.items():
+            df[name] = ragged.to_object_array()
+        return df[sorted(df.columns)]
+
+    def report_failures(self):
+        """Print the spectra for which the feature computation failed. These
+        are not included in the output file.
+        """
+        if self.failed:
+            print ('  -WARNING: ' + str(len(self.failed)) + ' spectra failed'
+                   + ' and were skipped:')
+            for index, error in self.failed:
+                print ('    -INDEX ' + str(index) + ': '
+                       + error.strip().split('\n')[-1])
         
     def save_output(self):
-        self.df.to_pickle('./../OUTPUT_FILES/' + self.filename + '.pkl')
+        out_fp = './../OUTPUT_FILES/' + self.filename
+        if self.shard is not None:
+            #Shards are always pickled, along with what 'merge_shards' needs
+            #to check that the merged catalog is complete.
+            with open(out_fp + '.pkl', 'wb') as out:
+                cPickle.dump(
+                  {'shard': self.shard, 'catalog_IDs': self.catalog_IDs,
+                   'IDs': self.shard_IDs, 'failed': self.failed,
+                   'df': self.get_output_dataframe(), 'sweep': self.sweep},
+                  out, protocol=cPickle.HIGHEST_PROTOCOL)
+        elif self.output_format in ['pickle', 'both']:
+            self.get_output_dataframe().to_pickle(out_fp + '.pkl')
+        if self.shard is None and self.output_format in ['columns', 'both']:
+            write_columns(self.df, out_fp + '.cols/', arrays=self.arrays)
+        if self.shard is None and self.sweep is not None:
+            self.sweep.to_pickle(out_fp + '_sweep.pkl')
+
+        #The shards are no longer needed once the output is complete.
+        if self.shard_size is not None and os.path.exists(self.parts_fp):
+            shutil.rmtree(self.parts_fp)
+
+    def evict_result_cache(self):
+        """Trim the result cache to its maximum size, once the output which
+        was computed from it is saved.
+        """
+        if self.result_cache is not None:
+            self.result_cache.evict()
+
+    def make_figures_of_spectra(self):
+        """Render the figure of each spectrum in a separate stage, from the
+        computed results. See 'render_BSNIP_figures', which can also be run
+        on its own.
+        """
+        if self.make_figures:
+            Render_Figures(filename=self.filename,
+                           df=self.get_output_dataframe(),
+                           workers=self.workers).run_rendering()
         
-    #@profile
+    def run_stage(self, name, method):
+        """Run a stage of the pipeline, recording its time, memory and the
+        number of rows in the dataframe at its end.
+        """
+        with self.timer.stage(name) as record:
+            method()
+            record['rows'] = 0 if self.df is None else len(self.df)
+
     def run_BSNIP_database(self):
-        self.initialize_dataframe_and_get_spectra()
-        self.read_general_info()
-        self.read_phase_info()
-        self.read_types()
-        self.read_features()
-        self.trim_by_phase_and_indexes()
-        self.compute_observables()
-        self.save_output()
-
-#BSNIP_object = BSNIP_Database(filename='BSNIP', make_figures=True)
-BSNIP_object = BSNIP_Database(filename='BSNIP-test', make_figures=False)
+        self.run_stage('initialize', self.initialize_dataframe)
+        self.run_stage('read tables', self.read_tables)
+        self.run_stage('table1', self.read_general_info)
+        self.run_stage('table2', self.read_phase_info)
+        self.run_stage('types', self.read_types)
+        self.run_stage('features', self.read_features)
+        self.run_stage('trim', self.trim_by_phase_and_indexes)
+        self.run_stage('get spectra', self.get_spectra)
+        self.run_stage('shard', self.select_shard)
+        self.run_stage('compute', self.compute_observables)
+        self.run_stage('save', self.save_output)
+        self.run_stage('evict', self.evict_result_cache)
+        self.run_stage('figures', self.make_figures_of_spectra)
+        
+        self.timer.print_summary()
+        self.timer.write_report(
+          './../OUTPUT_FILES/' + self.filename + '_timing.json')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+      description='Recompute the spectral features of the BSNIP sample.')
+    parser.add_argument('--filename', default='BSNIP-test')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--make-figures', action='store_true')
+    parser.add_argument(
+      '--shard', default=None,
+      help="'i/n' computes the i-th of n shards, e.g. one per array job."
+      + " Combine them with 'python BSNIP_shards.py merge n filename'.")
+    parser.add_argument('--shard-size', type=int, default=None)
+    parser.add_argument('--smoothing-windows', type=int, nargs='+',
+                        default=None)
+    parser.add_argument('--resume', action='store_true')
+    parser.add_argument('--uncertainties', choices=['loop', 'batched'],
+                        default=None)
+    args = parser.parse_args()
+
+    #BSNIP_object = BSNIP_Database(filename='BSNIP', make_figures=True)
+    BSNIP_object = BSNIP_Database(
+      filename=args.filename, make_figures=args.make_figures,
+      workers=args.workers, shard=args.shard, shard_size=args.shard_size,
+      resume=args.resume, smoothing_windows=args.smoothing_windows,
+      uncertainties=args.uncertainties)
 
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import fcntl
+import hashlib
+import cPickle
+from contextlib import contextmanager
+
+manifest_fpath = './../OUTPUT_FILES/FIGURES_manifest.pkl'
+
+#Modules through which the plotting scripts read and draw their inputs. Their
+#source files are inputs of every figure.
+helper_modules = ['plot_setup', 'BSNIP_columns', 'ragged_array',
+                  'tardis_catalog', 'tardis_products', 'cached_loader']
+
+def get_source_fpaths(modules):
+    """Paths of the .py files of modules in the directory of this one."""
+    codes_fp = os.path.dirname(os.path.abspath(__file__))
+    return [os.path.join(codes_fp, module + '.py') for module in modules]
+
+def get_file_signatures(fpaths):
+    """(path, mtime, size) of every input file. Directories (e.g. the
+    '.cols/' output of a BSNIP run) contribute every file they contain.
+    """
+    signatures = []
+    for fpath in fpaths:
+        if os.path.isdir(fpath):
+            for dirpath, dirnames, filenames in sorted(os.walk(fpath)):
+                for filename in sorted(filenames):
+                    signatures += get_file_signatures(
+                      [os.path.join(dirpath, filename)])
+        else:
+            stat = os.stat(fpath)
+            signatures.append(
+              (os.path.abspath(fpath), stat.st_mtime, stat.st_size))
+    return signatures
+
+def get_key(signatures, parameters):
+    md5 = hashlib.md5()
+    md5.update(repr(sorted(parameters.items())))
+    md5.update(repr(signatures))
+    return md5.hexdigest()
+
+def read_manifest(fpath=manifest_fpath):
+    if not os.path.isfile(fpath):
+        return {}
+    with open(fpath, 'rb') as inp:
+        return cPickle.load(inp)
+
+@contextmanager
+def locked_manifest(fpath=manifest_fpath):
+    """Manifest which is written back when the 'with' block exits. A lock
+    file prevents figures rendered by parallel processes from overwriting
+    each other's entries.
+    """
+    with open(fpath + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        manifest = read_manifest(fpath)
+        yield manifest
+        tmp_fpath = fpath + '.tmp' + str(os.getpid())
+        with open(tmp_fpath, 'wb') as out:
+            cPickle.dump(manifest, out, protocol=cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_fpath, fpath)
+
+class Managed_Figure(object):
+    """Base class of figures which are only rendered again if their inputs
+    changed.
+
+    Notes
+    -----
+    Subclasses define 'get_fig_fpath(extension)', 'get_inputs()', which
+    returns the paths of the files the figure is made from, and
+    'figure_parameters', the names of the attributes (constructor
+    arguments) which determine the figure. The source files of the subclass
+    and of the 'helper_modules' are always inputs, so that editing a script
+    or a helper renders the figures again. Other modules imported by a
+    script are not tracked; use 'force' after editing them.
+
+    A figure is up to date if it is saved (not shown), it exists, it is
+    newer than all of its inputs and the manifest entry for it matches the
+    current inputs and parameters. Setting 'force' to True renders it
+    anyway.
+    """
+
+    figure_parameters = []
+
+    def get_manifest_key(self):
+        fpaths = list(self.get_inputs())
+        module_fpath = sys.modules[self.__class__.__module__].__file__
+        fpaths.append(os.path.splitext(module_fpath)[0] + '.py')
+        fpaths += get_source_fpaths(helper_modules)
+        signatures = get_file_signatures(fpaths)
+        parameters = dict((name, getattr(self, name))
+                          for name in self.figure_parameters)
+        parameters['class'] = self.__class__.__name__
+        return signatures, get_key(signatures, parameters)
+
+    def is_up_to_date(self, extension='pdf'):
+        self.skipped = False
+        if (getattr(self, 'force', False) or self.show_fig
+            or not self.save_fig):
+            return False
+        fig_fpath = self.get_fig_fpath(extension)
+        if not os.path.isfile(fig_fpath):
+            return False
+        signatures, key = self.get_manifest_key()
+        if any([mtime > os.path.getmtime(fig_fpath)
+                for (fpath, mtime, size) in signatures]):
+            return False
+        self.skipped = read_manifest().get(os.path.abspath(fig_fpath)) == key
+        if self.skipped:
+            print '  -UP TO DATE: ' + fig_fpath
+        return self.skipped
+
+    def record_figure(self, extension='pdf'):
+        """Store the inputs of a figure which has just been saved."""
+        signatures, key = self.get_manifest_key()
+        with locked_manifest() as manifest:
+            manifest[os.path.abspath(self.get_fig_fpath(extension))] = key
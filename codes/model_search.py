@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import fnmatch
+import cPickle
+
+import numpy as np
+import pandas as pd
+
+from spectrum_matrix import (make_grid, rebin_flux, get_spectrum_arrays,
+                             find_pkl_files, write_spectrum_matrix,
+                             Spectrum_Matrix)
+
+#Directories under path_tardis_output which hold model grids.
+default_grids = ['11fe_L-grid', '05bl_L-grid', '*_default_L-scaled*',
+                 '11fe_Ti-grid']
+
+def find_model_files(path_tardis_output, grids=default_grids):
+    """(grid, path) of every .pkl file in the directories of
+    path_tardis_output whose name matches one of the grids patterns.
+    """
+    list_model = []
+    for grid_dir in sorted(os.listdir(path_tardis_output)):
+        if not os.path.isdir(os.path.join(path_tardis_output, grid_dir)):
+            continue
+        if any([fnmatch.fnmatch(grid_dir, pattern) for pattern in grids]):
+            for fpath in find_pkl_files(
+              os.path.join(path_tardis_output, grid_dir)):
+                list_model.append((grid_dir, fpath))
+    return list_model
+
+def has_spectrum(fpath):
+    """Whether a .pkl file holds a spectrum (see 'get_spectrum_arrays')."""
+    with open(fpath, 'rb') as inp:
+        D = cPickle.load(inp)
+    keys = D.keys() if isinstance(D, dict) else getattr(D, 'columns', [])
+    return (('wavelength_corr' in keys or 'wavelength_raw' in keys)
+            and ('flux_normalized' in keys or 'flux_raw' in keys))
+
+def select_model_spectra(list_model):
+    """The models of list_model whose file holds a spectrum. Other files
+    (e.g. other pickled products) are dropped with a warning.
+    """
+    selected = []
+    for grid_dir, fpath in list_model:
+        if has_spectrum(fpath):
+            selected.append((grid_dir, fpath))
+        else:
+            print '  -WARNING: No spectrum in ' + fpath + '. Skipping.'
+    return selected
+
+def iter_model_spectra(list_model):
+    """Yield (metadata, wavelength, flux) for each model, reading one file
+    at a time. Every file has to hold a spectrum (see
+    'select_model_spectra').
+    """
+    for grid_dir, fpath in list_model:
+        with open(fpath, 'rb') as inp:
+            D = cPickle.load(inp)
+        wavelength, flux = get_spectrum_arrays(D)
+        metadata = {'name': os.path.basename(fpath).split('.pkl')[0],
+                    'source': 'tardis', 'SNID': None, 'phase': None,
+                    'path': fpath, 'grid': grid_dir}
+        yield metadata, wavelength, flux
+
+def compute_distances(flux_models, flux_observed, metric='chi2',
+                      min_coverage=0.9):
+    """Distance between an observed spectrum and every model, with masked
+    sums computed as array operations over the (models x pixels) matrix.
+
+    Parameters
+    ----------
+    flux_models : ~np.array
+        (models x pixels) fluxes, nan where a model is not covered.
+    flux_observed : ~np.array
+        Observed flux on the same pixels, nan where not covered.
+    metric : ~str
+        'chi2' is the mean squared residual after scaling each model by the
+        factor which minimizes it, in units of the mean observed flux
+        squared. 'correlation' is 1 minus the Pearson correlation.
+    min_coverage : ~float
+        Minimum fraction of the observed pixels that a model has to cover.
+        Models covering less get an infinite distance.
+
+    Returns
+    -------
+    (distance, scale, N_pixels) arrays, one value per model. scale is the
+    best fit factor of each model (only meaningful for 'chi2').
+    """
+    observed = np.isfinite(flux_observed)
+    o = flux_observed[observed].astype(float)
+    o = o / np.mean(o)
+    M = np.asarray(flux_models[:, observed], dtype=float)
+    W = np.isfinite(M)
+    M = np.where(W, M, 0.)
+    W = W.astype(float)
+
+    N = W.sum(axis=1)
+    S_o, S_oo = W.dot(o), W.dot(o**2.)
+    S_m, S_mm, S_om = M.sum(axis=1), (M**2.).sum(axis=1), M.dot(o)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = S_om / S_mm
+        if metric == 'chi2':
+            distance = (S_oo - S_om**2. / S_mm) / N
+        elif metric == 'correlation':
+            covariance = S_om / N - (S_o / N) * (S_m / N)
+            variance_o = S_oo / N - (S_o / N)**2.
+            variance_m = S_mm / N - (S_m / N)**2.
+            distance = 1. - covariance / np.sqrt(variance_o * variance_m)
+        else:
+            raise ValueError('metric must be "chi2" or "correlation".')
+
+    enough = (N >= min_coverage * len(o)) & (N > 1) & np.isfinite(distance)
+    return np.where(enough, distance, np.inf), scale, N.astype(int)
+
+class Model_Search(object):
+    """Rank the TARDIS models by how well they match an observed spectrum.
+
+    Parameters
+    ----------
+    path_tardis_output : ~str
+        Directory containing the model grids. Default is None, which uses
+        the 'path_tardis_output' environment variable.
+    grids : ~list
+        Patterns of the grid directories to search (see 'default_grids').
+    fpath : ~str
+        Where the matrix of models is stored.
+    grid : ~np.array
+        Rest frame grid of the matrix. Default is None (see 'make_grid').
+    rebuild : ~bool
+        If True, the matrix is always built again. Otherwise (default) it is
+        only built if it is missing or if any model file has been added,
+        removed or modified since.
+
+    Notes
+    -----
+    All models are rebinned onto a common grid once and stored as a
+    'Spectrum_Matrix', which is then held in memory, so that a query only
+    rebins the observed spectrum and computes the distance to every model at
+    once (see 'compute_distances').
+
+    Examples
+    --------
+    Model_Search().rank('2005bl/2005_04_26.pkl', 5500., 6500.).head(10)
+    """
+
+    def __init__(self, path_tardis_output=None, grids=default_grids,
+                 fpath='./../OUTPUT_FILES/model_matrix/', grid=None,
+                 rebuild=False):
+        if path_tardis_output is None:
+            path_tardis_output = os.environ['path_tardis_output']
+        self.path_tardis_output = path_tardis_output
+        self.grids = grids
+        self.fpath = fpath
+        self.grid = make_grid() if grid is None else grid
+        self.obs_fp = './../INPUT_FILES/observational_spectra/'
+
+        list_model = find_model_files(self.path_tardis_output, self.grids)
+        signature = self.get_signature(list_model)
+        if rebuild or not self.is_current(signature):
+            #The models are counted first, so that the matrix is written one
+            #row at a time without holding every spectrum in memory.
+            list_spectra = select_model_spectra(list_model)
+            print ('\n*BUILDING MODEL MATRIX: ' + str(len(list_spectra))
+                   + ' models.')
+            write_spectrum_matrix(
+              self.fpath, iter_model_spectra(list_spectra), self.grid,
+              N=len(list_spectra))
+            with open(self.fpath + 'signature.pkl', 'wb') as out:
+                cPickle.dump(signature, out, protocol=cPickle.HIGHEST_PROTOCOL)
+        self.matrix = Spectrum_Matrix(self.fpath)
+        self.flux = np.asarray(self.matrix.flux)
+        self.metadata = self.matrix.metadata
+
+    def get_signature(self, list_model):
+        return {'grid': list(self.grid), 'files': dict(
+          (fpath, os.path.getmtime(fpath)) for grid_dir, fpath in list_model)}
+
+    def is_current(self, signature):
+        """Whether the stored matrix was built on the same grid from the same
+        model files, with the same modification times.
+        """
+        fpath = self.fpath + 'signature.pkl'
+        if not os.path.isfile(fpath):
+            return False
+        with open(fpath, 'rb') as inp:
+            return cPickle.load(inp) == signature
+
+    def get_observed_flux(self, observed):
+        """Rebin an observed spectrum onto the grid of the matrix. observed
+        is the path of a .pkl file (relative to the observational spectra
+        directory, e.g. '2005bl/2005_04_26.pkl'), a dictionary as returned
+        by 'Analyse_Spectra' or a (wavelength, flux) tuple.
+        """
+        if isinstance(observed, basestring):
+            fpath = observed
+            if not os.path.isfile(fpath):
+                fpath = self.obs_fp + observed
+            with open(fpath, 'rb') as inp:
+                observed = cPickle.load(inp)
+        if isinstance(observed, tuple):
+            wavelength, flux = observed
+        else:
+            wavelength, flux = get_spectrum_arrays(observed)
+        return rebin_flux(wavelength, flux, self.matrix.wavelength)[0]
+
+    def rank(self, observed, w_min=3500., w_max=9000., metric='chi2',
+             grids=None, min_coverage=0.9, top=None):
+        """Rank the models by their distance to an observed spectrum.
+
+        Parameters
+        ----------
+        observed : ~str, ~dict or ~tuple
+            See 'get_observed_flux'.
+        w_min, w_max : ~float
+            Wavelength range (rest frame) used in the comparison.
+        metric : ~str
+            'chi2' or 'correlation', see 'compute_distances'.
+        grids : ~list
+            If given, only models in grid directories matching these
+            patterns are ranked.
+        min_coverage : ~float
+            See 'compute_distances'.
+        top : ~int
+            If given, only the best top models are returned.
+
+        Returns
+        -------
+        Dataframe of models sorted by distance (best first), with the
+        'distance', 'scale' and 'N_pixels' of each model.
+        """
+        cols = self.matrix.get_window(w_min, w_max)
+        flux_observed = self.get_observed_flux(observed)[cols]
+        rows = np.arange(len(self.metadata))
+        if grids is not None:
+            rows = rows[np.array([any([fnmatch.fnmatch(grid_dir, pattern)
+                                       for pattern in grids])
+                                  for grid_dir in self.metadata['grid']],
+                                 dtype=bool)]
+
+        distance, scale, N_pixels = compute_distances(
+          self.flux[:, cols][rows], flux_observed, metric, min_coverage)
+
+        df = self.metadata.iloc[rows][['name', 'grid', 'path']].copy()
+        df['distance'], df['scale'], df['N_pixels'] = (
+          distance, scale, N_pixels)
+        df = df.iloc[np.argsort(distance, kind='mergesort')]
+        if top is not None:
+            df = df.head(top)
+        return df.reset_index(drop=True)
+
+if __name__ == '__main__':
+    #e.g. python model_search.py 2005bl/2005_04_26.pkl chi2 5500 6500
+    if len(sys.argv) < 2:
+        print ('Usage: python model_search.py observed.pkl [chi2|correlation]'
+               ' [w_min w_max]')
+        sys.exit(1)
+    metric = sys.argv[2] if len(sys.argv) > 2 else 'chi2'
+    w_range = ([float(value) for value in sys.argv[3:5]]
+               if len(sys.argv) > 4 else [3500., 9000.])
+    search = Model_Search()
+    time_start = time.time()
+    ranking = search.rank(sys.argv[1], w_range[0], w_range[1], metric)
+    print ('\n*RANKED ' + str(len(ranking)) + ' MODELS IN '
+           + format(time.time() - time_start, '.3f') + 's.')
+    print ranking.head(10).to_string()
@@ -1,33 +1,23 @@
 #!/usr/bin/env python
 
-import os                                                               
-import sys
-import time
-
-path_tardis_output = os.environ['path_tardis_output']
+import numpy as np
 
-import matplotlib
-import cPickle
+import cached_loader
+from tardis_catalog import Tardis_Catalog
+from figure_manifest import Managed_Figure
+from plot_setup import Lazy_Module, plt, get_parser, parse_args
+from tardis_products import Products_Store
 
-import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib as mpl
-import pylab
-from matplotlib.ticker import MultipleLocator
-from matplotlib import cm
-from matplotlib import colors
-
-import colormaps as cmaps
-                                                
-mpl.rcParams['mathtext.fontset'] = 'stix'
-mpl.rcParams['mathtext.fontset'] = 'stix'
-mpl.rcParams['font.family'] = 'STIXGeneral'
+#Imported when first used, see 'plot_setup'.
+ticker = Lazy_Module('matplotlib.ticker')
+colors = Lazy_Module('matplotlib.colors')
+cmaps = Lazy_Module('colormaps')
 
 def mean_flux(w, f, w_min, w_max):
     window_condition = ((w > w_min) & (w < w_max))  
     return np.mean(f[window_condition])
     
-class L_Grid(object):
+class L_Grid(Managed_Figure):
     """Makes a figure with two panels:
     Left: Sequence of TARDIS spectra where the luminosity is scaled.
     Right: Sequence of TARDIS spectra where the Ti mass fraction is scaled
@@ -42,6 +32,10 @@ class L_Grid(object):
         '11fe' or '05bl'.
         Used to determine the directory of the spectra that will be plotted in
         the left panel.
+
+    force : ~bool
+        If True, the figure is rendered even if its inputs have not changed
+        since it was last saved. See 'figure_manifest'.
         
     Notes
     -----
@@ -49,21 +43,21 @@ class L_Grid(object):
     do correspond to the SN requested (11fe/05bl) and the correct lm.
     *Requires 'path_tardis_output' to be defined in the bash file.
     """
+
+    figure_parameters = ['lm', 'left_panel', 'show_pEW']
     
     def __init__(self, lm='downbranch', left_panel='11fe',
-                 show_pEW=False, show_fig=True, save_fig=False):
+                 show_pEW=False, show_fig=True, save_fig=False, force=False):
 
         self.lm = lm
         self.left_panel = left_panel
         self.show_pEW = show_pEW
         self.show_fig = show_fig
         self.save_fig = save_fig 
+        self.force = force
         self.L_array = list(np.logspace(8.544, 9.72, 20)[::-1])
         self.list_pkl, self.label = [], []  
         self.list_pkl_bright, self.list_pkl_faint = [], []
-        self.FIG = plt.figure(figsize=(20,22))
-        self.ax1 = plt.subplot(121) 
-        self.ax2 = plt.subplot(122, sharey=self.ax1)
 
         self.fs_label = 26
         self.fs_ticks = 26
@@ -89,10 +83,10 @@ class L_Grid(object):
         self.ax1.minorticks_on()
         self.ax1.tick_params('both', length=8, width=1, which='major')
         self.ax1.tick_params('both', length=4, width=1, which='minor')
-        self.ax1.xaxis.set_minor_locator(MultipleLocator(500.))
-        self.ax1.xaxis.set_major_locator(MultipleLocator(1000.))
-        self.ax1.yaxis.set_minor_locator(MultipleLocator(1.))
-        self.ax1.yaxis.set_major_locator(MultipleLocator(5.))       
+        self.ax1.xaxis.set_minor_locator(ticker.MultipleLocator(500.))
+        self.ax1.xaxis.set_major_locator(ticker.MultipleLocator(1000.))
+        self.ax1.yaxis.set_minor_locator(ticker.MultipleLocator(1.))
+        self.ax1.yaxis.set_major_locator(ticker.MultipleLocator(5.))       
         self.ax1.tick_params(labelleft='off')       
 
         self.ax2.set_xlabel(right_x_label, fontsize=self.fs_label)
@@ -103,42 +97,47 @@ class L_Grid(object):
         self.ax2.minorticks_on()
         self.ax2.tick_params('both', length=8, width=1, which='major')
         self.ax2.tick_params('both', length=4, width=1, which='minor')
-        self.ax2.xaxis.set_minor_locator(MultipleLocator(500.))
-        self.ax2.xaxis.set_major_locator(MultipleLocator(1000.))
-        self.ax2.yaxis.set_minor_locator(MultipleLocator(1.))
-        self.ax2.yaxis.set_major_locator(MultipleLocator(5.))       
+        self.ax2.xaxis.set_minor_locator(ticker.MultipleLocator(500.))
+        self.ax2.xaxis.set_major_locator(ticker.MultipleLocator(1000.))
+        self.ax2.yaxis.set_minor_locator(ticker.MultipleLocator(1.))
+        self.ax2.yaxis.set_major_locator(ticker.MultipleLocator(5.))       
         self.ax2.tick_params(labelleft='off')   
     
-    def load_spectra(self):
+    def find_spectra(self):
         
+        catalog = Tardis_Catalog()
+
         """Get the pkl files for the luminosity grid."""
-        case_folder = path_tardis_output + self.left_panel + '_L-grid/'
-        
-        for L in self.L_array:
-            L_str = str(format(np.log10(L), '.3f'))       
-            fname = ('loglum-' + L_str +  '_line_interaction-' + self.lm) 
-            with open(case_folder + fname + '/' + fname + '.pkl', 'r') as inp:
-                self.list_pkl.append(cPickle.load(inp))
+        queries_L = [{'grid': self.left_panel + '_L-grid',
+                      'L': str(format(np.log10(L), '.3f')), 'lm': self.lm}
+                     for L in self.L_array]
 
         """Load pkl files for the titanium grid."""
         #path_data = (path_tardis_output + '11fe_Ti_' + self.lm)
         #Ti plot not yet run with macroatom.
-        case_folder = path_tardis_output + '11fe_Ti-grid/'
-        
         list_X_Ti = ['20.00', '10.00', '5.00', '2.00',
                      '1.00', '0.5', '0.2', '0.1', '0.05', '0.00']
-                
-        for X_Ti in list_X_Ti:
-           
-            #L1 and L2 refers to L_11fe and L_11fe/4, respectively.
-            f_L1 = 'TiCrs-' + X_Ti + '_loglum-9.544_line_interaction-' + self.lm
-            f_L2 = 'TiCrs-' + X_Ti + '_loglum-8.942_line_interaction-' + self.lm
-            
-            with open(case_folder + f_L1 + '/' + f_L1 + '.pkl', 'r') as inp:
-                self.list_pkl_bright.append(cPickle.load(inp))            
 
-            with open(case_folder + f_L2 + '/' + f_L2 + '.pkl', 'r') as inp:
-                self.list_pkl_faint.append(cPickle.load(inp))            
+        #L1 and L2 refers to L_11fe and L_11fe/4, respectively.
+        queries_L1 = [{'grid': '11fe_Ti-grid', 'X_Ti': X_Ti, 'L': '9.544',
+                       'lm': self.lm} for X_Ti in list_X_Ti]
+        queries_L2 = [{'grid': '11fe_Ti-grid', 'X_Ti': X_Ti, 'L': '8.942',
+                       'lm': self.lm} for X_Ti in list_X_Ti]
+
+        #Check that every run exists before loading any of them.
+        self.paths = catalog.require(queries_L + queries_L1 + queries_L2)
+        self.N_L, self.N_Ti = len(queries_L), len(list_X_Ti)
+
+    def load_spectra(self):
+
+        #Runs are read on a thread pool, so that plotting can start while
+        #the last ones are still loading. See 'cached_loader.prefetch'.
+        spectra = cached_loader.prefetch(
+          self.paths, Products_Store().load)
+        N_L, N_Ti = self.N_L, self.N_Ti
+        self.list_pkl = spectra[:N_L]
+        self.list_pkl_bright = spectra[N_L:N_L + N_Ti]
+        self.list_pkl_faint = spectra[N_L + N_Ti:]
     
     def plotting(self):
        
@@ -270,24 +269,36 @@ class L_Grid(object):
                + ' low brightnesses: ', np.mean(np.asarray(
                [T1-T2 for (T1,T2) in zip(T_bright,T_faint)])))
 
-    def save_figure(self, extension='pdf', dpi=360):
-                
+    def get_inputs(self):
+        return self.paths
+
+    def get_fig_fpath(self, extension='pdf'):
         directory = './../OUTPUT_FILES/FIGURES/'
+        if self.show_pEW:
+            return (directory + 'Fig_' + self.left_panel + '_'
+                    + self.lm + '_L_and_Ti_grid_pEW.' + extension)
+        else:
+            return (directory + 'Fig_' + self.left_panel + '_'
+                    + self.lm + '_L_and_Ti_grid.' + extension)
+
+    def save_figure(self, extension='pdf', dpi=360):
         if self.save_fig:
-            if self.show_pEW:
-                filename = (directory + 'Fig_' + self.left_panel + '_'
-                            + self.lm + '_L_and_Ti_grid_pEW.'
-                            + extension)
-            else:
-                filename = (directory + 'Fig_' + self.left_panel + '_'
-                            + self.lm + '_L_and_Ti_grid.' + extension)         
-            plt.savefig(filename, format=extension, dpi=dpi)
+            plt.savefig(self.get_fig_fpath(extension), format=extension,
+                        dpi=dpi)
+            self.record_figure(extension)
         
     def show_figure(self):
         if self.show_fig:
             plt.show()
                 
     def run_comparison(self):
+        self.find_spectra()
+        if self.is_up_to_date(extension='pdf'):
+            return
+        #pyplot is only imported for figures to be rendered.
+        self.FIG = plt.figure(figsize=(20,22))
+        self.ax1 = plt.subplot(121)
+        self.ax2 = plt.subplot(122, sharey=self.ax1)
         self.set_fig_frame()
         self.load_spectra()
         plt.tight_layout()
@@ -295,25 +306,21 @@ class L_Grid(object):
         self.save_figure()
         self.show_figure()  
 
-compare_spectra_object = L_Grid(lm='downbranch', left_panel='11fe',
-                                show_pEW=True, show_fig=True, save_fig=False)
-
-#Run and save all options
-'''
-compare_spectra_object = L_Grid(lm='downbranch',left_panel='11fe',
-                                show_pEW=False, show_fig=False, save_fig=True)
-compare_spectra_object = L_Grid(lm='downbranch',left_panel='11fe',
-                                show_pEW=True, show_fig=False, save_fig=True)
-compare_spectra_object = L_Grid(lm='downbranch',left_panel='05bl',
-                                show_pEW=False, show_fig=False, save_fig=True)
-compare_spectra_object = L_Grid(lm='downbranch',left_panel='05bl',
-                                show_pEW=True, show_fig=False, save_fig=True)
-compare_spectra_object = L_Grid(lm='macroatom',left_panel='11fe',
-                                show_pEW=False, show_fig=False, save_fig=True)
-compare_spectra_object = L_Grid(lm='macroatom',left_panel='11fe',
-                                show_pEW=True, show_fig=False, save_fig=True)
-compare_spectra_object = L_Grid(lm='macroatom',left_panel='05bl',
-                                show_pEW=False, show_fig=False, save_fig=True)
-compare_spectra_object = L_Grid(lm='macroatom',left_panel='05bl',
-                                show_pEW=True, show_fig=False, save_fig=True)
-'''
+def main(argv=None):
+    #Every variant is rendered by 'render_paper_figures.py'.
+    parser = get_parser('Plot the TARDIS spectra of a luminosity grid and of'
+                        ' the 11fe Ti grid.')
+    parser.add_argument('--lm', choices=['downbranch', 'macroatom'],
+                        default='downbranch')
+    parser.add_argument('--left-panel', choices=['11fe', '05bl'],
+                        default='11fe')
+    parser.add_argument('--show-pEW', dest='show_pEW', action='store_true',
+                        default=True)
+    parser.add_argument('--no-show-pEW', dest='show_pEW',
+                        action='store_false')
+    args = parse_args(parser, argv)
+    return L_Grid(lm=args.lm, left_panel=args.left_panel,
+                  show_pEW=args.show_pEW, **args.figure_kwargs)
+
+if __name__ == '__main__':
+    main()
@@ -1,28 +1,16 @@
 #!/usr/bin/env python
 
-import os                                                               
-import sys
-import time
-
-path_tardis_output = os.environ['path_tardis_output']
-
-import matplotlib
-import cPickle
+import os
 
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib as mpl
-import pylab
-from matplotlib.ticker import MultipleLocator
-from matplotlib import cm
-from matplotlib import colors
 from itertools import cycle
 
-import colormaps as cmaps
-                                                
-mpl.rcParams['mathtext.fontset'] = 'stix'
-mpl.rcParams['mathtext.fontset'] = 'stix'
-mpl.rcParams['font.family'] = 'STIXGeneral'
+import cached_loader
+from figure_manifest import Managed_Figure
+from plot_setup import Lazy_Module, plt, get_parser, parse_args
+
+#Imported when first used, see 'plot_setup'.
+ticker = Lazy_Module('matplotlib.ticker')
 
 def normalize_spectrum(w, f):
     aux_flux = np.asarray(f).astype(np.float)                    
@@ -31,24 +19,24 @@ def normalize_spectrum(w, f):
     normalization_factor = np.mean(flux_window)    
     return f / normalization_factor
 
-class Analyse_Vphoto(object):
+class Analyse_Vphoto(Managed_Figure):
     """Makes a figure with a subplot for the spectra and another for the
     temperature profile. Usually used to check how changes in the photospheric
     velocity and explosion time affect the T-profile and thus the spectra."""
+
+    figure_parameters = ['mode', 'L_folder']
     
-    def __init__(self, mode, L_folder, show_fig=True, save_fig=False):
+    def __init__(self, mode, L_folder, show_fig=True, save_fig=False,
+                 force=False):
 
         self.show_fig = show_fig
         self.save_fig = save_fig
+        self.force = force
         self.mode = mode
         self.L_folder = L_folder
         self.list_pkl = []
         self.pkl_05bl = None 
 
-        self.FIG = plt.figure(figsize=(16,10))
-        self.ax1 = plt.subplot(211) 
-        self.ax2 = plt.subplot(212)
-
         self.fs_label = 26
         self.fs_ticks = 26
         self.fs_legend = 20
@@ -76,10 +64,10 @@ class Analyse_Vphoto(object):
         self.ax1.minorticks_on()
         self.ax1.tick_params('both', length=8, width=1, which='major')
         self.ax1.tick_params('both', length=4, width=1, which='minor')
-        self.ax1.xaxis.set_minor_locator(MultipleLocator(500.))
-        self.ax1.xaxis.set_major_locator(MultipleLocator(1000.))
-        self.ax1.yaxis.set_minor_locator(MultipleLocator(0.5))
-        self.ax1.yaxis.set_major_locator(MultipleLocator(1.))       
+        self.ax1.xaxis.set_minor_locator(ticker.MultipleLocator(500.))
+        self.ax1.xaxis.set_major_locator(ticker.MultipleLocator(1000.))
+        self.ax1.yaxis.set_minor_locator(ticker.MultipleLocator(0.5))
+        self.ax1.yaxis.set_major_locator(ticker.MultipleLocator(1.))       
 
         self.ax2.set_xlabel(bot_x_label, fontsize=self.fs_label)
         self.ax2.set_ylabel(bot_y_label, fontsize=self.fs_label)
@@ -90,22 +78,23 @@ class Analyse_Vphoto(object):
         self.ax2.minorticks_on()
         self.ax2.tick_params('both', length=8, width=1, which='major')
         self.ax2.tick_params('both', length=4, width=1, which='minor')
-        self.ax2.xaxis.set_minor_locator(MultipleLocator(1.))
-        self.ax2.xaxis.set_major_locator(MultipleLocator(5.))
-        self.ax2.yaxis.set_minor_locator(MultipleLocator(1000.))
-        self.ax2.yaxis.set_major_locator(MultipleLocator(5000.))       
+        self.ax2.xaxis.set_minor_locator(ticker.MultipleLocator(1.))
+        self.ax2.xaxis.set_major_locator(ticker.MultipleLocator(5.))
+        self.ax2.yaxis.set_minor_locator(ticker.MultipleLocator(1000.))
+        self.ax2.yaxis.set_major_locator(ticker.MultipleLocator(5000.))       
     
-    def load_spectra(self):
-        """Load data files."""
+    def find_spectra(self):
+        """List data files."""
         
+        path_tardis_output = os.environ['path_tardis_output']
+
         #Sequence in vphoto.
         path_data = (path_tardis_output + '11fe_' + self.mode + '_'
           + self.L_folder + '/')
        
-        for filename in os.listdir(path_data):
-            if filename.split('.')[-1] == 'pkl':
-                with open(path_data + filename, 'r') as inp:
-                    self.list_pkl.append(cPickle.load(inp))
+        self.paths = [path_data + filename
+                      for filename in os.listdir(path_data)
+                      if filename.split('.')[-1] == 'pkl']
                     
         #05bl spectrum that is matched with the scaled temperature.
         path_data = path_tardis_output + '05bl_standard_downbranch/'
@@ -117,8 +106,14 @@ class Analyse_Vphoto(object):
         elif L_suffix == 'postmax':
             filename = 'velocity_start-3350_loglum-8.594_time_explosion-29.9.pkl'        
                 
-        with open(path_data + filename, 'r') as inp: 
-            self.pkl_05bl = cPickle.load(inp)                
+        self.paths.append(path_data + filename)
+
+    def load_spectra(self):
+        """Load data files."""
+
+        self.list_pkl = [cached_loader.load(fpath)
+                         for fpath in self.paths[:-1]]
+        self.pkl_05bl = cached_loader.load(self.paths[-1])
 
     def plotting(self):
         
@@ -183,30 +178,47 @@ class Analyse_Vphoto(object):
                 
         plt.tight_layout()
             
-    def save_figure(self, ext='pdf', dpi=360):
+    def get_inputs(self):
+        return self.paths
+
+    def get_fig_fpath(self, ext='pdf'):
         directory = './../OUTPUT_FILES/FIGURES/'
+        return directory + 'Fig_' + self.mode + '_' + self.L_folder + '.' + ext
+
+    def save_figure(self, ext='pdf', dpi=360):
         if self.save_fig:
-            filename = (directory + 'Fig_' + self.mode + '_' + self.L_folder
-              + '.' + ext)
-              
-            plt.savefig(filename, format=ext, dpi=dpi)
+            plt.savefig(self.get_fig_fpath(ext), format=ext, dpi=dpi)
+            self.record_figure(ext)
         
     def show_figure(self):
         if self.show_fig:
             plt.show()
                 
     def run_vphoto(self):
+        self.find_spectra()
+        if self.is_up_to_date():
+            return
+        #pyplot is only imported for figures to be rendered.
+        self.FIG = plt.figure(figsize=(16,10))
+        self.ax1 = plt.subplot(211)
+        self.ax2 = plt.subplot(212)
         self.set_fig_frame()
         self.load_spectra()
         self.plotting()
         self.save_figure()
         self.show_figure()  
 
-#compare_spectra_object = Analyse_Vphoto(mode='vphoto', L_folder='premax_L-05bl',
-#                                        show_fig=True, save_fig=False)
-
-#compare_spectra_object = Analyse_Vphoto(mode='texp', L_folder='premax_L-05bl',
-#                                        show_fig=True, save_fig=False)                                        
-
-compare_spectra_object = Analyse_Vphoto(mode='texp', L_folder='postmax_L-05bl',
-                                        show_fig=True, save_fig=False)                                            
+def main(argv=None):
+    parser = get_parser('Plot the spectra and temperature profiles of a'
+                        ' sequence of 11fe models.')
+    parser.add_argument('--mode', choices=['vphoto', 'texp'], default='texp')
+    parser.add_argument(
+      '--L-folder', default='postmax_L-05bl',
+      help="e.g. 'premax_L-05bl'. The runs are read from"
+      + " '11fe_<mode>_<L_folder>/' under path_tardis_output.")
+    args = parse_args(parser, argv)
+    return Analyse_Vphoto(mode=args.mode, L_folder=args.L_folder,
+                          **args.figure_kwargs)
+
+if __name__ == '__main__':
+    main()
@@ -1,31 +1,38 @@
 #!/usr/bin/env python
 
-import os                                                               
-import sys
-
-path_tardis_output = os.environ['path_tardis_output']
+import os
+import itertools
 
-import pandas as pd
 import numpy as np
-from astropy import constants as const
 
-import matplotlib
-import cPickle
+import cached_loader
+from figure_manifest import Managed_Figure
+from plot_setup import Lazy_Module, plt, get_parser, parse_args
 
-import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib as mpl
-import pylab
-import itertools
-from matplotlib.ticker import MultipleLocator
-                                                        
-mpl.rcParams['mathtext.fontset'] = 'stix'
-mpl.rcParams['mathtext.fontset'] = 'stix'
-mpl.rcParams['font.family'] = 'STIXGeneral'
+#Imported when first used, see 'plot_setup'.
+ticker = Lazy_Module('matplotlib.ticker')
+const = Lazy_Module('astropy.constants')
 
-class Plot_Ti(object):
+def read_density_file(fpath):
+    """(velocity, density) columns of a TARDIS density file."""
+    with open(fpath, 'r') as inp:
+        rows = [filter(None, line.rstrip('\n').split(' '))
+                for line in itertools.islice(inp, 2, None, 1)]
+    return (tuple(float(column[1]) for column in rows),
+            tuple(float(column[2]) for column in rows))
+
+def read_abundance_file(fpath):
+    """Titanium column of a TARDIS abundance file."""
+    with open(fpath, 'r') as inp:
+        return tuple(float(filter(None, line.rstrip('\n').split(' '))[-9])
+                     for line in itertools.islice(inp, 1, None, 1))
+
+class Plot_Ti(Managed_Figure):
+
+    figure_parameters = ['element']
     
-    def __init__(self, element='Ti', show_fig=True, save_fig=False):
+    def __init__(self, element='Ti', show_fig=True, save_fig=False,
+                 force=False):
 
         self.element = element
         
@@ -43,6 +50,12 @@ class Plot_Ti(object):
         
         self.file_dens_05bl = 'density_05bl_es-0.7_ms-1.0_29.9_day.dat'
         self.file_abun_05bl = 'abundance_05bl_29.9_day.dat'
+
+        path_input = os.path.abspath(os.path.join(
+          os.environ['path_tardis_output'], '..'))
+        self.path_dens = path_input + '/INPUT_FILES/DENSITY_FILES/'
+        self.path_abun = (path_input
+                          + '/INPUT_FILES/STRATIFIED_COMPOSITION_FILES/')
         
         
         self.abun_11fe, self.dens_11fe, self.vel_11fe = [], [], []
@@ -53,9 +66,7 @@ class Plot_Ti(object):
         
         self.show_fig = show_fig
         self.save_fig = save_fig
-                        
-        self.FIG = plt.figure(figsize=(10,10))
-        self.ax = plt.subplot(111)  
+        self.force = force
 
         self.fs_label = 26
         self.fs_ticks = 26
@@ -82,44 +93,26 @@ class Plot_Ti(object):
         self.ax.minorticks_on()
         self.ax.tick_params('both', length=8, width=1, which='major')
         self.ax.tick_params('both', length=4, width=1, which='minor')
-        self.ax.xaxis.set_minor_locator(MultipleLocator(1000.))
-        self.ax.xaxis.set_major_locator(MultipleLocator(5000.))     
+        self.ax.xaxis.set_minor_locator(ticker.MultipleLocator(1000.))
+        self.ax.xaxis.set_major_locator(ticker.MultipleLocator(5000.))     
 
     def get_data(self):
         
-        path_dens = (os.path.abspath(os.path.join(path_tardis_output, '..'))
-                     + '/INPUT_FILES/DENSITY_FILES/')
-
-        path_abun = (os.path.abspath(os.path.join(path_tardis_output, '..'))
-                     + '/INPUT_FILES/STRATIFIED_COMPOSITION_FILES/')
-        
+        path_dens, path_abun = self.path_dens, self.path_abun
         
         #Note densities for 11fe and 05bl have to be scaled differently. To check!
-        with open(path_dens + self.file_dens_11fe, 'r') as inp:
-            for line in itertools.islice(inp, 2, None, 1):
-                column = line.rstrip('\n').split(' ') 
-                column = filter(None, column)
-                self.vel_11fe.append(float(column[1]))
-                self.dens_11fe.append(float(column[2]))
-                
-        with open(path_dens + self.file_dens_05bl, 'r') as inp:
-            for line in itertools.islice(inp, 2, None, 1):
-                column = line.rstrip('\n').split(' ') 
-                column = filter(None, column)
-                self.vel_05bl.append(float(column[1]))
-                self.dens_05bl.append(float(column[2]))
-
-        with open(path_abun + self.file_abun_11fe, 'r') as inp:
-            for line in itertools.islice(inp, 1, None, 1):
-                column = line.rstrip('\n').split(' ') 
-                column = filter(None, column)
-                self.abun_11fe.append(float(column[-9]))
-
-        with open(path_abun + self.file_abun_05bl, 'r') as inp:
-            for line in itertools.islice(inp, 1, None, 1):
-                column = line.rstrip('\n').split(' ') 
-                column = filter(None, column)
-                self.abun_05bl.append(float(column[-9]))
+        vel, dens = cached_loader.load(path_dens + self.file_dens_11fe,
+                                       read_density_file)
+        self.vel_11fe, self.dens_11fe = list(vel), list(dens)
+
+        vel, dens = cached_loader.load(path_dens + self.file_dens_05bl,
+                                       read_density_file)
+        self.vel_05bl, self.dens_05bl = list(vel), list(dens)
+
+        self.abun_11fe = list(cached_loader.load(
+          path_abun + self.file_abun_11fe, read_abundance_file))
+        self.abun_05bl = list(cached_loader.load(
+          path_abun + self.file_abun_05bl, read_abundance_file))
                     
     def compute_11fe_absolute_masses(self):
         
@@ -181,16 +174,31 @@ class Plot_Ti(object):
         print ('11fe model has ' + str(format(self.m_11fe[5], '.5f')) + ' Msun '
           + 'above the photosphere at maximum (v=' + str(self.v_11fe[5]) + 'km/s)')
     
+    def get_inputs(self):
+        return [self.path_dens + self.file_dens_11fe,
+                self.path_dens + self.file_dens_05bl,
+                self.path_abun + self.file_abun_11fe,
+                self.path_abun + self.file_abun_05bl]
+
+    def get_fig_fpath(self, extension='pdf'):
+        return './../OUTPUT_FILES/FIGURES/Fig_Ti_mass_fraction.' + extension
+
     def save_figure(self, extension='pdf', dpi=360):
         if self.save_fig:
-            plt.savefig('./../OUTPUT_FILES/FIGURES/Fig_Ti_mass_fraction.'
-                        + extension, format=extension, dpi=dpi)
+            plt.savefig(self.get_fig_fpath(extension), format=extension,
+                        dpi=dpi)
+            self.record_figure(extension)
         
     def show_figure(self):
         if self.show_fig:
             plt.show()
                 
     def run_comparison(self):
+        if self.is_up_to_date(extension='pdf'):
+            return
+        #pyplot is only imported for figures to be rendered.
+        self.FIG = plt.figure(figsize=(10,10))
+        self.ax = plt.subplot(111)
         self.set_fig_frame()
         self.get_data()
         self.compute_11fe_absolute_masses()                                                                 
@@ -201,4 +209,11 @@ class Plot_Ti(object):
         self.show_figure()  
 
 
-compare_spectra_object = Plot_Ti(show_fig=True, save_fig=True)
+def main(argv=None):
+    parser = get_parser('Plot the Ti mass above the photosphere of the 11fe'
+                        ' and 05bl models.', save_fig=True)
+    args = parse_args(parser, argv)
+    return Plot_Ti(**args.figure_kwargs)
+
+if __name__ == '__main__':
+    main()
@@ -5,28 +5,20 @@ the weak silicon feature (f6). This includes objects from the BSNIP sample
 and the simulation of 11fe and 05bl with scaled luminosity.
 """
 
-import os                                                               
-import sys
-import time
-
-path_tardis_output = os.environ['path_tardis_output']
+import numpy as np
 
-import matplotlib
-import cPickle
+import cached_loader
+from BSNIP_columns import read_columns, get_output_path
+from figure_manifest import Managed_Figure
+from plot_setup import Lazy_Module, plt, get_parser, parse_args
+from tardis_catalog import Tardis_Catalog
+from tardis_products import Products_Store
 
-import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib as mpl
-from matplotlib.ticker import MultipleLocator
-from matplotlib import cm
-from matplotlib import colors
-import matplotlib.collections as mcoll
-
-import colormaps as cmaps
-                                                
-mpl.rcParams['mathtext.fontset'] = 'stix'
-mpl.rcParams['mathtext.fontset'] = 'stix'
-mpl.rcParams['font.family'] = 'STIXGeneral'
+#Imported when first used, see 'plot_setup'.
+ticker = Lazy_Module('matplotlib.ticker')
+colors = Lazy_Module('matplotlib.colors')
+mcoll = Lazy_Module('matplotlib.collections')
+cmaps = Lazy_Module('colormaps')
 
 def subtype2marker(subtype_list):       
     converter = {'Ia-norm': 's', 'Ia-91bg': '*', 'Ia-91T': '^',
@@ -89,26 +81,30 @@ def colorline(x, y, z, cmap, norm, linestyle, linewidth, alpha, zorder):
 
 class Get_BSNIP(object):
     def __init__(self):
-        with open('./../OUTPUT_FILES//BSNIP.pkl', 'r') as inp:
-            self.df_BSNIP = cPickle.load(inp)
+        #Only the columns used in the plot are read.
+        self.df_BSNIP = read_columns(
+          './../OUTPUT_FILES/BSNIP',
+          ['phase', 'subtype', 'SNID']
+          + [var + '_f' + key for key in ['6', '7']
+             for var in ['pEW', 'pEW_unc', 'pEW_flag', 'BSNIP_pEW']])
                    
-class Feature_Parspace(Get_BSNIP):
+class Feature_Parspace(Get_BSNIP, Managed_Figure):
 
-    def __init__(self, lm='downbranch', show_fig=True, save_fig=False):
-                        
-        Get_BSNIP.__init__(self)
+    figure_parameters = ['lm']
+
+    def __init__(self, lm='downbranch', show_fig=True, save_fig=False,
+                 force=False):
         
         self.lm = lm
         self.show_fig = show_fig
         self.save_fig = save_fig
+        self.force = force
                 
         self.L_array = list(np.logspace(8.544, 9.72, 20))[::-1]
                
         self.list_label_11fe, self.list_label_05bl = [], []
         self.list_pkl_11fe, self.list_L_05bl = [], []
       
-        self.FIG = plt.figure(figsize=(10, 10))
-        self.ax = plt.subplot(111)  
         self.color_11fe = None
 
         self.fs_label = 26
@@ -128,10 +124,10 @@ class Feature_Parspace(Get_BSNIP):
           + r'$\rm{Si}\,\mathrm{II} \ \lambda$5972' ,fontsize=self.fs_label)        
         self.ax.set_xlim(40.,180.)
         self.ax.set_ylim(0.,70.)
-        self.ax.xaxis.set_minor_locator(MultipleLocator(5.))
-        self.ax.xaxis.set_major_locator(MultipleLocator(20.))
-        self.ax.yaxis.set_minor_locator(MultipleLocator(2.))
-        self.ax.yaxis.set_major_locator(MultipleLocator(10.))
+        self.ax.xaxis.set_minor_locator(ticker.MultipleLocator(5.))
+        self.ax.xaxis.set_major_locator(ticker.MultipleLocator(20.))
+        self.ax.yaxis.set_minor_locator(ticker.MultipleLocator(2.))
+        self.ax.yaxis.set_major_locator(ticker.MultipleLocator(10.))
         self.ax.tick_params(axis='y', which='major', labelsize=self.fs_ticks, pad=8)
         self.ax.tick_params(axis='x', which='major', labelsize=self.fs_ticks, pad=8)
         self.ax.minorticks_on()
@@ -194,10 +190,20 @@ class Feature_Parspace(Get_BSNIP):
                                      zorder=3)                     
                 
 
+    def find_synthetic_spectra(self):
+        """Check that the runs of both luminosity grids exist before anything
+        is plotted. See 'tardis_catalog'. The runs are then read from the
+        store of extracted products, see 'tardis_products'.
+        """
+        catalog = Tardis_Catalog()
+        self.paths_11fe, self.paths_05bl = [
+          catalog.require([{'grid': grid, 'lm': self.lm,
+                            'L': str(format(np.log10(L), '.3f'))}
+                           for L in self.L_array])
+          for grid in ['11fe_L-grid', '05bl_L-grid']]
+
     def add_11fe_synthetic_spectra(self):
 
-        case_folder = path_tardis_output + '11fe_L-grid/'        
-        
         cmap_L = cmaps.viridis
         Norm_L = colors.Normalize(vmin=0., vmax=len(self.L_array) + 11.)                 
 
@@ -205,43 +211,39 @@ class Feature_Parspace(Get_BSNIP):
         x_list_line, y_list_line, z_list_line = [], [], []
 
         for i, L in enumerate(self.L_array):
-            L_str = str(format(np.log10(L), '.3f'))       
-            fname = ('loglum-' + L_str +  '_line_interaction-' + self.lm) 
-            with open(case_folder + fname + '/' + fname + '.pkl', 'r') as inp:
-                
-                pkl = cPickle.load(inp)
-                                
-                list_x = pkl['pEW_f7']
-                list_x_unc = 1.2 * pkl['pEW_unc_f7']
-                list_x_flag = pkl['pEW_flag_f7']
-                        
-                list_y = pkl['pEW_f6']
-                list_y_unc = 1.2 * pkl['pEW_unc_f6']
-                list_y_flag = pkl['pEW_flag_f6']
+            pkl = self.store.load(self.paths_11fe[i])
+                            
+            list_x = pkl['pEW_f7']
+            list_x_unc = 1.2 * pkl['pEW_unc_f7']
+            list_x_flag = pkl['pEW_flag_f7']
                     
-                filling = ('full' if (list_x_flag != 1. and list_y_flag != 1.)
-                           else 'none')
-                           
-                color = cmap_L(Norm_L(i))
+            list_y = pkl['pEW_f6']
+            list_y_unc = 1.2 * pkl['pEW_unc_f6']
+            list_y_flag = pkl['pEW_flag_f6']
                 
-                #if filling == 'full': 
-                if 2. > 1.: 
-                    #Do not include objects where the features start to blend.
-                    if  L / 3.5e9 <= 1.5 and L / 3.5e9 > 0.28:
-                        
-                        #print '  yes 11fe', L / 3.5e9
-                        
-                        x_list_line.append(pkl['pEW_f7'])
-                        y_list_line.append(pkl['pEW_f6'])
-                        z_list_line.append(i)
-                                        
-                        self.ax.errorbar(
-                          list_x, list_y, xerr=list_x_unc,yerr=list_y_unc,
-                          ls='None', marker='D', markersize=10.,
-                          fillstyle=filling, capsize=0., color=color, zorder=6)                       
-                        
-                        self.color_11fe = color
-                        
+            filling = ('full' if (list_x_flag != 1. and list_y_flag != 1.)
+                       else 'none')
+                       
+            color = cmap_L(Norm_L(i))
+            
+            #if filling == 'full': 
+            if 2. > 1.: 
+                #Do not include objects where the features start to blend.
+                if  L / 3.5e9 <= 1.5 and L / 3.5e9 > 0.28:
+                    
+                    #print '  yes 11fe', L / 3.5e9
+                    
+                    x_list_line.append(pkl['pEW_f7'])
+                    y_list_line.append(pkl['pEW_f6'])
+                    z_list_line.append(i)
+                                    
+                    self.ax.errorbar(
+                      list_x, list_y, xerr=list_x_unc,yerr=list_y_unc,
+                      ls='None', marker='D', markersize=10.,
+                      fillstyle=filling, capsize=0., color=color, zorder=6)                       
+                    
+                    self.color_11fe = color
+                    
         #PLot line with gradient
         self.plot_line, = self.ax.plot(
           [np.nan], [np.nan], ls='--', linewidth=6.0, marker='None', color='k',
@@ -255,50 +257,44 @@ class Feature_Parspace(Get_BSNIP):
 
     def add_05bl_synthetic_spectra(self):           
 
-        case_folder = path_tardis_output + '05bl_L-grid/'        
-        
         list_pkl_05bl = []
         x_list, x_unc_list, x_flag_list = [], [], []
         y_list, y_unc_list, y_flag_list = [], [], []
 
         for i, L in enumerate(self.L_array):
-            L_str = str(format(np.log10(L), '.3f'))       
-            fname = ('loglum-' + L_str +  '_line_interaction-' + self.lm) 
-            with open(case_folder + fname + '/' + fname + '.pkl', 'r') as inp:
-                
-                pkl = cPickle.load(inp)
-                
-                x_flag_list = pkl['pEW_flag_f7']
-                y_flag_list = pkl['pEW_flag_f6']
-                filling = ('full' if (x_flag_list != 1. and y_flag_list != 1.)
-                           else 'none')
-                
-                #print L / 10. ** 8.861
-                #if filling == 'full': 
-                if 2. > 1.: 
-                    #Do not include objects where the features start to blend.
-                    #if  L/3.5e9 <= 1.5 and L/3.5e9 > 0.28:
-                    if  L/3.5e9 <= 1.5 and L/3.5e9 > 0.21:
-                        
-                        #print '  yes 05bl', L, L / 10. ** 8.861
-                        
-                        x = pkl['pEW_f7']
-                        y = pkl['pEW_f6']
-                        x_err = pkl['pEW_unc_f7']
-                        y_err = pkl['pEW_unc_f6']
-                                                
-                        x_list.append(x)
-                        y_list.append(y)
-                        x_unc_list.append(1.2 * x_err)
-                        y_unc_list.append(1.2 * y_err)                                        
-                
-                        self.ax.errorbar(
-                          x, y, xerr=x_err, yerr=y_err,
-                          ls='-', marker='p', markersize=14.,
-                          fillstyle=filling, capsize=0., color='g', zorder=4)
+            pkl = self.store.load(self.paths_05bl[i])
+            
+            x_flag_list = pkl['pEW_flag_f7']
+            y_flag_list = pkl['pEW_flag_f6']
+            filling = ('full' if (x_flag_list != 1. and y_flag_list != 1.)
+                       else 'none')
+            
+            #print L / 10. ** 8.861
+            #if filling == 'full': 
+            if 2. > 1.: 
+                #Do not include objects where the features start to blend.
+                #if  L/3.5e9 <= 1.5 and L/3.5e9 > 0.28:
+                if  L/3.5e9 <= 1.5 and L/3.5e9 > 0.21:
+                    
+                    #print '  yes 05bl', L, L / 10. ** 8.861
+                    
+                    x = pkl['pEW_f7']
+                    y = pkl['pEW_f6']
+                    x_err = pkl['pEW_unc_f7']
+                    y_err = pkl['pEW_unc_f6']
+                                            
+                    x_list.append(x)
+                    y_list.append(y)
+                    x_unc_list.append(1.2 * x_err)
+                    y_unc_list.append(1.2 * y_err)                                        
+            
+                    self.ax.errorbar(
+                      x, y, xerr=x_err, yerr=y_err,
+                      ls='-', marker='p', markersize=14.,
+                      fillstyle=filling, capsize=0., color='g', zorder=4)
 
-                self.ax.plot(x_list, y_list, ls='-', color='g', marker='None',
-                             zorder=3)                                 
+            self.ax.plot(x_list, y_list, ls='-', color='g', marker='None',
+                         zorder=3)                                 
 
     def add_observational_spectra(self):
 
@@ -306,8 +302,7 @@ class Feature_Parspace(Get_BSNIP):
         
         """Add 11fe observation data"""
         
-        pkl_11fe_file = open(path_data + '2011fe/2011_09_10.pkl', 'r')
-        pkl_11fe = cPickle.load(pkl_11fe_file)
+        pkl_11fe = cached_loader.load(path_data + '2011fe/2011_09_10.pkl')
 
         list_x_11fe = pkl_11fe['pEW_f7']
         list_x_unc_11fe = 1.2 * pkl_11fe['pEW_unc_f7']
@@ -327,8 +322,7 @@ class Feature_Parspace(Get_BSNIP):
 
         """Add 05bl observation data"""
 
-        pkl_05bl_file = open(path_data + '2005bl/2005_04_26.pkl', 'r')
-        pkl_05bl = cPickle.load(pkl_05bl_file)
+        pkl_05bl = cached_loader.load(path_data + '2005bl/2005_04_26.pkl')
      
         list_x_05bl = pkl_05bl['pEW_f7']
         list_x_unc_05bl = 1.2 * pkl_05bl['pEW_unc_f7']
@@ -388,17 +382,36 @@ class Feature_Parspace(Get_BSNIP):
         self.ax.legend(frameon=True, fontsize=20., numpoints=1, ncol=1,
                        handletextpad=0.2, labelspacing=0.05, loc=2)
 
+    def get_inputs(self):
+        path_data = './../INPUT_FILES/observational_spectra/'
+        return ([get_output_path('./../OUTPUT_FILES/BSNIP')]
+                + self.paths_11fe + self.paths_05bl
+                + [path_data + '2011fe/2011_09_10.pkl',
+                   path_data + '2005bl/2005_04_26.pkl'])
+
+    def get_fig_fpath(self, extension='pdf'):
+        return ('./../OUTPUT_FILES/FIGURES/Fig_parspace_' + self.lm + '.'
+                + extension)
+
     def save_figure(self, extension='pdf', dpi=360):        
-        directory = './../OUTPUT_FILES/FIGURES/'
         if self.save_fig:
-            plt.savefig(directory + 'Fig_parspace_' + self.lm + '.'
-                        + extension, format=extension, dpi=dpi)
+            plt.savefig(self.get_fig_fpath(extension), format=extension,
+                        dpi=dpi)
+            self.record_figure(extension)
         
     def show_figure(self):
         if self.show_fig:
             plt.show()
         
     def run_parspace(self):
+        self.find_synthetic_spectra()
+        if self.is_up_to_date(extension='pdf'):
+            return
+        #The data and pyplot are only loaded for figures to be rendered.
+        Get_BSNIP.__init__(self)
+        self.store = Products_Store()
+        self.FIG = plt.figure(figsize=(10, 10))
+        self.ax = plt.subplot(111)
         self.set_fig_frame()
         self.plot_BSNIP()   
         self.add_11fe_synthetic_spectra()
@@ -409,8 +422,14 @@ class Feature_Parspace(Get_BSNIP):
         self.save_figure(extension='pdf')
         self.show_figure()              
 
-parspace_object = Feature_Parspace(lm='downbranch', show_fig=False,
-                                   save_fig=True)
-#parspace_object = Feature_Parspace(lm='macroatom', show_fig=False,
-#                                   save_fig=True)
-
+def main(argv=None):
+    parser = get_parser('Plot the pEW of Si II 6355 vs. Si II 5972 of the'
+                        ' BSNIP sample and of the 11fe and 05bl L-grids.',
+                        show_fig=False, save_fig=True)
+    parser.add_argument('--lm', choices=['downbranch', 'macroatom'],
+                        default='downbranch')
+    args = parse_args(parser, argv)
+    return Feature_Parspace(lm=args.lm, **args.figure_kwargs)
+
+if __name__ == '__main__':
+    main()
@@ -1,48 +1,39 @@
 #!/usr/bin/env python
 
-import os                                                               
-import sys
-import time
-
-path_tardis_output = os.environ['path_tardis_output']
-
-import matplotlib
-import cPickle
-
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib as mpl
-import pylab
-from matplotlib.ticker import MultipleLocator
-from matplotlib import cm
-from matplotlib import colors
 from itertools import cycle
-from astropy import units as u
-                                                
-mpl.rcParams['mathtext.fontset'] = 'stix'
-mpl.rcParams['mathtext.fontset'] = 'stix'
-mpl.rcParams['font.family'] = 'STIXGeneral'
+
+import cached_loader
+from tardis_catalog import Tardis_Catalog
+from figure_manifest import Managed_Figure
+from plot_setup import Lazy_Module, plt, get_parser, parse_args
+from tardis_products import Products_Store
+
+#Imported when first used, see 'plot_setup'.
+ticker = Lazy_Module('matplotlib.ticker')
+u = Lazy_Module('astropy.units')
 
 def mean_flux(w, f, w_min, w_max):
     window_condition = ((w > w_min) & (w < w_max))  
     return np.mean(f[window_condition])
 
-class Compare_Spectra(object):
+class Compare_Spectra(Managed_Figure):
     """Code to make a figure containg a comparison between scaled 11fe and 05bl
-    models with observations.
+    models with observations. If force is False (default), a saved figure is
+    only rendered again if its inputs changed, see 'figure_manifest'.
     """
+
+    figure_parameters = ['lm']
     
-    def __init__(self, lm='downbranch', show_fig=True, save_fig=False):
+    def __init__(self, lm='downbranch', show_fig=True, save_fig=False,
+                 force=False):
         
         self.list_pkl, self.label = [], []    
 
         self.lm = lm
         self.show_fig = show_fig
         self.save_fig = save_fig
-               
-        self.FIG = plt.figure(figsize=(20,22))
-        self.ax1 = plt.subplot(121)  
-        self.ax2 = plt.subplot(122, sharey=self.ax1)
+        self.force = force
         
         self.left_top = []
         self.left_mid = []
@@ -76,10 +67,10 @@ class Compare_Spectra(object):
         self.ax1.minorticks_on()
         self.ax1.tick_params('both', length=8, width=1, which='major')
         self.ax1.tick_params('both', length=4, width=1, which='minor')
-        self.ax1.xaxis.set_minor_locator(MultipleLocator(500.))
-        self.ax1.xaxis.set_major_locator(MultipleLocator(1000.))
-        self.ax1.yaxis.set_minor_locator(MultipleLocator(1.))
-        self.ax1.yaxis.set_major_locator(MultipleLocator(5.))       
+        self.ax1.xaxis.set_minor_locator(ticker.MultipleLocator(500.))
+        self.ax1.xaxis.set_major_locator(ticker.MultipleLocator(1000.))
+        self.ax1.yaxis.set_minor_locator(ticker.MultipleLocator(1.))
+        self.ax1.yaxis.set_major_locator(ticker.MultipleLocator(5.))       
         self.ax1.tick_params(labelleft='off')       
 
         self.ax2.set_xlabel(right_x_label, fontsize=self.fs_label)
@@ -90,29 +81,28 @@ class Compare_Spectra(object):
         self.ax2.minorticks_on()
         self.ax2.tick_params('both', length=8, width=1, which='major')
         self.ax2.tick_params('both', length=4, width=1, which='minor')
-        self.ax2.xaxis.set_minor_locator(MultipleLocator(500.))
-        self.ax2.xaxis.set_major_locator(MultipleLocator(1000.))
-        self.ax2.yaxis.set_minor_locator(MultipleLocator(1.))
-        self.ax2.yaxis.set_major_locator(MultipleLocator(5.))       
+        self.ax2.xaxis.set_minor_locator(ticker.MultipleLocator(500.))
+        self.ax2.xaxis.set_major_locator(ticker.MultipleLocator(1000.))
+        self.ax2.yaxis.set_minor_locator(ticker.MultipleLocator(1.))
+        self.ax2.yaxis.set_major_locator(ticker.MultipleLocator(5.))       
         self.ax2.tick_params(labelleft='off')   
     
-    def load_spectra(self):
+    def find_spectra(self):
 
         #Define path variables.
         path_obs_11fe = './../INPUT_FILES/observational_spectra/2011fe/'
         path_obs_05bl = './../INPUT_FILES/observational_spectra/2005bl/'
 
+        #Runs are looked up in the catalog of TARDIS outputs. The paths are
+        #only resolved (and checked) once all panels have been listed.
         def get_path(event, v, L, lm, texp): 
             if event == '05bl':
-                case_folder = path_tardis_output + event + '_default_L-scaled/'
-                filename = ('velocity_start-' + v + '_loglum-' + L + '_line_'
-                        + 'interaction-' + lm + '_time_explosion-' + texp)
+                grid = event + '_default_L-scaled'
             elif event == '11fe':    
-                case_folder = path_tardis_output + event + '_default_L-scaled_UP/'
-                filename = ('line_interaction-' + lm + '_loglum-' + L
-                            + '_velocity_start-' + v + '_time_explosion-' + texp)
-            path_sufix = filename + '/' + filename + '.pkl'
-            return case_folder + path_sufix
+                grid = event + '_default_L-scaled_UP'
+            return {'grid': grid, 'v': v, 'L': L, 'lm': lm, 'texp': texp}
+
+        panels = []
                                                           
        #=-=-=-=-=-=-=-=-=-=-=-=- 11fe -> 05bl spectra -=-=-=-=-=-=-=-=-=-=-=-=
 
@@ -127,9 +117,7 @@ class Compare_Spectra(object):
                get_path('05bl', '8100', '8.617', self.lm, '12.0'),     
                path_obs_05bl + '2005_04_17.pkl']                    
         
-        for pkl_path in aux:
-            with open(pkl_path, 'r') as inp:
-                self.left_top.append(cPickle.load(inp))
+        panels.append(('left_top', aux))
 
         #t_exp = 19.1 - standard.
         aux = [path_obs_11fe + '2011_09_10.pkl',
@@ -142,9 +130,7 @@ class Compare_Spectra(object):
                get_path('05bl', '6800', '8.861', self.lm, '21.8'),
                path_obs_05bl + '2005_04_26.pkl']        
                 
-        for pkl_path in aux:
-            with open(pkl_path, 'r') as inp:
-                self.left_mid.append(cPickle.load(inp))
+        panels.append(('left_mid', aux))
 
         #t_exp = 28.3 - standard.  
         aux = [path_obs_11fe + '2011_09_19.pkl',
@@ -157,9 +143,7 @@ class Compare_Spectra(object):
                get_path('05bl', '3350', '8.594', self.lm, '29.9'),
                path_obs_05bl + '2005_05_04.pkl']        
                 
-        for pkl_path in aux:
-            with open(pkl_path, 'r') as inp:
-                self.left_bot.append(cPickle.load(inp))    
+        panels.append(('left_bot', aux))
 
        #=-=-=-=-=-=-=-=-=-=-=-=- 05bl -> 11fe spectra -=-=-=-=-=-=-=-=-=-=-=-=
 
@@ -174,9 +158,7 @@ class Compare_Spectra(object):
                get_path('05bl', '8100', '8.617', self.lm, '12.0'),
                path_obs_05bl + '2005_04_17.pkl']        
                 
-        for pkl_path in aux:
-            with open(pkl_path, 'r') as inp:
-                self.right_top.append(cPickle.load(inp)) 
+        panels.append(('right_top', aux))
 
         #t_exp = 21.8
         aux = [path_obs_11fe + '2011_09_10.pkl',
@@ -189,9 +171,7 @@ class Compare_Spectra(object):
                get_path('05bl', '6800', '8.861', self.lm, '21.8'),
                path_obs_05bl + '2005_04_26.pkl']        
                 
-        for pkl_path in aux:
-            with open(pkl_path, 'r') as inp:
-                self.right_mid.append(cPickle.load(inp)) 
+        panels.append(('right_mid', aux))
 
         #t_exp = 28.3 - standard.
         aux = [path_obs_11fe + '2011_09_19.pkl',
@@ -204,9 +184,23 @@ class Compare_Spectra(object):
                get_path('05bl', '3350', '8.594', self.lm, '29.9'),
                path_obs_05bl + '2005_05_04.pkl']        
                 
-        for pkl_path in aux:
-            with open(pkl_path, 'r') as inp:
-                self.right_bot.append(cPickle.load(inp)) 
+        panels.append(('right_bot', aux))
+
+        self.panels = panels
+        self.paths = Tardis_Catalog().require(
+          [query for (panel, aux) in panels for query in aux])
+
+    def load_spectra(self):
+
+        #Spectra are read on a thread pool, so that the first panels can be
+        #drawn while the others are still loading. Each panel is a sequence
+        #of its spectra, see 'cached_loader.prefetch'.
+        spectra = cached_loader.prefetch(
+          self.paths, Products_Store().load)
+        i = 0
+        for (panel, aux) in self.panels:
+            setattr(self, panel, spectra[i:i + len(aux)])
+            i += len(aux)
 
     def plotting_11fe_to_05bl(self):
         """Plot the left panel"""
@@ -420,18 +414,32 @@ class Compare_Spectra(object):
         print '11fe +0.1 days velocity from cooler model: ', self.left_mid[5]['velocity_f7']
         
         
+    def get_inputs(self):
+        return self.paths
+
+    def get_fig_fpath(self, extension='pdf'):
+        return ('./../OUTPUT_FILES/FIGURES/'
+                + 'Fig_combined_11fe_05bl_transition_'
+                + self.lm + '_UP.' + extension)
+
     def save_figure(self, extension='pdf', dpi=360):
         if self.save_fig:
-            plt.savefig('./../OUTPUT_FILES/FIGURES/'
-                        + 'Fig_combined_11fe_05bl_transition_'
-                        + self.lm + '_UP.' + extension, format=extension,
+            plt.savefig(self.get_fig_fpath(extension), format=extension,
                         dpi=dpi)
+            self.record_figure(extension)
         
     def show_figure(self):
         if self.show_fig:
             plt.show()
                 
     def run_comparison(self):
+        self.find_spectra()
+        if self.is_up_to_date(extension='pdf'):
+            return
+        #pyplot is only imported for figures to be rendered.
+        self.FIG = plt.figure(figsize=(20,22))
+        self.ax1 = plt.subplot(121)
+        self.ax2 = plt.subplot(122, sharey=self.ax1)
         self.set_fig_frame()
         self.load_spectra()
         plt.tight_layout()
@@ -442,11 +450,14 @@ class Compare_Spectra(object):
         self.save_figure()
         self.show_figure()  
 
-compare_spectra_object = Compare_Spectra(lm='downbranch',
-                                         show_fig=True, save_fig=True)
-
-#compare_spectra_object = Compare_Spectra(lm='downbranch',
-#                                         show_fig=False, save_fig=True)
-#compare_spectra_object = Compare_Spectra(lm='macroatom',
-#                                         show_fig=False, save_fig=True)
-
+def main(argv=None):
+    parser = get_parser('Compare the spectra of 11fe and 05bl scaled in'
+                        ' luminosity with the observed spectra.',
+                        save_fig=True)
+    parser.add_argument('--lm', choices=['downbranch', 'macroatom'],
+                        default='downbranch')
+    args = parse_args(parser, argv)
+    return Compare_Spectra(lm=args.lm, **args.figure_kwargs)
+
+if __name__ == '__main__':
+    main()
@@ -2,18 +2,17 @@
 
 ############################  IMPORTS  #################################
 
-import matplotlib
-import cPickle
-
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib as mpl
-import itertools
-from matplotlib.ticker import MultipleLocator
-                                                        
-mpl.rcParams['mathtext.fontset'] = 'stix'
-mpl.rcParams['mathtext.fontset'] = 'stix'
-mpl.rcParams['font.family'] = 'STIXGeneral'
+
+from BSNIP_columns import read_columns, get_output_path
+from figure_manifest import Managed_Figure
+from plot_setup import plt, get_parser, parse_args
+
+#Range of the axes of each feature, keyed by (feature, key).
+default_ranges = {
+  ('pEW', '7'): [0., 200.], ('pEW', '6'): [0., 70.],
+  ('depth', '7'): [0., 1.], ('depth', '6'): [0., 1.],
+  ('velocity', '7'): [7., 15.], ('velocity', '6'): [7., 15.]}
 
 def subtype2marker(subtype_list):       
     converter = {'Ia-norm': 's', 'Ia-91bg': '*', 'Ia-91T': '^',
@@ -33,22 +32,27 @@ def flag2filling(flag_list):
     return filling
     
 class get_BSNIP(object):
-    def __init__(self):
-        with open('./../OUTPUT_FILES/BSNIP.pkl', 'r') as inp:
-            self.df_BSNIP = cPickle.load(inp)
+    def __init__(self, feature, key):
+        #Only the columns used in the plot are read. Uncertainties and flags
+        #are not available for every feature.
+        self.df_BSNIP = read_columns(
+          './../OUTPUT_FILES/BSNIP',
+          ['phase', 'subtype', feature + '_f' + key,
+           'BSNIP_' + feature + '_f' + key,
+           'BSNIP_' + feature + '_unc_f' + key,
+           feature + '_unc_f' + key, feature + '_flag_f' + key],
+          skip_missing=True)
                     
-class Compare_Feature(get_BSNIP):
+class Compare_Feature(get_BSNIP, Managed_Figure):
+
+    figure_parameters = ['feature', 'key', 'feature_range']
 
     def __init__(self, feature, key, feature_range, show_fig=True,
-                 save_fig=False):
-                                     
-        get_BSNIP.__init__(self)
+                 save_fig=False, force=False):
                             
         self.show_fig = show_fig
         self.save_fig = save_fig
-        
-        self.FIG = plt.figure(figsize=(10, 10))
-        self.ax = plt.subplot(111)  
+        self.force = force
         
         self.feature = feature
         self.key = key
@@ -196,12 +200,19 @@ class Compare_Feature(get_BSNIP):
         self.ax.legend(frameon=True, fontsize=self.fs_legend, numpoints=1,
                        ncol=1,  columnspacing=0., labelspacing=0.1, loc=2)
 
+    def get_inputs(self):
+        return [get_output_path('./../OUTPUT_FILES/BSNIP')]
+
+    def get_fig_fpath(self, extension='pdf'):
+        fig_name = 'compare_' + self.feature + '_f' + self.key
+        return './../OUTPUT_FILES/FIGURES/Fig_' + fig_name + '.' + extension
+
     def save_figure(self, extension='pdf', dpi=360):
         if self.save_fig:
             try:
-                fig_name = 'compare_' + self.feature + '_f' + self.key
-                plt.savefig('./../OUTPUT_FILES/FIGURES/Fig_' + fig_name + '.'
-                            + extension, format=extension, dpi=dpi)
+                plt.savefig(self.get_fig_fpath(extension), format=extension,
+                            dpi=dpi)
+                self.record_figure(extension)
             except:
                 pass             
         
@@ -210,6 +221,12 @@ class Compare_Feature(get_BSNIP):
             plt.show()
         
     def run_feature(self):
+        if self.is_up_to_date(extension='pdf'):
+            return
+        #The data and pyplot are only loaded for figures to be rendered.
+        get_BSNIP.__init__(self, self.feature, self.key)
+        self.FIG = plt.figure(figsize=(10, 10))
+        self.ax = plt.subplot(111)
         self.set_fig_frame()
         self.plot_comparison()
         self.plot_reference()
@@ -217,20 +234,21 @@ class Compare_Feature(get_BSNIP):
         self.save_figure(extension='pdf')
         self.show_figure()
         
-#Compare_Feature(feature='pEW', key='7', feature_range=[0., 200.],
-#                show_fig=True, save_fig=False) 
-
-Compare_Feature(feature='pEW', key='6', feature_range=[0., 70.],
-                show_fig=True, save_fig=False)                                      
-
-#Compare_Feature(feature='depth', key='7', feature_range=[0., 1.],
-#                show_fig=True, save_fig=False) 
-
-#Compare_Feature(feature='depth', key='6', feature_range=[0., 1.],
-#                show_fig=True, save_fig=False)
-
-#Compare_Feature(feature='velocity', key='7', feature_range=[7., 15.],
-#                show_fig=True, save_fig=False)               
-
-#Compare_Feature(feature='velocity', key='6', feature_range=[7., 15.],
-#                show_fig=True, save_fig=False)                  
+def main(argv=None):
+    parser = get_parser('Compare a feature of the BSNIP sample measured in'
+                        ' this work with the values of Silverman et al.')
+    parser.add_argument('--feature', choices=['pEW', 'depth', 'velocity'],
+                        default='pEW')
+    parser.add_argument('--key', choices=['6', '7'], default='6')
+    parser.add_argument(
+      '--feature-range', type=float, nargs=2, default=None,
+      help="Default is given by 'default_ranges'.")
+    args = parse_args(parser, argv)
+    feature_range = args.feature_range
+    if feature_range is None:
+        feature_range = default_ranges[(args.feature, args.key)]
+    return Compare_Feature(feature=args.feature, key=args.key,
+                           feature_range=feature_range, **args.figure_kwargs)
+
+if __name__ == '__main__':
+    main()
@@ -1,36 +1,29 @@
 #!/usr/bin/env python
 
-import os                                                               
-import sys
+import numpy as np
 
-path_tardis_output = os.environ['path_tardis_output']
+import cached_loader
+from tardis_catalog import Tardis_Catalog
+from figure_manifest import Managed_Figure
+from plot_setup import Lazy_Module, plt, get_parser, parse_args
+from tardis_products import Products_Store
 
-import matplotlib
-import cPickle
+#Imported when first used, see 'plot_setup'.
+ticker = Lazy_Module('matplotlib.ticker')
 
-import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib as mpl
-import pylab
-import itertools
-from matplotlib.ticker import MultipleLocator
-                                                
-mpl.rcParams['mathtext.fontset'] = 'stix'
-mpl.rcParams['mathtext.fontset'] = 'stix'
-mpl.rcParams['font.family'] = 'STIXGeneral'
-
-class Macroatom_Comparison(object):
+class Macroatom_Comparison(Managed_Figure):
     
-    def __init__(self, show_fig=True, save_fig=False):
+    def __init__(self, show_fig=True, save_fig=False, force=False):
         """Creates a figure where spectra computed using the 'downbranch' and
-        'macroatom' modes are compared for both 11fe and 05bl.
+        'macroatom' modes are compared for both 11fe and 05bl. If force is
+        False (default), a saved figure is only rendered again if its inputs
+        changed, see 'figure_manifest'.
         """
 
         self.show_fig = show_fig
         self.save_fig = save_fig 
+        self.force = force
        
-        self.FIG = plt.figure(figsize=(10,10))
-        self.ax = plt.subplot(111)  
         self.pkl_11fe_macroatom, self.pkl_11fe_downbranch = None, None  
         self.pkl_05bl_macroatom, self.pkl_05bl_downbranch = None, None  
         self.pkl_11fe_obs, self.pkl_11fe_obs = None, None  
@@ -57,49 +50,47 @@ class Macroatom_Comparison(object):
         self.ax.minorticks_on()
         self.ax.tick_params('both', length=8, width=1, which='major')
         self.ax.tick_params('both', length=4, width=1, which='minor')
-        self.ax.xaxis.set_minor_locator(MultipleLocator(500.))
-        self.ax.xaxis.set_major_locator(MultipleLocator(1000.))
-        self.ax.yaxis.set_minor_locator(MultipleLocator(0.5))
-        self.ax.yaxis.set_major_locator(MultipleLocator(2.))        
+        self.ax.xaxis.set_minor_locator(ticker.MultipleLocator(500.))
+        self.ax.xaxis.set_major_locator(ticker.MultipleLocator(1000.))
+        self.ax.yaxis.set_minor_locator(ticker.MultipleLocator(0.5))
+        self.ax.yaxis.set_major_locator(ticker.MultipleLocator(2.))        
         self.ax.tick_params(labelleft='off')                
     
-    def load_spectra(self):
+    def find_spectra(self):
 
         def get_path(event, v, L, lm, texp): 
-            case_folder = path_tardis_output + event + '_default_L-scaled/'
-            filename = ('velocity_start-' + v + '_loglum-' + L + '_line_'
-                    + 'interaction-' + lm + '_time_explosion-' + texp)
-            path_sufix = filename + '/' + filename + '.pkl'
-            return case_folder + path_sufix
-            
+            return {'grid': event + '_default_L-scaled', 'v': v, 'L': L,
+                    'lm': lm, 'texp': texp}
+
+        #Check that all the runs exist before loading any of them.
+        path_data = './../INPUT_FILES/observational_spectra/'
+        self.fnames = Tardis_Catalog().require([
+          get_path('11fe', '10700', '9.362', 'downbranch', '12.1'),
+          get_path('11fe', '10700', '9.362', 'macroatom', '12.1'),
+          get_path('05bl', '8100', '8.617', 'downbranch', '12.0'),
+          get_path('05bl', '8100', '8.617', 'macroatom', '12.0'),
+          path_data + '2011fe/2011_09_03.pkl',
+          path_data + '2005bl/2005_04_17.pkl'])
+
+    def load_spectra(self):
+
+        fnames = self.fnames
+        store = Products_Store()
+
         """11fe"""
 
-        fname = get_path('11fe', '10700', '9.362', 'downbranch', '12.1')
-        with open(fname, 'r') as inp:
-            self.pkl_11fe_downbranch = cPickle.load(inp)        
-        
-        fname = get_path('11fe', '10700', '9.362', 'macroatom', '12.1')
-        with open(fname, 'r') as inp:
-            self.pkl_11fe_macroatom = cPickle.load(inp)
+        self.pkl_11fe_downbranch = store.load(fnames[0])
+        self.pkl_11fe_macroatom = store.load(fnames[1])
 
         """05bl"""  
 
-        fname = get_path('05bl', '8100', '8.617', 'downbranch', '12.0')
-        with open(fname, 'r') as inp:
-            self.pkl_05bl_downbranch = cPickle.load(inp)
-        
-        fname = get_path('05bl', '8100', '8.617', 'macroatom', '12.0')
-        with open(fname, 'r') as inp:
-            self.pkl_05bl_macroatom = cPickle.load(inp)
+        self.pkl_05bl_downbranch = store.load(fnames[2])
+        self.pkl_05bl_macroatom = store.load(fnames[3])
         
         """Observational"""
 
-        path_data = './../INPUT_FILES/observational_spectra/'
-        with open(path_data + '2011fe/2011_09_03.pkl', 'r') as inp:
-            self.pkl_11fe_obs = cPickle.load(inp)                       
-
-        with open(path_data + '2005bl/2005_04_17.pkl', 'r') as inp:
-            self.pkl_05bl_obs = cPickle.load(inp)                   
+        self.pkl_11fe_obs = cached_loader.load(fnames[4])
+        self.pkl_05bl_obs = cached_loader.load(fnames[5])
 
     def plotting(self):
 
@@ -157,17 +148,29 @@ class Macroatom_Comparison(object):
         self.ax.legend(frameon=False, fontsize=20., numpoints=1, ncol=1,
                        labelspacing=0.05, loc=1)        
 
+    def get_inputs(self):
+        return self.fnames
+
+    def get_fig_fpath(self, extension='pdf'):
+        return './../OUTPUT_FILES/FIGURES/Fig_line_mode' + '.' + extension
+
     def save_figure(self, extension='pdf', dpi=360):        
-        directory = './../OUTPUT_FILES/FIGURES/'
         if self.save_fig:
-            plt.savefig(directory + 'Fig_line_mode' + '.' + extension,
-                        format=extension, dpi=dpi)
+            plt.savefig(self.get_fig_fpath(extension), format=extension,
+                        dpi=dpi)
+            self.record_figure(extension)
         
     def show_figure(self):
         if self.show_fig:
             plt.show()
                 
     def run_comparison(self):
+        self.find_spectra()
+        if self.is_up_to_date(extension='pdf'):
+            return
+        #pyplot is only imported for figures to be rendered.
+        self.FIG = plt.figure(figsize=(10,10))
+        self.ax = plt.subplot(111)
         self.set_fig_frame()
         self.load_spectra()
         plt.tight_layout()
@@ -175,4 +178,12 @@ class Macroatom_Comparison(object):
         self.save_figure()
         self.show_figure()  
 
-compare_spectra_object = Macroatom_Comparison(show_fig=True, save_fig=True)
+def main(argv=None):
+    parser = get_parser("Compare the 11fe and 05bl spectra computed in the"
+                        " 'downbranch' and 'macroatom' modes.",
+                        save_fig=True)
+    args = parse_args(parser, argv)
+    return Macroatom_Comparison(**args.figure_kwargs)
+
+if __name__ == '__main__':
+    main()
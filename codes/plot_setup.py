@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import argparse
+import importlib
+
+class Lazy_Module(object):
+    """Module which is only imported when one of its attributes is first
+    accessed, e.g. plt = Lazy_Module('matplotlib.pyplot').
+
+    Parameters
+    ----------
+    name : ~str
+        Full name of the module.
+    on_import : ~function
+        Called with the module right after it is imported. Default is None.
+
+    Notes
+    -----
+    Importing the plotting scripts therefore does not import matplotlib,
+    astropy or pandas, which take most of the start-up time of a script,
+    and figures which are up to date (see 'figure_manifest') are skipped
+    without ever importing them.
+    """
+
+    def __init__(self, name, on_import=None):
+        self.name = name
+        self.on_import = on_import
+        self.module = None
+
+    def __getattr__(self, attr):
+        if self.module is None:
+            self.module = importlib.import_module(self.name)
+            if self.on_import is not None:
+                self.on_import(self.module)
+        return getattr(self.module, attr)
+
+def set_style(pyplot):
+    pyplot.rcParams['mathtext.fontset'] = 'stix'
+    pyplot.rcParams['font.family'] = 'STIXGeneral'
+
+#Shared by the plotting scripts, so that the style is only set once.
+plt = Lazy_Module('matplotlib.pyplot', on_import=set_style)
+
+def use_batch_backend():
+    """Select the non-interactive Agg backend, so that figures can be saved
+    on nodes without a display. Called before pyplot is imported, since
+    the backend cannot be selected afterwards in older matplotlib versions.
+    """
+    import matplotlib
+    if 'matplotlib.pyplot' in sys.modules:
+        plt.switch_backend('Agg')
+    else:
+        matplotlib.use('Agg')
+
+def has_display():
+    """False on Linux nodes without an X or Wayland display, where showing
+    a figure fails or hangs.
+    """
+    if not sys.platform.startswith('linux'):
+        return True
+    return bool(os.environ.get('DISPLAY')
+                or os.environ.get('WAYLAND_DISPLAY'))
+
+def get_parser(description, show_fig=True, save_fig=False):
+    """Argument parser with the options shared by the plotting scripts.
+
+    Parameters
+    ----------
+    description : ~str
+        Description of the script.
+    show_fig : ~bool
+        Whether the figure is shown by default.
+    save_fig : ~bool
+        Whether the figure is saved by default.
+
+    Notes
+    -----
+    '--show'/'--no-show' and '--save'/'--no-save' override the defaults of
+    the script. '--batch' neither shows the figure nor needs a display: the
+    Agg backend is selected and the figure is saved unless '--no-save' is
+    given. Scripts run in batch mode if there is no display.
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--show', dest='show', action='store_true',
+                        help='Show the figure on the screen.')
+    parser.add_argument('--no-show', dest='show', action='store_false')
+    parser.add_argument('--save', dest='save', action='store_true',
+                        help='Save the figure.')
+    parser.add_argument('--no-save', dest='save', action='store_false')
+    parser.add_argument(
+      '--batch', action='store_true',
+      help='Save the figure with the Agg backend, without showing it.')
+    parser.add_argument(
+      '--force', action='store_true',
+      help='Render the figure even if its inputs have not changed.')
+    parser.set_defaults(show=show_fig, save=None)
+    parser.default_save = save_fig
+    return parser
+
+def parse_args(parser, argv=None):
+    """Parse the arguments and select the backend. Returns the arguments,
+    plus 'figure_kwargs' (show_fig, save_fig and force) to be passed to the
+    figure class.
+    """
+    args = parser.parse_args(argv)
+    if args.show and not args.batch and not has_display():
+        print '  -NO DISPLAY: running in batch mode.'
+        args.batch = True
+    if args.batch:
+        args.show = False
+    if args.save is None:
+        args.save = parser.default_save or args.batch
+    if not args.show:
+        use_batch_backend()
+    args.figure_kwargs = {'show_fig': args.show, 'save_fig': args.save,
+                          'force': args.force}
+    return args
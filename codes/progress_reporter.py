@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+import sys
+import time
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours > 0:
+        return str(hours) + 'h' + str(minutes).zfill(2) + 'm'
+    return str(minutes) + 'm' + str(seconds).zfill(2) + 's'
+
+class Progress_Reporter(object):
+    """Throttled progress report of a loop over N_total items, showing the
+    rate, the moving average of the latency, the ETA and the failures.
+
+    Parameters
+    ----------
+    N_total : ~int
+        Number of items to be processed.
+    label : ~str
+        Name of the items, used in the report. Default is 'spectra'.
+    batch : ~bool
+        If True, every report is printed as a new log line. Otherwise a
+        single status line is overwritten. Default is None, which uses batch
+        mode unless the output is a terminal.
+    interval : ~float
+        Minimum time (s) between reports. Default is None, which uses 30s in
+        batch mode and 0.5s otherwise.
+    alpha : ~float
+        Weight of the latest latency in the exponential moving average.
+    stream : ~file
+        Where the report is written. Default is sys.stdout.
+
+    Notes
+    -----
+    'update' is called once per item, in the process collecting the results,
+    so the report also works when items are computed by a pool of workers.
+    The rate is the number of items completed per second of wall time.
+    """
+
+    def __init__(self, N_total, label='spectra', batch=None, interval=None,
+                 alpha=0.1, stream=sys.stdout):
+        self.N_total = N_total
+        self.label = label
+        self.stream = stream
+        if batch is None:
+            batch = not (hasattr(stream, 'isatty') and stream.isatty())
+        self.batch = batch
+        if interval is None:
+            interval = 30. if batch else 0.5
+        self.interval = interval
+        self.alpha = alpha
+
+        self.N_done, self.N_failed = 0, 0
+        self.latency = None
+        self.time_start = time.time()
+        self.time_report = self.time_start
+
+    def update(self, latency=None, failed=False):
+        """Count one completed item. latency (s) is None for items which
+        were not computed, e.g. taken from a cache.
+        """
+        self.N_done += 1
+        self.N_failed += int(failed)
+        if latency is not None:
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency += self.alpha * (latency - self.latency)
+
+        now = time.time()
+        if now - self.time_report >= self.interval:
+            self.time_report = now
+            self.report()
+
+    def get_status(self):
+        elapsed = time.time() - self.time_start
+        rate = self.N_done / elapsed if elapsed > 0. else 0.
+        status = (str(self.N_done) + '/' + str(self.N_total) + ' '
+                  + self.label)
+        if self.N_total > 0:
+            status += (' (' + format(100. * self.N_done / self.N_total, '.1f')
+                       + '%)')
+        status += ', ' + format(rate, '.2f') + ' ' + self.label + '/s'
+        if self.latency is not None:
+            status += ', latency ' + format(self.latency, '.2f') + 's'
+        if rate > 0. and self.N_done < self.N_total:
+            status += (', ETA '
+                       + format_duration((self.N_total - self.N_done) / rate))
+        status += ', ' + str(self.N_failed) + ' failed'
+        return status
+
+    def report(self):
+        if self.batch:
+            self.stream.write('    -PROGRESS: ' + self.get_status() + '\n')
+        else:
+            self.stream.write('\r    -PROGRESS: ' + self.get_status()
+                              + ' ' * 4)
+        self.stream.flush()
+
+    def finish(self):
+        """Report the final state, regardless of the throttling."""
+        self.report()
+        if not self.batch:
+            self.stream.write('\n')
+            self.stream.flush()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+class Ragged_Array(object):
+    """Sequence of 1-D arrays of varying length, stored as one contiguous
+    buffer plus the int64 offsets where each row starts. Rows are returned as
+    views of the buffer, so they are never copied.
+
+    Parameters
+    ----------
+    data : ~np.array
+        Concatenated rows. Default is None, which creates an empty array that
+        can be filled with 'append'.
+    offsets : ~np.array
+        Start of each row in data, followed by the end of the last row.
+    mask : ~np.array
+        Boolean array, True for missing rows. Default is None (no missing
+        rows).
+    dtype : ~np.dtype
+        Type of the buffer, only used if data is None. Default is None, which
+        takes the type of the first row appended.
+
+    Notes
+    -----
+    Missing rows have zero length and are returned as nan, which is how
+    pandas fills a missing entry in an object column. While appending, the
+    buffer grows by doubling its capacity, so that building an array of N
+    rows only copies the data O(log N) times.
+    """
+
+    def __init__(self, data=None, offsets=None, mask=None, dtype=None):
+        if data is None:
+            self._buffer = None
+            self._offsets = np.zeros(1, dtype=np.int64)
+            self._mask = np.zeros(0, dtype=bool)
+            self._N = 0
+            self.dtype = None if dtype is None else np.dtype(dtype)
+        else:
+            self._buffer = data
+            self._offsets = np.asarray(offsets, dtype=np.int64)
+            self._N = len(self._offsets) - 1
+            if mask is None:
+                mask = np.zeros(self._N, dtype=bool)
+            self._mask = np.asarray(mask, dtype=bool)
+            self.dtype = data.dtype
+
+    @classmethod
+    def from_arrays(cls, arrays, dtype=None):
+        ragged = cls(dtype=dtype)
+        for array in arrays:
+            ragged.append(array)
+        return ragged
+
+    @classmethod
+    def concatenate(cls, list_ragged, dtype=None):
+        """Join several Ragged_Array objects, row after row."""
+        if dtype is None and list_ragged:
+            dtype = list_ragged[0].dtype
+        ragged = cls(dtype=dtype)
+        ragged.reserve(sum([len(part.data) for part in list_ragged]))
+        for part in list_ragged:
+            for i in range(len(part)):
+                ragged.append(part[i])
+        return ragged
+
+    @classmethod
+    def load(cls, fpath, mmap_mode='r'):
+        """Load an array written by 'save'. The buffer is memory-mapped
+        unless mmap_mode is None.
+        """
+        try:
+            data = np.load(fpath + '.data.npy', mmap_mode=mmap_mode)
+        except ValueError:
+            #Empty buffers cannot be memory-mapped.
+            data = np.load(fpath + '.data.npy')
+        return cls(data, np.load(fpath + '.offsets.npy'),
+                   np.load(fpath + '.mask.npy'))
+
+    def save(self, fpath):
+        """Write the buffer, offsets and mask to fpath + '.data.npy',
+        '.offsets.npy' and '.mask.npy'.
+        """
+        np.save(fpath + '.data.npy', self.data)
+        np.save(fpath + '.offsets.npy', self.offsets)
+        np.save(fpath + '.mask.npy', self.mask)
+
+    def __reduce__(self):
+        #Only the filled part of the buffer is pickled.
+        return (Ragged_Array, (self.data, self.offsets, self.mask))
+
+    def reserve(self, size):
+        """Make sure the buffer can hold 'size' elements."""
+        capacity = 0 if self._buffer is None else len(self._buffer)
+        if size > capacity:
+            buffer = np.empty(max(size, 2 * capacity), dtype=self.dtype)
+            if self._buffer is not None:
+                buffer[:self._offsets[self._N]] = (
+                  self._buffer[:self._offsets[self._N]])
+            self._buffer = buffer
+
+    def append(self, array):
+        """Copy a row to the end of the buffer. None or nan adds a missing
+        row.
+        """
+        missing = array is None or (isinstance(array, float)
+                                    and np.isnan(array))
+        if not missing:
+            array = np.asarray(array)
+            if self.dtype is None:
+                self.dtype = array.dtype
+        start = self._offsets[self._N]
+        stop = start + (0 if missing else len(array))
+
+        if len(self._offsets) == self._N + 1:
+            self._offsets = np.concatenate(
+              (self._offsets, np.zeros(max(self._N, 1), dtype=np.int64)))
+            self._mask = np.concatenate(
+              (self._mask, np.zeros(max(self._N, 1), dtype=bool)))
+        if not missing:
+            self.reserve(stop)
+            self._buffer[start:stop] = array
+        self._offsets[self._N + 1] = stop
+        self._mask[self._N] = missing
+        self._N += 1
+
+    @property
+    def data(self):
+        if self._buffer is None:
+            return np.zeros(0, dtype=self.dtype)
+        return self._buffer[:self._offsets[self._N]]
+
+    @property
+    def offsets(self):
+        return self._offsets[:self._N + 1]
+
+    @property
+    def mask(self):
+        return self._mask[:self._N]
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + self.offsets.nbytes + self.mask.nbytes
+
+    def __len__(self):
+        return self._N
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._N
+        if not 0 <= i < self._N:
+            raise IndexError('Row ' + str(i) + ' out of range.')
+        if self._mask[i]:
+            return np.nan
+        return np.asarray(self._buffer[self._offsets[i]:self._offsets[i + 1]])
+
+    def __iter__(self):
+        for i in range(self._N):
+            yield self[i]
+
+    def to_object_array(self):
+        """Object array of row views, e.g. to build a dataframe column."""
+        values = np.empty(self._N, dtype=object)
+        for i in range(self._N):
+            values[i] = self[i]
+        return values
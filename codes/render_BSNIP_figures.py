@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import hashlib
+import cPickle
+import traceback
+import multiprocessing
+
+import matplotlib.pyplot as plt
+
+import numpy as np
+
+from BSNIP_columns import read_columns
+
+def hash_inputs(D):
+    """Hash of the content of a result dictionary, which determines whether
+    its figure has to be rendered again.
+    """
+    md5 = hashlib.md5()
+    for key in sorted(D.keys()):
+        value = D[key]
+        md5.update(str(key) + '=')
+        if isinstance(value, np.ndarray):
+            md5.update(str(value.dtype) + str(value.shape))
+            md5.update(np.ascontiguousarray(value).data)
+        else:
+            md5.update(repr(value))
+        md5.update(';')
+    return md5.hexdigest()
+
+def render_figure(task):
+    """Render the figure of a single spectrum. Defined at the module level so
+    that it can be dispatched to worker processes.
+    """
+    #Imported here, so that compute_BSNIP_features can run without tardis.
+    import tardis.tardistools.compute_features as cp
+    fname, D = task
+    try:
+        cp.Plot_Spectra(D=D, outfile=fname, show_fig=False, save_fig=True)
+    except Exception:
+        return fname, traceback.format_exc()
+    finally:
+        plt.close('all')
+    return fname, None
+
+class Render_Figures(object):
+    """Renders the figure of every spectrum analysed in a BSNIP run. This is
+    independent of the feature computation, so that it can be run on its own
+    from a saved output file.
+
+    Parameters
+    ----------
+    filename : ~str
+        Name of the BSNIP output. Figures are saved under
+        './../OUTPUT_FILES/<filename>_FIGURES/'.
+    df : ~pandas dataframe
+        Results to be plotted. Default is None, in which case these are read
+        from the output of './../OUTPUT_FILES/<filename>', see
+        'BSNIP_columns.read_columns'.
+    workers : ~int
+        Number of rendering processes. Default is 1.
+    force : ~bool
+        If True, render all figures, even those whose inputs have not changed.
+
+    Notes
+    -----
+    A manifest stores the hash of the data used for each figure. Figures
+    which exist and whose data has not changed since they were last written
+    are skipped.
+
+    Usage: python render_BSNIP_figures.py [filename] [workers] [--force]
+    """
+
+    def __init__(self, filename='BSNIP', df=None, workers=1, force=False):
+        self.filename = filename
+        self.df = df
+        self.workers = workers
+        self.force = force
+        self.top_dir = './../OUTPUT_FILES/' + filename + '_FIGURES/'
+        self.manifest_fp = self.top_dir + 'manifest.pkl'
+        self.manifest = {}
+        self.failed = []
+
+    def load_manifest(self):
+        if os.path.isfile(self.manifest_fp):
+            with open(self.manifest_fp, 'rb') as inp:
+                self.manifest = cPickle.load(inp)
+
+    def save_manifest(self):
+        with open(self.manifest_fp, 'wb') as out:
+            cPickle.dump(self.manifest, out,
+                         protocol=cPickle.HIGHEST_PROTOCOL)
+
+    def get_tasks(self, hashes):
+        """Generate the figures that need to be rendered."""
+        for index, row in self.df.iterrows():
+            fname = self.top_dir + str(index) + '.png'
+            D = row.to_dict()
+            hashes[fname] = hash_inputs(D)
+            if (not self.force and os.path.isfile(fname)
+              and self.manifest.get(fname) == hashes[fname]):
+                continue
+            yield fname, D
+
+    def run_rendering(self):
+        print '  -RENDERING FIGURES...'
+        
+        #Figures are only saved to disk. Switching to Agg (rather than calling
+        #matplotlib.use) also works if pyplot has already been imported, e.g.
+        #by compute_features. Worker processes inherit the backend.
+        plt.switch_backend('Agg')
+        if not os.path.exists(self.top_dir):
+            os.makedirs(self.top_dir)
+        if self.df is None:
+            self.df = read_columns('./../OUTPUT_FILES/' + self.filename)
+        self.load_manifest()
+
+        hashes = {}
+        tasks = self.get_tasks(hashes)
+        if self.workers > 1:
+            pool = multiprocessing.Pool(processes=self.workers)
+            results = pool.imap_unordered(render_figure, tasks)
+        else:
+            pool = None
+            results = (render_figure(task) for task in tasks)
+
+        N_rendered = 0
+        for fname, error in results:
+            if error is None:
+                self.manifest[fname] = hashes[fname]
+                N_rendered += 1
+            else:
+                self.failed.append((fname, error))
+                self.manifest.pop(fname, None)
+
+        if pool is not None:
+            pool.close()
+            pool.join()
+        self.save_manifest()
+
+        print ('    -' + str(N_rendered) + ' rendered, '
+               + str(len(self.df) - N_rendered - len(self.failed))
+               + ' up to date, ' + str(len(self.failed)) + ' failed.')
+        for fname, error in self.failed:
+            print '    -' + fname + ': ' + error.strip().split('\n')[-1]
+        return self
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if arg != '--force']
+    filename = args[0] if len(args) > 0 else 'BSNIP'
+    workers = int(args[1]) if len(args) > 1 else 1
+    Render_Figures(filename=filename, workers=workers,
+                   force='--force' in sys.argv).run_rendering()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import imp
+import glob
+import time
+import argparse
+import traceback
+import multiprocessing
+
+import cached_loader
+from plot_setup import plt, use_batch_backend
+from stage_timing import Stage_Timer
+from BSNIP_columns import read_columns, get_output_path
+from tardis_catalog import Tardis_Catalog
+from tardis_products import Products_Store, Run_Products
+
+#TARDIS grids and observed spectra read by more than one figure.
+shared_grids = ['11fe_L-grid', '05bl_L-grid', '11fe_Ti-grid',
+                '11fe_default_L-scaled', '11fe_default_L-scaled_UP',
+                '05bl_default_L-scaled']
+shared_events = ['2011fe', '2005bl']
+
+#(feature, key, feature_range) of the plot_feature_comparison figures.
+feature_variants = [('pEW', '7', [0., 200.]), ('pEW', '6', [0., 70.]),
+                    ('depth', '7', [0., 1.]), ('depth', '6', [0., 1.]),
+                    ('velocity', '7', [7., 15.]), ('velocity', '6', [7., 15.])]
+
+def load_script(fname):
+    """Import a plotting script as a module. Scripts whose name is not a
+    valid module name (e.g. 'plot_combined_11fe-05bl.py') are imported under
+    the same name with '-' replaced by '_'.
+    """
+    name = os.path.splitext(fname)[0].replace('-', '_')
+    if name not in sys.modules:
+        imp.load_source(name, fname)
+    return sys.modules[name]
+
+def get_figures():
+    """(label, script, class, parameters) of every figure of the paper."""
+    figures = []
+    for lm in ['downbranch', 'macroatom']:
+        figures.append(('plot_branch.py', 'Feature_Parspace', {'lm': lm}))
+        figures.append(('plot_combined_11fe-05bl.py', 'Compare_Spectra',
+                        {'lm': lm}))
+        for left_panel in ['11fe', '05bl']:
+            for show_pEW in [False, True]:
+                figures.append(('plot_L_and_Ti.py', 'L_Grid',
+                                {'lm': lm, 'left_panel': left_panel,
+                                 'show_pEW': show_pEW}))
+    figures.append(('plot_Ti.py', 'Plot_Ti', {}))
+    figures.append(('plot_macroatom-vs-downbranch.py', 'Macroatom_Comparison',
+                    {}))
+    for feature, key, feature_range in feature_variants:
+        figures.append(('plot_feature_comparison.py', 'Compare_Feature',
+                        {'feature': feature, 'key': key,
+                         'feature_range': feature_range}))
+
+    return [(class_name + '(' + ', '.join(
+               [name + '=' + str(value)
+                for name, value in sorted(parameters.items())]) + ')',
+             script, class_name, parameters)
+            for (script, class_name, parameters) in figures]
+
+def render_figure(task):
+    """Render and save a single figure, unless it is up to date (see
+    'figure_manifest'). Defined at the module level so that it can be
+    dispatched to worker processes.
+    """
+    (label, script, class_name, parameters), force = task
+    time_start = time.time()
+    try:
+        figure_class = getattr(load_script(script), class_name)
+        figure = figure_class(show_fig=False, save_fig=True, force=force,
+                              **parameters)
+    except Exception:
+        return label, time.time() - time_start, False, traceback.format_exc()
+    finally:
+        plt.close('all')
+    return label, time.time() - time_start, figure.skipped, None
+
+class Render_Session(object):
+    """Renders every figure of the paper in a single process pool, from data
+    which is loaded only once.
+
+    Parameters
+    ----------
+    workers : ~int
+        Number of rendering processes. Default is None, which uses the
+        number of CPUs.
+    figures : ~list
+        Only figures whose label contains one of these strings (e.g.
+        'L_Grid' or 'lm=macroatom') are rendered. Default is None, which
+        renders all of them (see 'get_figures').
+    path_tardis_output : ~str
+        Default is None, which uses the 'path_tardis_output' environment
+        variable.
+    force : ~bool
+        If True, render all figures, even those whose inputs have not
+        changed since they were saved. See 'figure_manifest'.
+
+    Notes
+    -----
+    The plotting scripts are imported and the shared inputs (the BSNIP
+    dataframe, the runs of the 'shared_grids' and the observed spectra) are
+    loaded before the workers are forked. Runs in the store of
+    'tardis_products' are kept as 'Run_Products', whose arrays are
+    memory-mapped in the parent; other files are read into the
+    process-wide cache of 'cached_loader'. The workers therefore find every
+    shared input in their (copy-on-write) copy of these caches instead of
+    reading it again. Fields of a run which are not in the store are still
+    read from its .pkl file by the workers which need them.
+
+    Usage: python render_paper_figures.py [--workers N] [--force] [label ...]
+    """
+
+    def __init__(self, workers=None, figures=None, path_tardis_output=None,
+                 force=False):
+        if path_tardis_output is None:
+            path_tardis_output = os.environ['path_tardis_output']
+        self.path_tardis_output = path_tardis_output
+        self.workers = (multiprocessing.cpu_count() if workers is None
+                        else workers)
+        self.figures = [figure for figure in get_figures()
+                        if figures is None
+                        or any([name in figure[0] for name in figures])]
+        self.force = force
+        self.timer = Stage_Timer()
+        self.timings = []
+        self.failed = []
+        self.N_skipped = 0
+
+    def load_shared_data(self):
+        """Read the inputs shared by the figures into the cache. Returns the
+        number of files read.
+        """
+        #Scripts which cannot be imported are reported by their figures.
+        for figure in self.figures:
+            try:
+                load_script(figure[1])
+            except Exception:
+                pass
+
+        #The BSNIP output is read through 'read_columns', as by the plotting
+        #scripts, so that they find its columns in the cache.
+        BSNIP_fp = './../OUTPUT_FILES/BSNIP'
+        N_files = 0
+        if os.path.exists(get_output_path(BSNIP_fp)):
+            read_columns(BSNIP_fp)
+            N_files += 1
+
+        catalog = Tardis_Catalog(self.path_tardis_output)
+        fpaths = [catalog.get_full_path(run) for grid in shared_grids
+                  for run in catalog.find(grid=grid)]
+        obs_fp = './../INPUT_FILES/observational_spectra/'
+        for event in shared_events:
+            fpaths += sorted(glob.glob(obs_fp + event + '/*.pkl'))
+        #Every file is read and the prefetching threads have exited before
+        #any worker is forked.
+        spectra = cached_loader.prefetch(
+          fpaths, Products_Store(self.path_tardis_output).load)
+        for spectrum in spectra:
+            if isinstance(spectrum, Run_Products):
+                spectrum.load_store_fields()
+        spectra.join()
+        return N_files + len(fpaths)
+
+    def run_session(self):
+        print '\n*RENDERING ' + str(len(self.figures)) + ' PAPER FIGURES.'
+        use_batch_backend()
+        if not os.path.exists('./../OUTPUT_FILES/FIGURES/'):
+            os.makedirs('./../OUTPUT_FILES/FIGURES/')
+
+        with self.timer.stage('load') as record:
+            record['rows'] = self.load_shared_data()
+        cached_loader.print_stats()
+
+        with self.timer.stage('render') as record:
+            time_start = time.time()
+            tasks = [(figure, self.force) for figure in self.figures]
+            if self.workers > 1:
+                pool = multiprocessing.Pool(processes=self.workers)
+                results = pool.imap_unordered(render_figure, tasks)
+            else:
+                pool = None
+                results = (render_figure(task) for task in tasks)
+
+            for label, elapsed, skipped, error in results:
+                self.timings.append((label, elapsed))
+                print ('  -' + label + ': ' + format(elapsed, '.2f') + 's'
+                       + (' (up to date)' if skipped else '')
+                       + ('' if error is None else ' (FAILED)'))
+                self.N_skipped += skipped
+                if error is not None:
+                    self.failed.append((label, error))
+
+            if pool is not None:
+                pool.close()
+                pool.join()
+            record['rows'] = len(self.figures)
+            self.timer.add_latencies(
+              'figure', [elapsed for (label, elapsed) in self.timings],
+              wall_time=time.time() - time_start)
+
+        self.timer.print_summary()
+        print ('  -' + str(len(self.figures) - len(self.failed)
+                           - self.N_skipped) + ' figures rendered, '
+               + str(self.N_skipped) + ' up to date, '
+               + str(len(self.failed)) + ' failed.')
+        for label, error in self.failed:
+            print '    -' + label + ': ' + error.strip().split('\n')[-1]
+        return self
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+      description='Render every figure of the paper.')
+    parser.add_argument('figures', nargs='*',
+                        help="e.g. 'L_Grid' or 'lm=macroatom'. Default is"
+                        + " all figures, see 'get_figures'.")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--force', action='store_true')
+    args = parser.parse_args(argv)
+    return Render_Session(workers=args.workers, figures=args.figures or None,
+                          force=args.force).run_session()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+import os
+import re
+import sys
+import errno
+import shutil
+import inspect
+import hashlib
+import cPickle
+
+#Name of the directories created by Result_Cache, see 'compute_code_version'.
+version_pattern = re.compile('^[0-9a-f]{12}$')
+
+def compute_code_version(objects):
+    """Hash of the source code of the given modules and functions. Any
+    change to the analysis code therefore results in a new cache version.
+    """
+    md5 = hashlib.md5()
+    for obj in objects:
+        if inspect.ismodule(obj):
+            fpath = os.path.splitext(obj.__file__)[0] + '.py'
+            with open(fpath, 'rb') as f:
+                md5.update(f.read())
+        else:
+            md5.update(inspect.getsource(obj))
+    return md5.hexdigest()[:12]
+
+def get_analysis_version(objects):
+    """Version of the code used to compute the BSNIP features, i.e. of the
+    given modules and functions (see
+    'compute_BSNIP_features.get_analysis_objects') plus tardistools, if it
+    is available.
+    """
+    objects = list(objects)
+    try:
+        import tardis.tardistools.compute_features as cp
+        objects.append(cp)
+    except ImportError:
+        #Only the native engine runs without tardis.
+        pass
+    return compute_code_version(objects)
+
+def is_missing_file(error):
+    """Whether an OSError was raised because the file no longer exists,
+    e.g. if it was evicted by another process sharing the cache.
+    """
+    return error.errno == errno.ENOENT
+
+class Result_Cache(object):
+    """Cache of the features computed for each spectrum. Entries are keyed
+    by a hash of the name, modification time and size of the spectrum file
+    and of the analysis parameters (including the spectrum ID, which seeds
+    the MC uncertainties), and stored under a directory named after the
+    version of the analysis code.
+
+    Parameters
+    ----------
+    cache_fp : ~str
+        Directory where the cache is stored.
+    version : ~str
+        Version of the analysis code, see 'get_analysis_version'.
+    max_bytes : ~float
+        Maximum size of the cache. When exceeded, the least recently used
+        entries are evicted. Default is 2GB.
+
+    Notes
+    -----
+    To remove entries computed with previous versions of the code, run:
+    python result_cache.py prune [cache_fp]
+    Only directories named like a version (see 'version_pattern') are
+    removed.
+    """
+
+    def __init__(self, cache_fp, version, max_bytes=2.e9):
+        self.cache_fp = cache_fp
+        self.version = version
+        self.max_bytes = max_bytes
+        self.version_fp = cache_fp + version + '/'
+        self.N_hits, self.N_misses = 0, 0
+
+    def make_key(self, fpath, **parameters):
+        """Key of the results computed from the file fpath with the given
+        parameters. The file is not read, so that looking up a spectrum
+        costs a single 'stat'.
+        """
+        stat = os.stat(fpath)
+        md5 = hashlib.md5()
+        md5.update(repr((os.path.basename(fpath), stat.st_mtime,
+                         stat.st_size)) + ';')
+        for name in sorted(parameters.keys()):
+            md5.update(name + '=' + repr(parameters[name]) + ';')
+        return md5.hexdigest()
+
+    def get_path(self, key):
+        return self.version_fp + key[0:2] + '/' + key + '.pkl'
+
+    def __contains__(self, key):
+        return os.path.isfile(self.get_path(key))
+
+    def get(self, key):
+        """Return the cached dictionary, or None if not in the cache."""
+        fpath = self.get_path(key)
+        try:
+            with open(fpath, 'rb') as inp:
+                D = cPickle.load(inp)
+        except (IOError, OSError, EOFError, cPickle.UnpicklingError):
+            self.N_misses += 1
+            return None
+        #Mark the entry as recently used.
+        try:
+            os.utime(fpath, None)
+        except OSError as error:
+            if not is_missing_file(error):
+                raise
+        self.N_hits += 1
+        return D
+
+    def put(self, key, D):
+        fpath = self.get_path(key)
+        if not os.path.exists(os.path.dirname(fpath)):
+            try:
+                os.makedirs(os.path.dirname(fpath))
+            except OSError:
+                #Created by another process in the meantime.
+                pass
+
+        #Write to a temporary file first, so that an interrupted run never
+        #leaves a truncated entry behind. The name is unique to the process,
+        #since concurrent runs (e.g. shards) share the cache.
+        tmp_fp = fpath + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_fp, 'wb') as out:
+            cPickle.dump(D, out, protocol=cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_fp, fpath)
+
+    def list_entries(self):
+        entries = []
+        for root, dirs, files in os.walk(self.cache_fp):
+            for fname in files:
+                if fname.endswith('.pkl'):
+                    try:
+                        stat = os.stat(os.path.join(root, fname))
+                    except OSError as error:
+                        if not is_missing_file(error):
+                            raise
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size,
+                                    os.path.join(root, fname)))
+        return entries
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is smaller
+        than max_bytes.
+        """
+        entries = sorted(self.list_entries())
+        total_bytes = sum([size for (mtime, size, fpath) in entries])
+        N_removed = 0
+        for (mtime, size, fpath) in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(fpath)
+                N_removed += 1
+            except OSError as error:
+                if not is_missing_file(error):
+                    raise
+            total_bytes -= size
+        return N_removed
+
+    def prune(self):
+        """Remove all the entries computed with other versions of the code.
+        Other files or directories in cache_fp are left untouched.
+        """
+        N_removed = 0
+        if os.path.exists(self.cache_fp):
+            for version in os.listdir(self.cache_fp):
+                if (version != self.version and version_pattern.match(version)
+                    and os.path.isdir(self.cache_fp + version)):
+                    shutil.rmtree(self.cache_fp + version)
+                    N_removed += 1
+        return N_removed
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in ['prune', 'evict']:
+        print 'Usage: python result_cache.py prune|evict [cache_fp]'
+        sys.exit(1)
+
+    cache_fp = './../OUTPUT_FILES/BSNIP_result_cache/'
+    if len(sys.argv) > 2:
+        cache_fp = sys.argv[2].rstrip('/') + '/'
+    from compute_BSNIP_features import get_analysis_objects
+    cache = Result_Cache(cache_fp,
+                         get_analysis_version(get_analysis_objects()))
+    if sys.argv[1] == 'prune':
+        print 'Removed ' + str(cache.prune()) + ' outdated version(s).'
+    else:
+        print 'Removed ' + str(cache.evict()) + ' entries.'
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+import os
+import cPickle
+from collections import OrderedDict
+
+import numpy as np
+
+from ragged_array import Ragged_Array
+
+def parse_spectrum_filename(file_spectra):
+    """Retrieve the SNID and date from the name of a BSNIP spectrum file."""
+    file_name_parts = (file_spectra.rstrip('\n').replace('.flm', '')
+                       .split('-'))
+    try:
+        date = str(format(float(file_name_parts[1]), '.3f'))
+        if len(date) < 7:
+            date = str(format(float(file_name_parts[2]), '.3f'))
+    except:
+        date = str(format(float(file_name_parts[2]), '.3f'))
+    SNID = file_name_parts[0].upper()
+    return SNID, date
+
+def count_spectrum_pixels(fpath):
+    """Number of pixels of a spectrum file, without parsing the values."""
+    with open(fpath, 'r') as f:
+        return sum([1 for line in f
+                    if line.strip() and not line.lstrip().startswith('#')])
+
+def read_spectrum_file(fpath):
+    """Read the wavelength and flux (first two columns) of a spectrum file."""
+    data = np.loadtxt(fpath, usecols=(0, 1), ndmin=2)
+    return data[:, 0].copy(), data[:, 1].copy()
+
+class Spectra_Store(object):
+    """Binary store of all the spectra in a directory. The wavelength and flux
+    of every spectrum are packed into two float64 Ragged_Array files, which
+    are memory-mapped when loaded, plus an index with the 'SNID|date' key of
+    each spectrum.
+
+    Parameters
+    ----------
+    spectra_fp : ~str
+        Directory containing the spectra files.
+    store_fp : ~str
+        Directory where the store is written.
+
+    Notes
+    -----
+    The store records the name, mtime and size of every file in spectra_fp.
+    If any of these change, is_valid() returns False and the store has to be
+    ingested again. get_spectra() takes care of this automatically.
+    """
+
+    def __init__(self, spectra_fp, store_fp):
+        self.spectra_fp = spectra_fp
+        self.store_fp = store_fp
+        self.index = None
+        self.wavelength = None
+        self.flux = None
+
+    def get_signature(self):
+        signature = []
+        for file_spectra in sorted(os.listdir(self.spectra_fp)):
+            stat = os.stat(self.spectra_fp + file_spectra)
+            signature.append((file_spectra, stat.st_mtime, stat.st_size))
+        return signature
+
+    def is_valid(self):
+        if not os.path.isfile(self.store_fp + 'index.pkl'):
+            return False
+        with open(self.store_fp + 'index.pkl', 'rb') as inp:
+            index = cPickle.load(inp)
+        return index['signature'] == self.get_signature()
+
+    def ingest(self):
+        """Parse every spectrum file once and write the binary store."""
+        print '  -RUNNING: Packing spectra into binary store...'
+        if not os.path.exists(self.store_fp):
+            os.makedirs(self.store_fp)
+
+        signature = self.get_signature()
+        keys = []
+        wavelength = Ragged_Array(dtype=np.float64)
+        flux = Ragged_Array(dtype=np.float64)
+        for (file_spectra, mtime, size) in signature:
+            SNID, date = parse_spectrum_filename(file_spectra)
+            w, f = read_spectrum_file(self.spectra_fp + file_spectra)
+            wavelength.append(w)
+            flux.append(f)
+            keys.append(SNID + '|' + date)
+        wavelength.save(self.store_fp + 'wavelength')
+        flux.save(self.store_fp + 'flux')
+
+        #The index is written last, so that an interrupted ingest is never
+        #mistaken for a valid store.
+        index = {'signature': signature, 'keys': keys}
+        with open(self.store_fp + 'index.pkl', 'wb') as out:
+            cPickle.dump(index, out, protocol=cPickle.HIGHEST_PROTOCOL)
+
+    def load(self):
+        """Memory-map the store. Arrays are copy-on-write, so that changes
+        to a spectrum in memory are never written back to disk.
+        """
+        with open(self.store_fp + 'index.pkl', 'rb') as inp:
+            self.index = cPickle.load(inp)
+        self.wavelength = Ragged_Array.load(self.store_fp + 'wavelength',
+                                            mmap_mode='c')
+        self.flux = Ragged_Array.load(self.store_fp + 'flux', mmap_mode='c')
+
+    def get_spectra(self):
+        """Ingest the spectra if the store is missing or outdated and then
+        load it.
+        """
+        if not self.is_valid():
+            self.ingest()
+        self.load()
+        return self
+
+    @property
+    def keys(self):
+        return self.index['keys']
+
+    @property
+    def filenames(self):
+        return [file_spectra for (file_spectra, mtime, size)
+                in self.index['signature']]
+
+    def __len__(self):
+        return len(self.index['keys'])
+
+    def __getitem__(self, i):
+        """Wavelength and flux of the i-th spectrum, as views of the store."""
+        return self.wavelength[i], self.flux[i]
+
+class Lazy_Spectra(object):
+    """Mapping from a key (e.g. the row of a dataframe) to the (wavelength,
+    flux) of its spectrum file, where spectra are only read when requested.
+
+    Parameters
+    ----------
+    spectra_fp : ~str
+        Directory containing the spectra files.
+    filenames : ~dict
+        Name of the spectrum file of each key.
+    store : ~Spectra_Store
+        A loaded binary store. If given, spectra are taken from it instead of
+        the text files. Default is None.
+    max_loaded : ~int
+        Number of spectra kept in memory. When exceeded, the least recently
+        requested spectrum is dropped and read again if requested later.
+        Default is 256.
+    """
+
+    def __init__(self, spectra_fp, filenames, store=None, max_loaded=256):
+        self.spectra_fp = spectra_fp
+        self.filenames = filenames
+        self.store = store
+        self.max_loaded = max_loaded
+        self.loaded = OrderedDict()
+        if store is not None:
+            self.store_position = dict(
+              (file_spectra, i)
+              for i, file_spectra in enumerate(store.filenames))
+
+    def get_path(self, key):
+        """Path of the spectrum file of a key."""
+        return self.spectra_fp + self.filenames[key]
+
+    def get_N_pixels(self, key):
+        """Number of pixels of a spectrum, taken from the store if possible.
+        """
+        file_spectra = self.filenames[key]
+        if self.store is not None:
+            return int(self.store.wavelength.lengths[
+              self.store_position[file_spectra]])
+        return count_spectrum_pixels(self.spectra_fp + file_spectra)
+
+    def __getitem__(self, key):
+        if key in self.loaded:
+            spectrum = self.loaded.pop(key)
+        elif self.store is not None:
+            spectrum = self.store[self.store_position[self.filenames[key]]]
+        else:
+            spectrum = read_spectrum_file(self.spectra_fp
+                                          + self.filenames[key])
+        self.loaded[key] = spectrum
+        if len(self.loaded) > self.max_loaded:
+            self.loaded.popitem(last=False)
+        return spectrum
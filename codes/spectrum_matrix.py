@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import shutil
+import cPickle
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from BSNIP_columns import read_columns
+
+def make_grid(w_min=3000., w_max=10000., step=2.):
+    """Rest frame wavelength grid, as the centres of bins of width step."""
+    return np.arange(w_min + step / 2., w_max, step)
+
+def get_bin_edges(wavelength):
+    """Edges of the bins centred on each wavelength. The edges are midway
+    between consecutive pixels, and the first and last bins are symmetric
+    around their pixel.
+    """
+    wavelength = np.asarray(wavelength, dtype=float)
+    middle = (wavelength[1:] + wavelength[:-1]) / 2.
+    return np.concatenate(([2. * wavelength[0] - middle[0]], middle,
+                           [2. * wavelength[-1] - middle[-1]]))
+
+def rebin_flux(wavelength, flux, grid, min_coverage=1.):
+    """Flux conserving rebinning of a spectrum onto a grid.
+
+    Parameters
+    ----------
+    wavelength : ~np.array
+        Wavelength of each pixel of the spectrum.
+    flux : ~np.array
+        Flux density of each pixel. Non-finite values are treated as gaps.
+    grid : ~np.array
+        Centres of the output bins (see 'make_grid').
+    min_coverage : ~float
+        Minimum fraction of an output bin which has to be covered by valid
+        input pixels for the bin to be kept. Default is 1 (fully covered).
+
+    Returns
+    -------
+    (flux, coverage), where flux is the mean flux density over each output
+    bin (nan where not covered) and coverage is a boolean array.
+
+    Notes
+    -----
+    Each input pixel is taken to have a constant flux density over its bin.
+    The cumulative integral of the flux is interpolated at the output edges,
+    so that the integral of the flux over any range of output bins equals
+    that of the input spectrum over the same range.
+    """
+    wavelength = np.asarray(wavelength, dtype=float)
+    flux = np.asarray(flux, dtype=float)
+    order = np.argsort(wavelength, kind='mergesort')
+    wavelength, flux = wavelength[order], flux[order]
+
+    edges_in = get_bin_edges(wavelength)
+    edges_out = get_bin_edges(grid)
+    valid = np.isfinite(flux)
+    width = np.diff(edges_in)
+
+    integral = np.concatenate(([0.], np.cumsum(np.where(
+      valid, flux, 0.) * width)))
+    integral_valid = np.concatenate(([0.], np.cumsum(valid * width)))
+
+    flux_out = np.diff(np.interp(edges_out, edges_in, integral))
+    width_valid = np.diff(np.interp(edges_out, edges_in, integral_valid))
+    #The tolerance absorbs the rounding of the cumulative sums.
+    coverage = ((width_valid > 0.) & (width_valid >= min_coverage
+                * np.diff(edges_out) * (1. - 1.e-9)))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        flux_out = np.where(coverage, flux_out / width_valid, np.nan)
+    return flux_out, coverage
+
+def get_spectrum_arrays(D):
+    """Wavelength and flux of a spectrum stored as a dictionary or as a single
+    row dataframe (as in some TARDIS outputs). The de-redshifted and
+    normalized arrays are used if available.
+    """
+    def get_value(key):
+        value = D[key]
+        if isinstance(value, pd.Series):
+            value = value.tolist()[0]
+        return np.asarray(value).astype(np.float)
+
+    keys = D.keys() if isinstance(D, dict) else D.columns
+    wavelength = get_value('wavelength_corr' if 'wavelength_corr' in keys
+                           else 'wavelength_raw')
+    flux = get_value('flux_normalized' if 'flux_normalized' in keys
+                     else 'flux_raw')
+    return wavelength, flux
+
+def iter_BSNIP_spectra(filename='./../OUTPUT_FILES/BSNIP'):
+    """Yield (metadata, wavelength, flux) for every spectrum of a BSNIP
+    output, reading only the columns needed (see 'read_columns').
+    """
+    df = read_columns(filename, columns=[
+      'ID', 'SNID', 'phase', 'wavelength_corr', 'flux_normalized'])
+    for index, row in df.iterrows():
+        metadata = {'name': row['ID'], 'source': 'BSNIP',
+                    'SNID': row['SNID'], 'phase': row['phase'], 'path': None}
+        yield metadata, row['wavelength_corr'], row['flux_normalized']
+
+def iter_pkl_spectra(list_fpath, source):
+    """Yield (metadata, wavelength, flux) for the spectra stored in .pkl
+    files, e.g. observed spectra ('observed') or TARDIS models ('tardis').
+    """
+    for fpath in list_fpath:
+        with open(fpath, 'rb') as inp:
+            D = cPickle.load(inp)
+        wavelength, flux = get_spectrum_arrays(D)
+        metadata = {'name': os.path.basename(fpath).split('.pkl')[0],
+                    'source': source, 'SNID': None, 'phase': None,
+                    'path': fpath}
+        yield metadata, wavelength, flux
+
+def find_pkl_files(top_dir):
+    """Paths of the .pkl files under top_dir, excluding window sweep tables
+    (see 'window_sweep').
+    """
+    list_fpath = []
+    for path, dirs, files in os.walk(top_dir):
+        for fname in files:
+            if fname.endswith('.pkl') and not fname.endswith('_sweep.pkl'):
+                list_fpath.append(os.path.join(path, fname))
+    return sorted(list_fpath)
+
+def write_spectrum_matrix(fpath, spectra, grid, N=None, min_coverage=1.):
+    """Rebin spectra onto a common grid and store them as a matrix.
+
+    Parameters
+    ----------
+    fpath : ~str
+        Output directory, e.g. './../OUTPUT_FILES/spectrum_matrix/'.
+    spectra : ~iterable
+        (metadata, wavelength, flux) of each spectrum, where metadata is a
+        dictionary, e.g. from 'iter_BSNIP_spectra' or 'iter_pkl_spectra'.
+    grid : ~np.array
+        Rest frame grid (see 'make_grid').
+    N : ~int
+        Number of spectra. Default is None, in which case spectra is first
+        converted to a list.
+    min_coverage : ~float
+        See 'rebin_flux'.
+
+    Notes
+    -----
+    The directory contains 'flux.npy', a float32 (spectra x pixels) array
+    with nan where a spectrum does not cover the grid, 'coverage.npy', the
+    boolean mask of covered pixels, 'wavelength.npy', the grid, and
+    'metadata.pkl', a dataframe with one row per spectrum. The matrix is
+    filled one row at a time through a memory map, so if N is given and
+    spectra is a generator, the spectra are never held in memory at once. As
+    in 'write_columns', the directory is written under a temporary name and
+    only replaces a previous one once complete.
+    """
+    if N is None:
+        spectra = list(spectra)
+        N = len(spectra)
+    grid = np.asarray(grid, dtype=float)
+    tmp_fp = fpath.rstrip('/') + '.tmp/'
+    if os.path.exists(tmp_fp):
+        shutil.rmtree(tmp_fp)
+    os.makedirs(tmp_fp)
+
+    shape = (N, len(grid))
+    flux_matrix = np.lib.format.open_memmap(
+      tmp_fp + 'flux.npy', mode='w+', dtype=np.float32, shape=shape)
+    coverage_matrix = np.lib.format.open_memmap(
+      tmp_fp + 'coverage.npy', mode='w+', dtype=bool, shape=shape)
+
+    list_metadata = []
+    for i, (metadata, wavelength, flux) in enumerate(spectra):
+        if i >= N:
+            raise ValueError('More than N=' + str(N) + ' spectra were given.')
+        flux_matrix[i, :], coverage_matrix[i, :] = rebin_flux(
+          wavelength, flux, grid, min_coverage)
+        metadata = dict(metadata)
+        metadata['row'] = i
+        metadata['N_covered'] = int(np.sum(coverage_matrix[i, :]))
+        list_metadata.append(metadata)
+    if len(list_metadata) != N:
+        raise ValueError('Expected ' + str(N) + ' spectra, but '
+                         + str(len(list_metadata)) + ' were given.')
+    flux_matrix.flush()
+    coverage_matrix.flush()
+    del flux_matrix, coverage_matrix
+
+    np.save(tmp_fp + 'wavelength.npy', grid)
+    columns = ['row', 'name', 'source', 'SNID', 'phase', 'path', 'N_covered']
+    columns += sorted(set([key for metadata in list_metadata
+                           for key in metadata.keys()]) - set(columns))
+    pd.DataFrame(list_metadata, columns=columns).to_pickle(
+      tmp_fp + 'metadata.pkl')
+
+    if os.path.exists(fpath):
+        shutil.rmtree(fpath)
+    os.rename(tmp_fp, fpath)
+
+class Spectrum_Matrix(object):
+    """Spectra rebinned onto a common rest frame grid, as written by
+    'write_spectrum_matrix'. Operations over many spectra are single array
+    reductions over the rows of the matrix.
+
+    Parameters
+    ----------
+    fpath : ~str
+        Directory of the matrix.
+    mmap_mode : ~str
+        Memory-map mode of the flux and coverage arrays. Default is 'r'.
+
+    Notes
+    -----
+    'rows' arguments accept anything that indexes the rows of a numpy array
+    (e.g. a list of row numbers or a boolean mask). Default is None, which
+    uses every row. See 'select' to find rows from the metadata.
+    """
+
+    def __init__(self, fpath, mmap_mode='r'):
+        self.fpath = fpath
+        self.wavelength = np.load(fpath + 'wavelength.npy')
+        self.flux = np.load(fpath + 'flux.npy', mmap_mode=mmap_mode)
+        self.coverage = np.load(fpath + 'coverage.npy', mmap_mode=mmap_mode)
+        self.metadata = pd.read_pickle(fpath + 'metadata.pkl')
+
+    def __len__(self):
+        return self.flux.shape[0]
+
+    def select(self, **conditions):
+        """Row numbers whose metadata match every condition, e.g.
+        select(source='BSNIP') or select(name='2011_09_03').
+        """
+        mask = np.ones(len(self.metadata), dtype=bool)
+        for column, value in conditions.items():
+            mask &= (self.metadata[column] == value).values
+        return self.metadata['row'].values[mask]
+
+    def get_flux(self, rows=None):
+        """(rows x pixels) float64 array of fluxes, nan where not covered."""
+        if rows is None:
+            rows = slice(None)
+        return np.asarray(self.flux[rows], dtype=float)
+
+    def get_window(self, w_min, w_max):
+        """Columns of the grid with w_min < wavelength < w_max."""
+        return np.where((self.wavelength > w_min)
+                        & (self.wavelength < w_max))[0]
+
+    def window_mean(self, w_min, w_max, rows=None):
+        """Mean flux of each row between w_min and w_max, ignoring pixels not
+        covered. Rows with no covered pixel in the window get nan.
+        """
+        cols = self.get_window(w_min, w_max)
+        flux = self.get_flux(rows)[:, cols]
+        N = np.sum(np.isfinite(flux), axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(N > 0, np.nansum(flux, axis=1) / N, np.nan)
+
+    def normalize(self, w_min=4000., w_max=9000., rows=None):
+        """Fluxes divided by their mean flux between w_min and w_max."""
+        return (self.get_flux(rows)
+                / self.window_mean(w_min, w_max, rows)[:, None])
+
+    def difference(self, rows_a, rows_b, normalization=(4000., 9000.)):
+        """Flux of rows_a minus flux of rows_b (broadcast if one of them is a
+        single row), after normalizing each row over the normalization
+        window. If normalization is None, the stored fluxes are used.
+        """
+        if normalization is None:
+            flux_a, flux_b = self.get_flux(rows_a), self.get_flux(rows_b)
+        else:
+            flux_a = self.normalize(normalization[0], normalization[1],
+                                    rows_a)
+            flux_b = self.normalize(normalization[0], normalization[1],
+                                    rows_b)
+        return flux_a - flux_b
+
+if __name__ == '__main__':
+    #Build the matrix of BSNIP, observed and (if path_tardis_output is set)
+    #TARDIS spectra, e.g. python spectrum_matrix.py 3000 10000 2
+    grid = make_grid(*[float(value) for value in sys.argv[1:4]])
+    out_fp = './../OUTPUT_FILES/'
+
+    #Spectra are read while the matrix is written.
+    sources, N = [], 0
+    if os.path.isdir(out_fp + 'BSNIP.cols/') or os.path.isfile(
+      out_fp + 'BSNIP.pkl'):
+        N += len(read_columns(out_fp + 'BSNIP', columns=['ID']))
+        sources.append(iter_BSNIP_spectra(out_fp + 'BSNIP'))
+    list_fpath = find_pkl_files('./../INPUT_FILES/observational_spectra/')
+    N += len(list_fpath)
+    sources.append(iter_pkl_spectra(list_fpath, 'observed'))
+    if 'path_tardis_output' in os.environ:
+        list_fpath = find_pkl_files(os.environ['path_tardis_output'])
+        N += len(list_fpath)
+        sources.append(iter_pkl_spectra(list_fpath, 'tardis'))
+
+    print ('\n*WRITING SPECTRUM MATRIX: ' + str(N) + ' spectra x '
+           + str(len(grid)) + ' pixels.')
+    write_spectrum_matrix(out_fp + 'spectrum_matrix/',
+                          itertools.chain(*sources), grid, N=N)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+import time
+import json
+import resource
+from contextlib import contextmanager
+
+import numpy as np
+
+def get_usage():
+    """CPU time (s) and peak RSS (MB) of this process and of its children
+    which have been waited for, e.g. the workers of a closed pool.
+    """
+    usage = {}
+    for who, name in [(resource.RUSAGE_SELF, 'self'),
+                      (resource.RUSAGE_CHILDREN, 'children')]:
+        rusage = resource.getrusage(who)
+        usage['cpu_' + name] = rusage.ru_utime + rusage.ru_stime
+        #ru_maxrss is given in kB on Linux.
+        usage['rss_' + name] = rusage.ru_maxrss / 1024.
+    return usage
+
+class Stage_Timer(object):
+    """Records the wall time, CPU time and peak memory of each stage of a
+    pipeline, plus statistics of the time taken to process each item.
+
+    Notes
+    -----
+    CPU times include the children of the process (e.g. pool workers) once
+    they have finished. Peak RSS is the high-water mark of the process up to
+    the end of each stage, so the stage where it increases is the one which
+    allocated the memory.
+    """
+
+    def __init__(self):
+        self.stages = []
+        self.latencies = {}
+        self.time_start = time.time()
+
+    @contextmanager
+    def stage(self, name):
+        """Time the code within a 'with' block. The yielded dictionary is
+        stored in the report and can be used to add e.g. row counts.
+        """
+        record = {'stage': name}
+        usage_start, time_start = get_usage(), time.time()
+        yield record
+        usage_end = get_usage()
+        record['wall_s'] = time.time() - time_start
+        record['cpu_s'] = (
+          usage_end['cpu_self'] - usage_start['cpu_self']
+          + usage_end['cpu_children'] - usage_start['cpu_children'])
+        record['peak_rss_MB'] = usage_end['rss_self']
+        record['peak_rss_children_MB'] = usage_end['rss_children']
+        self.stages.append(record)
+
+    def add_latencies(self, name, latencies, wall_time=None, N_items=None):
+        """Summarize the time taken by each item of a stage. If wall_time is
+        given, the throughput (items/s) is also computed, counting N_items
+        (default: the number of latencies) items.
+        """
+        latencies = np.asarray(latencies, dtype=float)
+        summary = {'N': len(latencies)}
+        if len(latencies) > 0:
+            p50, p90, p99 = np.percentile(latencies, [50., 90., 99.])
+            summary.update({
+              'mean_s': float(np.mean(latencies)), 'p50_s': float(p50),
+              'p90_s': float(p90), 'p99_s': float(p99),
+              'max_s': float(np.max(latencies))})
+        if wall_time:
+            if N_items is None:
+                N_items = len(latencies)
+            summary['throughput_per_s'] = N_items / wall_time
+        self.latencies[name] = summary
+
+    def print_summary(self):
+        print '  -TIMING:'
+        for record in self.stages:
+            print ('    -' + record['stage'].ljust(12)
+                   + format(record['wall_s'], '8.2f') + 's wall'
+                   + format(record['cpu_s'], '8.2f') + 's cpu'
+                   + format(record['peak_rss_MB'], '8.0f') + 'MB'
+                   + (('  ' + str(record['rows']) + ' rows')
+                      if 'rows' in record else ''))
+        for name, summary in sorted(self.latencies.items()):
+            if summary['N'] > 0:
+                print ('    -' + name + ': ' + str(summary['N'])
+                       + ' items, p50=' + format(summary['p50_s'], '.3f')
+                       + 's, p99=' + format(summary['p99_s'], '.3f') + 's'
+                       + ((', ' + format(summary['throughput_per_s'], '.2f')
+                           + '/s') if 'throughput_per_s' in summary else ''))
+
+    def write_report(self, fpath):
+        report = {'total_wall_s': time.time() - self.time_start,
+                  'stages': self.stages, 'latencies': self.latencies}
+        with open(fpath, 'w') as out:
+            json.dump(report, out, indent=2, sort_keys=True)
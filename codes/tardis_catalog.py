@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+
+import os
+import re
+import sys
+import json
+
+#Parameters encoded in the names of the TARDIS runs, e.g.
+#'velocity_start-8100_loglum-8.617_line_interaction-downbranch_time_explosion
+#-12.0' or 'TiCrs-0.5_loglum-9.544_line_interaction-macroatom'.
+run_parameters = ['velocity_start', 'loglum', 'line_interaction',
+                  'time_explosion', 'TiCrs']
+
+#Short names accepted by 'Tardis_Catalog.find'.
+parameter_aliases = {'v': 'velocity_start', 'L': 'loglum',
+                     'lm': 'line_interaction', 'texp': 'time_explosion',
+                     'X_Ti': 'TiCrs'}
+
+run_pattern = re.compile('(' + '|'.join(run_parameters) + ')-([^_]+)')
+
+def parse_run_name(name):
+    """Dictionary of the parameters in the name of a run. Numerical values
+    are converted to float.
+    """
+    params = {}
+    for key, value in run_pattern.findall(name):
+        try:
+            params[key] = float(value)
+        except ValueError:
+            params[key] = value
+    return params
+
+def parse_run_values(name):
+    """Dictionary of the parameters in the name of a run, as written."""
+    return dict(run_pattern.findall(name))
+
+def scan_grid(path_tardis_output, grid):
+    """List the runs of a grid directory. A run is either a directory
+    '<name>/' containing '<name>.pkl', or a '<name>.pkl' file. Run
+    directories without their .pkl file (e.g. still running) are listed with
+    path and mtime set to None.
+    """
+    runs = []
+    grid_fp = os.path.join(path_tardis_output, grid)
+    for entry in sorted(os.listdir(grid_fp)):
+        if entry.endswith('.pkl'):
+            name, rel_path = entry[:-4], os.path.join(grid, entry)
+        elif os.path.isdir(os.path.join(grid_fp, entry)):
+            name, rel_path = entry, os.path.join(grid, entry, entry + '.pkl')
+        else:
+            continue
+        fpath = os.path.join(path_tardis_output, rel_path)
+        complete = os.path.isfile(fpath)
+        runs.append({
+          'name': name, 'grid': grid, 'event': grid.split('_')[0],
+          'path': rel_path if complete else None,
+          'params': parse_run_name(name),
+          'mtime': os.path.getmtime(fpath) if complete else None})
+    return runs
+
+class Tardis_Catalog(object):
+    """Index of the TARDIS runs under path_tardis_output.
+
+    Parameters
+    ----------
+    path_tardis_output : ~str
+        Directory containing one directory per grid of runs (e.g.
+        '11fe_L-grid', '05bl_default_L-scaled'). Default is None, which uses
+        the 'path_tardis_output' environment variable.
+    index_fpath : ~str
+        JSON file where the index is stored.
+    rescan : ~bool
+        If True, every grid is scanned again. Default is False.
+
+    Notes
+    -----
+    Each run is stored with its grid, its event (the prefix of the grid
+    name, e.g. '05bl'), the parameters parsed from its name (see
+    'parse_run_name'), its path relative to path_tardis_output and the
+    modification time of its .pkl file. When the index is loaded, only the
+    grid directories themselves are checked: grids whose modification time
+    changed (i.e. runs were added or removed) are scanned again, and new or
+    deleted grids are added or dropped. Queries never walk the filesystem.
+    """
+
+    def __init__(self, path_tardis_output=None,
+                 index_fpath='./../OUTPUT_FILES/tardis_catalog.json',
+                 rescan=False):
+        if path_tardis_output is None:
+            path_tardis_output = os.environ['path_tardis_output']
+        self.path_tardis_output = path_tardis_output
+        self.index_fpath = index_fpath
+        self.grids = {}
+        self.runs = []
+        if not rescan:
+            self.load_index()
+        self.update_index()
+
+    def load_index(self):
+        if not os.path.isfile(self.index_fpath):
+            return
+        with open(self.index_fpath, 'r') as inp:
+            index = json.load(inp)
+        if index['path_tardis_output'] == self.path_tardis_output:
+            self.grids, self.runs = index['grids'], index['runs']
+
+    def update_index(self):
+        """Scan the grids which are new or changed since the index was
+        written, and write the index if anything changed.
+        """
+        current = {}
+        for grid in sorted(os.listdir(self.path_tardis_output)):
+            grid_fp = os.path.join(self.path_tardis_output, grid)
+            if os.path.isdir(grid_fp):
+                current[grid] = os.path.getmtime(grid_fp)
+        #Grids with unfinished runs are checked again, since a .pkl file
+        #written inside a run directory does not change the grid directory.
+        incomplete = set([run['grid'] for run in self.runs
+                          if run['path'] is None])
+        changed = [grid for grid in sorted(current.keys())
+                   if self.grids.get(grid) != current[grid]
+                   or grid in incomplete]
+        if not changed and current == self.grids:
+            return
+
+        self.runs = [run for run in self.runs if run['grid'] in current
+                     and run['grid'] not in changed]
+        for grid in changed:
+            self.runs += scan_grid(self.path_tardis_output, grid)
+        self.runs.sort(key=lambda run: (run['grid'], run['name']))
+        self.grids = current
+        self.write_index()
+
+    def write_index(self):
+        tmp_fpath = self.index_fpath + '.tmp' + str(os.getpid())
+        with open(tmp_fpath, 'w') as out:
+            json.dump({'path_tardis_output': self.path_tardis_output,
+                       'grids': self.grids, 'runs': self.runs}, out,
+                      indent=1, sort_keys=True)
+        os.rename(tmp_fpath, self.index_fpath)
+
+    def get_full_path(self, run):
+        return os.path.join(self.path_tardis_output, run['path'])
+
+    def find(self, event=None, grid=None, exact=False, **conditions):
+        """Runs matching all the conditions, e.g.
+        find(event='05bl', lm='downbranch', texp=21.8). Parameters can be
+        given by their full name or by an alias (see 'parameter_aliases').
+        Numerical values are compared as floats, so that e.g. loglum='8.617'
+        and loglum=8.617 are equivalent. Runs may have other parameters in
+        their name (e.g. TiCrs), unless exact is True, in which case the
+        parameters of a run must be exactly those given and string values
+        must be written as in its name (e.g. TiCrs='0.5' does not match
+        'TiCrs-0.50').
+        """
+        conditions = dict((parameter_aliases.get(key, key), value)
+                          for key, value in conditions.items())
+        unknown = set(conditions.keys()) - set(run_parameters)
+        if unknown:
+            raise ValueError('Unknown run parameters: '
+                             + ', '.join(sorted(unknown)) + '.')
+
+        def matches(run):
+            if event is not None and run['event'] != event:
+                return False
+            if grid is not None and run['grid'] != grid:
+                return False
+            if exact:
+                if set(run['params'].keys()) != set(conditions.keys()):
+                    return False
+                written = parse_run_values(run['name'])
+            for key, value in conditions.items():
+                if key not in run['params']:
+                    return False
+                if exact and isinstance(value, basestring):
+                    if value != written[key]:
+                        return False
+                    continue
+                try:
+                    if float(value) != float(run['params'][key]):
+                        return False
+                except ValueError:
+                    if str(value) != str(run['params'][key]):
+                        return False
+            return True
+
+        return [run for run in self.runs
+                if run['path'] is not None and matches(run)]
+
+    def get(self, **conditions):
+        """Full path of the single run matching the conditions (see 'find').
+        If several runs match, e.g. 'loglum-9.544_line_interaction-macroatom'
+        and 'TiCrs-0.5_loglum-9.544_line_interaction-macroatom' for L='9.544'
+        and lm='macroatom', the run whose name has exactly the given
+        parameters and values is returned. A ValueError is raised if no run
+        or more than one run matches.
+        """
+        runs = self.find(**conditions)
+        if len(runs) > 1:
+            runs = self.find(exact=True, **conditions) or runs
+        if len(runs) != 1:
+            raise ValueError(
+              str(len(runs)) + ' runs match ' + str(conditions) + ': '
+              + ', '.join([run['path'] for run in runs]))
+        return self.get_full_path(runs[0])
+
+    def require(self, queries):
+        """Resolve a list of run queries before anything is loaded.
+
+        Parameters
+        ----------
+        queries : ~list
+            Each item is either a dictionary of conditions (see 'find') or
+            the path of a file which is not a TARDIS run (e.g. an observed
+            spectrum), which only has to exist.
+
+        Returns
+        -------
+        List with the path of each item, in the same order. A ValueError
+        listing every missing or ambiguous item is raised otherwise.
+        """
+        paths, errors = [], []
+        for query in queries:
+            if isinstance(query, dict):
+                try:
+                    paths.append(self.get(**query))
+                except ValueError as error:
+                    errors.append(str(error))
+            elif os.path.isfile(query):
+                paths.append(query)
+            else:
+                errors.append('Missing file: ' + query)
+        if errors:
+            raise ValueError('Required runs are not available:\n'
+                             + '\n'.join(errors))
+        return paths
+
+if __name__ == '__main__':
+    #Scan path_tardis_output and print the runs per grid, e.g.
+    #python tardis_catalog.py [--rescan]
+    catalog = Tardis_Catalog(rescan='--rescan' in sys.argv)
+    print '\n*TARDIS CATALOG: ' + str(len(catalog.runs)) + ' runs.'
+    for grid in sorted(catalog.grids.keys()):
+        print ('  -' + grid + ': '
+               + str(len(catalog.find(grid=grid))) + ' runs.')
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+
+import os
+import re
+import sys
+import shutil
+import cPickle
+import numbers
+import threading
+
+import numpy as np
+
+import cached_loader
+from tardis_catalog import Tardis_Catalog
+
+#Fields extracted into the store, i.e. those read by most of the figures.
+#Scalar features (e.g. 'pEW_f7' or 'velocity_unc_f6') are also extracted.
+#Any other field is read from the .pkl file of the run.
+array_fields = ['wavelength_corr', 'flux_normalized', 't_rad', 'v_inner']
+scalar_fields = ['t_inner', 'time_explosion', 'luminosity_requested']
+feature_pattern = re.compile('_f[1-9]$')
+
+#Run_Products returned by 'Products_Store.load', shared by every store of
+#the process. Keyed by (store path, run path), so that a run extracted again
+#replaces its previous entry. The lock is held since the runs are also
+#loaded from the prefetch threads (see 'cached_loader.prefetch').
+run_products = {}
+run_products_lock = threading.Lock()
+
+def split_quantity(value):
+    """(value, unit) of a quantity, with unit None for plain numbers."""
+    #astropy and pandas are imported when needed, since they take most of
+    #the time needed to import the plotting scripts.
+    from astropy import units as u
+    if isinstance(value, u.Quantity):
+        return value.value, value.unit.to_string()
+    return value, None
+
+def is_scalar(value):
+    value = split_quantity(value)[0]
+    return (isinstance(value, (numbers.Number, np.number))
+            and not isinstance(value, (complex, np.complexfloating)))
+
+def is_array(value):
+    value = split_quantity(value)[0]
+    return isinstance(value, np.ndarray) and value.dtype.kind in 'biuf'
+
+def get_array_fpath(store_fp, rel_path, field):
+    return (store_fp + 'arrays/' + os.path.splitext(rel_path)[0] + '.'
+            + field + '.npy')
+
+def extract_run(D, store_fp, rel_path):
+    """Write the arrays in array_fields of a run to .npy files and return its
+    row of the scalar table, which holds the scalars in scalar_fields and
+    the scalar features (e.g. 'pEW_f7'), plus the names of all the 'fields'
+    of the run.
+    """
+    row = {'scalar_fields': [], 'array_fields': [], 'fields': sorted(D.keys())}
+    for field, value in D.items():
+        if ((field in scalar_fields or feature_pattern.search(field))
+            and is_scalar(value)):
+            row[field], row[field + '.unit'] = split_quantity(value)
+            row['scalar_fields'].append(field)
+        elif field in array_fields and is_array(value):
+            value, row[field + '.unit'] = split_quantity(value)
+            fpath = get_array_fpath(store_fp, rel_path, field)
+            if not os.path.isdir(os.path.dirname(fpath)):
+                os.makedirs(os.path.dirname(fpath))
+            np.save(fpath, value)
+            row['array_fields'].append(field)
+    return row
+
+def extract_products(path_tardis_output=None,
+                     store_fp='./../OUTPUT_FILES/tardis_products/',
+                     force=False):
+    """Extract the arrays and scalars of every TARDIS run into the store.
+    Runs already extracted from a .pkl file with the same modification time
+    are skipped, unless force is True. Runs which are not stored as a
+    dictionary (e.g. one row dataframes) are not extracted, so that they are
+    always read from their .pkl file.
+
+    Notes
+    -----
+    The store holds 'scalars.pkl', a dataframe indexed by the path of each
+    run relative to path_tardis_output, with one column per scalar (plus
+    '<field>.unit' for quantities), the .pkl 'mtime', the lists of stored
+    'scalar_fields' and 'array_fields' and the names of all the 'fields' of
+    the run. Each array is a separate .npy file under 'arrays/', which can
+    be memory-mapped.
+    """
+    import pandas as pd
+    catalog = Tardis_Catalog(path_tardis_output)
+    scalars_fpath = store_fp + 'scalars.pkl'
+    if force and os.path.exists(store_fp):
+        shutil.rmtree(store_fp)
+    if not os.path.exists(store_fp):
+        os.makedirs(store_fp)
+    rows = {}
+    if os.path.isfile(scalars_fpath):
+        rows = pd.read_pickle(scalars_fpath).to_dict('index')
+
+    N_extracted, N_skipped = 0, 0
+    current = set()
+    for run in catalog.find():
+        rel_path, fpath = run['path'], catalog.get_full_path(run)
+        current.add(rel_path)
+        mtime = os.path.getmtime(fpath)
+        if rel_path in rows and rows[rel_path]['mtime'] == mtime:
+            continue
+        with open(fpath, 'rb') as inp:
+            D = cPickle.load(inp)
+        if not isinstance(D, dict):
+            rows.pop(rel_path, None)
+            N_skipped += 1
+            continue
+        rows[rel_path] = extract_run(D, store_fp, rel_path)
+        rows[rel_path]['mtime'] = mtime
+        N_extracted += 1
+
+    #Runs which no longer exist are dropped from the table.
+    rows = dict((rel_path, row) for rel_path, row in rows.items()
+                if rel_path in current)
+    df = pd.DataFrame.from_dict(rows, orient='index')
+    tmp_fpath = scalars_fpath + '.tmp' + str(os.getpid())
+    df.to_pickle(tmp_fpath)
+    os.rename(tmp_fpath, scalars_fpath)
+    print ('  -TARDIS PRODUCTS: ' + str(N_extracted) + ' runs extracted, '
+           + str(len(rows) - N_extracted) + ' up to date, '
+           + str(N_skipped) + ' not extractable.')
+    return df
+
+class Run_Products(object):
+    """Read-only view of a TARDIS run, which behaves like the dictionary
+    stored in its .pkl file. Fields in the store are read from it (arrays
+    are memory-mapped) and any other field triggers a single load of the
+    full .pkl file. Which fields exist is known from the store, so 'keys'
+    and 'in' never load the .pkl file.
+    """
+
+    def __init__(self, fpath, row, store_fp):
+        self.fpath = fpath
+        self.row = row
+        self.store_fp = store_fp
+        self.rel_path = row.name
+        self.values = {}
+        self.D = None
+
+    def load_full(self):
+        if self.D is None:
+            self.D = cached_loader.load(self.fpath)
+        return self.D
+
+    def rebuild(self, field, value):
+        unit = self.row.get(field + '.unit')
+        if isinstance(unit, basestring):
+            from astropy import units as u
+            return value * u.Unit(unit)
+        return value
+
+    def __getitem__(self, field):
+        if field not in self.values:
+            if field in self.row['array_fields']:
+                self.values[field] = self.rebuild(field, np.load(
+                  get_array_fpath(self.store_fp, self.rel_path, field),
+                  mmap_mode='r'))
+            elif field in self.row['scalar_fields']:
+                self.values[field] = self.rebuild(field, self.row[field])
+            elif field not in self.row['fields']:
+                raise KeyError(field)
+            else:
+                self.values[field] = self.load_full()[field]
+        return self.values[field]
+
+    def __contains__(self, field):
+        return (field in self.row['scalar_fields']
+                or field in self.row['array_fields']
+                or field in self.row['fields'])
+
+    def get(self, field, default=None):
+        try:
+            return self[field]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return list(self.row['fields'])
+
+    def load_store_fields(self):
+        """Read every field held in the store, i.e. memory-map the arrays,
+        without loading the .pkl file.
+        """
+        for kind in ['array_fields', 'scalar_fields']:
+            for field in self.row[kind]:
+                self[field]
+        return self
+
+class Products_Store(object):
+    """Loader of TARDIS runs from the store written by 'extract_products'.
+
+    Parameters
+    ----------
+    path_tardis_output : ~str
+        Default is None, which uses the 'path_tardis_output' environment
+        variable.
+    store_fp : ~str
+        Directory of the store.
+
+    Notes
+    -----
+    'load' returns a 'Run_Products' for runs in the store whose .pkl file
+    has not changed since it was extracted. The same Run_Products (and
+    therefore the fields it has already read) is returned for a run by
+    every store of the process. Any other file (e.g. observed spectra, or
+    runs extracted from an older .pkl) is unpickled through
+    'cached_loader', so that it is only read once per process.
+    """
+
+    def __init__(self, path_tardis_output=None,
+                 store_fp='./../OUTPUT_FILES/tardis_products/'):
+        import pandas as pd
+        if path_tardis_output is None:
+            path_tardis_output = os.environ['path_tardis_output']
+        self.path_tardis_output = os.path.abspath(path_tardis_output)
+        self.store_fp = store_fp
+        self.scalars = None
+        if os.path.isfile(store_fp + 'scalars.pkl'):
+            self.scalars = cached_loader.load(store_fp + 'scalars.pkl',
+                                              pd.read_pickle)
+
+    def get_rel_path(self, fpath):
+        fpath = os.path.abspath(fpath)
+        if fpath.startswith(self.path_tardis_output + os.sep):
+            return fpath[len(self.path_tardis_output) + 1:]
+        return None
+
+    def load(self, fpath):
+        rel_path = self.get_rel_path(fpath)
+        if self.scalars is None or rel_path not in self.scalars.index:
+            return cached_loader.load(fpath)
+        mtime = os.path.getmtime(fpath)
+        if self.scalars.loc[rel_path, 'mtime'] != mtime:
+            return cached_loader.load(fpath)
+        key = (os.path.abspath(self.store_fp), rel_path)
+        with run_products_lock:
+            if key not in run_products or run_products[key][0] != mtime:
+                run_products[key] = (mtime, Run_Products(
+                  fpath, self.scalars.loc[rel_path], self.store_fp))
+            return run_products[key][1]
+
+if __name__ == '__main__':
+    #Extract (or update) the store, e.g. python tardis_products.py [--force]
+    print '\n*EXTRACTING TARDIS PRODUCTS.'
+    extract_products(force='--force' in sys.argv)
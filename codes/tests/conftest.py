@@ -0,0 +1,71 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+#The modules in codes/ are imported as top level modules by the scripts.
+codes_fp = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, codes_fp)
+
+def put(line, first, text):
+    line = line.ljust(first + len(text))
+    return line[:first] + text + line[first + len(text):]
+
+def write_BSNIP_data(BSNIP_fp, SNIDs):
+    """Write BSNIP tables and spectra with the layout of the published files,
+    three spectra per object.
+    """
+    spectra_fp = BSNIP_fp + 'paper_I/Spectra_database/'
+    os.makedirs(spectra_fp)
+    os.makedirs(BSNIP_fp + 'paper_II')
+    rng = np.random.RandomState(0)
+    table1, table2, tablea1 = [], [], []
+    tableb = [[] for i in range(9)]
+    for n, SNID in enumerate(SNIDs):
+        row = put(put('', 3, SNID.ljust(6)), 10, 'Ia-norm ')
+        table1.append(put(put(row, 50, 'E      '), 57, '%6d%6.3f' % (
+          1000 + 300 * n, 0.02)))
+        tablea1.append(put(put('', 3, SNID.ljust(6)), 75, 'Ia-norm CN'))
+        for i_date in range(3):
+            date = '2000%02d%02d.%03d' % (n + 1, i_date + 1, 100 * i_date)
+            phase = [-3.2, 4.5, 25.][i_date] + n
+            row = put('', 3, SNID.ljust(6))
+            row = put(row, 11, (date[:4] + '/' + date[4:6] + '/'
+                                + date[6:]).ljust(14))
+            row = put(put(row, 37, '%7.2f' % phase), 47, ' 3300  10000')
+            table2.append(put(row, 115, 'y'))
+            for i in range(9):
+                row = put(put('', 3, SNID.ljust(6)), 11, '%6.2f' % phase)
+                tableb[i].append(put(row, 46, '%5.1f' % (40. + i)))
+
+            N = 400 + 150 * ((3 * n + i_date) % 5)
+            wavelength = np.linspace(3300., 10000., N)
+            flux = (1. + 0.1 * np.sin(wavelength / 300.)
+                    + rng.normal(0., 0.02, N))
+            np.savetxt(spectra_fp + 'sn' + SNID.lower() + '-' + date
+                       + '-ui.flm', np.column_stack((wavelength, flux)))
+
+    #Table 2 is matched to the spectra by position, in the same order.
+    table2.sort(key=lambda row: 'SN' + row[3:9].strip().upper() + '|'
+                + row[11:25].replace('/', '').strip())
+    for fname, rows in [('paper_I/table1.dat', table1),
+                        ('paper_I/table2.dat', table2),
+                        ('paper_II/tablea1.dat', tablea1)] + [
+                        ('paper_II/tableb' + str(i + 1) + '.dat', tableb[i])
+                        for i in range(9)]:
+        with open(BSNIP_fp + fname, 'w') as out:
+            out.write('\n'.join(rows) + '\n')
+
+@pytest.fixture
+def BSNIP_run_fp(tmpdir, monkeypatch):
+    """Directory laid out like the repository, with generated BSNIP data,
+    in which the scripts can be run (from the returned 'codes' directory).
+    """
+    root = str(tmpdir)
+    write_BSNIP_data(root + '/data/BSNIP_I/',
+                     ['1994D', '1997Y', '1997br', '2002bo', '2005bl'])
+    os.makedirs(root + '/OUTPUT_FILES')
+    os.makedirs(root + '/codes')
+    monkeypatch.chdir(root + '/codes')
+    return root + '/codes/'
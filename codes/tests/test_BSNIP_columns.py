@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pandas.util.testing import assert_frame_equal
+
+import cached_loader
+from BSNIP_columns import get_column_kind, read_columns, write_columns
+from ragged_array import Ragged_Array
+
+def make_dataframe(index):
+    spectra = np.empty(3, dtype=object)
+    spectra[:] = [np.arange(4.), np.nan, np.arange(2.)]
+    mixed = np.empty(3, dtype=object)
+    mixed[:] = [{'a': 1}, 'text', 2.]
+    return pd.DataFrame(
+      {'phase': [1.5, -2., 12.], 'N': [1, 2, 3],
+       'subtype': ['Ia-norm', np.nan, 'Ia-91bg'],
+       'flux_raw': spectra, 'mixed': mixed},
+      index=index, columns=['phase', 'N', 'subtype', 'flux_raw', 'mixed'])
+
+def assert_same(result, expected):
+    assert list(result.index) == list(expected.index)
+    assert list(result.columns) == list(expected.columns)
+    for name in ['phase', 'N', 'subtype', 'mixed']:
+        assert_frame_equal(result[[name]], expected[[name]],
+                           check_dtype=False, check_index_type=False)
+    for value, expected_value in zip(result['flux_raw'],
+                                     expected['flux_raw']):
+        if isinstance(expected_value, float):
+            assert np.isnan(value)
+        else:
+            np.testing.assert_array_equal(value, expected_value)
+
+def test_column_kinds():
+    df = make_dataframe([0, 1, 2])
+    assert [get_column_kind(df[name].values) for name in df.columns] == [
+      'array', 'array', 'string', 'ragged', 'object']
+
+@pytest.mark.parametrize('index', [[4, 7, 9], ['sn1994d-1', 'sn1997y-2', 'x'],
+                                   [0.5, 1.5, 2.5]])
+def test_round_trip(tmpdir, index):
+    df = make_dataframe(index)
+    filename = str(tmpdir.join('BSNIP'))
+    write_columns(df, filename + '.cols/')
+    assert_same(read_columns(filename), df)
+
+def test_string_index_with_missing_entry(tmpdir):
+    df = make_dataframe(['a', np.nan, 'c'])
+    filename = str(tmpdir.join('BSNIP'))
+    write_columns(df, filename + '.cols/')
+    index = read_columns(filename).index
+    assert index[0] == 'a' and np.isnan(index[1]) and index[2] == 'c'
+
+def test_extra_arrays_and_subsets(tmpdir):
+    df = make_dataframe([0, 1, 2])
+    filename = str(tmpdir.join('BSNIP'))
+    arrays = {'wavelength_corr': Ragged_Array.from_arrays(
+      [np.ones(3), np.ones(5), None])}
+    write_columns(df, filename + '.cols/', arrays=arrays)
+
+    result = read_columns(filename, columns=['wavelength_corr', 'phase'])
+    assert list(result.columns) == ['wavelength_corr', 'phase']
+    assert len(result['wavelength_corr'][1]) == 5
+    assert np.isnan(result['wavelength_corr'][2])
+
+    with pytest.raises(KeyError):
+        read_columns(filename, columns=['phase', 'not_a_column'])
+    result = read_columns(filename, columns=['phase', 'not_a_column'],
+                          skip_missing=True)
+    assert list(result.columns) == ['phase']
+
+def test_rewrite_replaces_output(tmpdir):
+    filename = str(tmpdir.join('BSNIP'))
+    write_columns(make_dataframe([0, 1, 2]), filename + '.cols/')
+    df = make_dataframe([3, 4, 5])[['phase']]
+    write_columns(df, filename + '.cols/')
+    assert_frame_equal(read_columns(filename), df)
+
+def test_pickle_output(tmpdir):
+    df = make_dataframe(['a', 'b', 'c'])
+    filename = str(tmpdir.join('BSNIP'))
+    df.to_pickle(filename + '.pkl')
+    assert_same(read_columns(filename), df)
+    assert list(read_columns(filename, ['N', 'other'], skip_missing=True)
+                .columns) == ['N']
+
+def test_columns_are_read_once(tmpdir):
+    filename = str(tmpdir.join('BSNIP'))
+    write_columns(make_dataframe([0, 1, 2]), filename + '.cols/')
+    cached_loader.loader.clear()
+    read_columns(filename)
+    N_misses = cached_loader.loader.get_stats()['N_misses']
+    df = read_columns(filename, columns=['phase', 'subtype'])
+    stats = cached_loader.loader.get_stats()
+    assert stats['N_misses'] == N_misses and stats['N_hits'] >= 3
+
+    #The returned dataframes are copies of the cached columns.
+    df.loc[0, 'phase'] = 100.
+    df.loc[1, 'subtype'] = 'changed'
+    assert_same(read_columns(filename), make_dataframe([0, 1, 2]))
+
+    #A rewritten output is read again.
+    write_columns(make_dataframe([0, 1, 2])[['N']] * 2, filename + '.cols/')
+    assert list(read_columns(filename)['N']) == [2, 4, 6]
+
+def test_render_session_preloads_the_columns(tmpdir, monkeypatch):
+    import render_paper_figures
+    write_columns(make_dataframe([0, 1, 2]),
+                  str(tmpdir.mkdir('OUTPUT_FILES').join('BSNIP.cols')) + '/')
+    monkeypatch.chdir(str(tmpdir.mkdir('codes')))
+    session = render_paper_figures.Render_Session(
+      workers=1, figures=['not_a_figure'],
+      path_tardis_output=str(tmpdir.mkdir('tardis')))
+    cached_loader.loader.clear()
+    assert session.load_shared_data() == 1
+    N_misses = cached_loader.loader.get_stats()['N_misses']
+    read_columns('./../OUTPUT_FILES/BSNIP', ['phase', 'subtype', 'flux_raw'])
+    assert cached_loader.loader.get_stats()['N_misses'] == N_misses
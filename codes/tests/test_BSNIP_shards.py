@@ -0,0 +1,68 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+from pandas.util.testing import assert_frame_equal
+
+from conftest import codes_fp
+from BSNIP_shards import assign_shards, merge_shards, parse_shard
+
+def run_BSNIP(run_fp, filename, shard=None):
+    """Run the native engine in a separate process. The engine is not
+    available from the command line of compute_BSNIP_features.py.
+    """
+    env = dict(os.environ, MPLBACKEND='Agg', PYTHONPATH=codes_fp)
+    code = ('from compute_BSNIP_features import BSNIP_Database\n'
+            'BSNIP_Database(filename=%r, shard=%r, engine="native")'
+            % (filename, shard))
+    subprocess.check_call([sys.executable, '-c', code], cwd=run_fp, env=env)
+
+def assert_same_output(result, expected):
+    assert list(result.columns) == list(expected.columns)
+    assert list(result.index) == list(expected.index)
+    for name in result.columns:
+        for value, expected_value in zip(result[name], expected[name]):
+            if isinstance(expected_value, np.ndarray):
+                np.testing.assert_array_equal(value, expected_value)
+            else:
+                assert_frame_equal(pd.DataFrame([value]),
+                                   pd.DataFrame([expected_value]))
+
+def test_parse_shard():
+    assert parse_shard('1/3') == (1, 3)
+    assert parse_shard((0, 2)) == (0, 2)
+    for shard in ['3/3', '1', 'a/b']:
+        with pytest.raises(ValueError):
+            parse_shard(shard)
+
+def test_assign_shards_balances_costs():
+    IDs = ['SN' + str(i) for i in range(7)]
+    costs = [5, 1, 4, 3, 2, 2, 3]
+    assignment = assign_shards(IDs, costs, 3)
+    loads = [sum([cost for cost, i in zip(costs, assignment) if i == shard])
+             for shard in range(3)]
+    assert sorted(loads) == [6, 7, 7]
+    assert list(assign_shards(IDs[::-1], costs[::-1], 3)) == (
+      list(assignment[::-1]))
+
+def test_merged_shards_match_single_run(BSNIP_run_fp):
+    run_BSNIP(BSNIP_run_fp, 'single')
+    for i in range(3):
+        run_BSNIP(BSNIP_run_fp, 'sharded', str(i) + '/3')
+
+    out_fp = BSNIP_run_fp + '../OUTPUT_FILES/'
+    merged = merge_shards('sharded', 3, out_fp=out_fp)
+    single = pd.read_pickle(out_fp + 'single.pkl')
+    assert len(single) == 10
+    assert_same_output(merged, single)
+    assert_same_output(pd.read_pickle(out_fp + 'sharded.pkl'), single)
+
+def test_merge_reports_missing_shards(BSNIP_run_fp):
+    for i in range(2):
+        run_BSNIP(BSNIP_run_fp, 'sharded', str(i) + '/3')
+    with pytest.raises(ValueError) as error:
+        merge_shards('sharded', 3, out_fp=BSNIP_run_fp + '../OUTPUT_FILES/')
+    assert 'Missing shard files' in str(error.value)
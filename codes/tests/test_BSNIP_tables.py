@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+from pandas.util.testing import assert_frame_equal
+
+import BSNIP_tables
+from BSNIP_tables import (feature_quantities, get_BSNIP_tables,
+                          pivot_features, read_feature_tables)
+
+def put(line, first, text):
+    line = line.ljust(first + len(text))
+    return line[:first] + text + line[first + len(text):]
+
+def make_tableb_row(SNID, phase, values):
+    row = put('', 3, SNID.ljust(6))
+    row = put(row, 11, phase.rjust(6))
+    for (quantity, first, last), value in zip(feature_quantities, values):
+        row = put(row, first, value.rjust(last - first))
+    return row
+
+def write_tables(BSNIP_fp, rows_b):
+    """Write tables b1-b9 (from rows_b) plus minimal table1, table2 and
+    tablea1 files under BSNIP_fp.
+    """
+    BSNIP_fp.join('paper_I').ensure(dir=True)
+    BSNIP_fp.join('paper_II').ensure(dir=True)
+    for name in ['paper_I/table1.dat', 'paper_I/table2.dat',
+                 'paper_II/tablea1.dat']:
+        BSNIP_fp.join(name).write(put('', 3, '1994D ') + '\n')
+    for i in range(9):
+        BSNIP_fp.join('paper_II/tableb' + str(i + 1) + '.dat').write(
+          '\n'.join(rows_b[i]) + '\n')
+
+def read_features_baseline(BSNIP_fp, df):
+    """The row by row parsing and nine merges used before BSNIP_tables."""
+    for i in range(9):
+        key = str(i + 1)
+        list_base = []
+        with open(BSNIP_fp + 'paper_II/tableb' + key + '.dat', 'r') as f:
+            for row in f:
+                dv = {}
+                dv['SNID'] = ('SN' + row[3:9].replace(' ', '')
+                              .replace('\n', '').upper())
+                dv['phase'] = row[11:17].replace(' ', '').replace('\n', '')
+                for (quantity, first, last) in feature_quantities:
+                    dv['BSNIP_' + quantity + '_f' + key] = (
+                      row[first:last].replace(' ', '').replace('\n', ''))
+                for var in dv.keys():
+                    if dv[var] == '':
+                        dv[var] = np.nan
+                list_base.append(dv)
+        df = pd.merge(df, pd.DataFrame(list_base), on=['SNID', 'phase'],
+                      how='left').set_index(df.index)
+    return df
+
+def make_rows_b():
+    rng = np.random.RandomState(1)
+    rows_b = [[] for i in range(9)]
+    for SNID in ['1994D', '1997br', '2005bl']:
+        for phase in ['-3.20', '4.50', '12.00']:
+            for i in range(9):
+                if rng.uniform() < 0.3:
+                    continue
+                values = ['%.1f' % value for value in rng.uniform(0., 99., 10)]
+                #Some quantities are not measured.
+                values[rng.randint(10)] = ''
+                rows_b[i].append(make_tableb_row(SNID, phase, values))
+    return rows_b
+
+def test_features_match_baseline_merges(tmpdir):
+    write_tables(tmpdir, make_rows_b())
+    df = pd.DataFrame({
+      'SNID': ['SN1994D', 'SN1994D', 'SN1997BR', 'SN2005BL', 'SN2011FE'],
+      'phase': ['-3.20', '12.00', '4.50', '-3.20', '0.00']},
+      index=[4, 7, 9, 12, 20])
+
+    expected = read_features_baseline(str(tmpdir) + '/', df)
+    df_tableb = pivot_features(read_feature_tables(str(tmpdir) + '/'))
+    result = pd.merge(df, df_tableb, on=['SNID', 'phase'],
+                      how='left').set_index(df.index)
+
+    assert_frame_equal(result, expected[result.columns])
+    assert sorted(result.columns) == sorted(expected.columns)
+
+def test_repeated_rows_are_reported_and_dropped(tmpdir, capsys):
+    rows_b = make_rows_b()
+    first = make_tableb_row('1994D', '0.00', ['1.0'] * 10)
+    second = make_tableb_row('1994D', '0.00', ['2.0'] * 10)
+    rows_b[6] += [first, second]
+    write_tables(tmpdir, rows_b)
+
+    df = pivot_features(read_feature_tables(str(tmpdir) + '/'))
+
+    assert 'SN1994D at phase 0.00 is repeated in table b7' in (
+      capsys.readouterr()[0])
+    row = df[(df['SNID'] == 'SN1994D') & (df['phase'] == '0.00')]
+    assert len(row) == 1
+    assert row['BSNIP_pEW_f7'].values[0] == '1.0'
+
+def test_cache_is_rebuilt_when_specs_change(tmpdir, monkeypatch):
+    write_tables(tmpdir, make_rows_b())
+    cache_fp = str(tmpdir.join('cache', 'tables.pkl'))
+    tables = get_BSNIP_tables(str(tmpdir) + '/', cache_fp)
+    assert get_BSNIP_tables(str(tmpdir) + '/', cache_fp)['features'].equals(
+      tables['features'])
+
+    fname, columns = BSNIP_tables.table_specs['table1']
+    monkeypatch.setitem(BSNIP_tables.table_specs, 'table1',
+                        (fname, columns[:1]))
+    table1 = get_BSNIP_tables(str(tmpdir) + '/', cache_fp)['table1']
+    assert list(table1.columns) == ['SNID']
+
+    monkeypatch.setattr(BSNIP_tables, 'tables_version', 2)
+    monkeypatch.setattr(BSNIP_tables, 'read_fixed_width',
+                        lambda fpath, columns: 'rebuilt')
+    monkeypatch.setattr(BSNIP_tables, 'read_feature_tables',
+                        lambda BSNIP_fp: 'rebuilt')
+    assert get_BSNIP_tables(str(tmpdir) + '/', cache_fp)['table1'] == (
+      'rebuilt')
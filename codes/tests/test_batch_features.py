@@ -0,0 +1,134 @@
+import numpy as np
+import pytest
+
+import pandas as pd
+
+from batch_features import (
+  Batch_Features, Batch_Uncertainty, analyse_native, check_validation,
+  compare_features, compute_feature_block, feature_keys, feature_windows,
+  make_reference_spectra, smooth_block, uncertainty_tolerances,
+  validate_engine, validate_reference, validate_uncertainties,
+  validation_tolerances)
+
+def test_native_engine_recovers_the_reference_features():
+    validation = validate_reference(analyse_native)
+    assert list(validation['N']) == [5] * 27
+    assert check_validation(validation) == []
+    #Measured: pEW within 0.3%, velocity within 40 km/s, depth within 0.002.
+    for key in feature_keys:
+        assert validation.loc['pEW_f' + key, 'max_rel'] < 0.005
+        assert validation.loc['velocity_f' + key, 'max_abs'] < 0.05
+        assert validation.loc['depth_f' + key, 'max_abs'] < 0.005
+
+def test_native_engine_recovers_the_features_of_noisy_spectra():
+    validation = pd.concat([validate_engine(
+      make_reference_spectra(key, noise=0.01), 21).loc[[
+      var + '_f' + key for var in ['pEW', 'velocity', 'depth']]]
+      for key in feature_keys])
+    assert check_validation(validation) == []
+
+def test_reference_continuum_points_are_inside_the_regions():
+    for key in feature_keys:
+        window = feature_windows[key]
+        for D in analyse_native(make_reference_spectra(key)):
+            assert D['pEW_flag_f' + key] == 0.
+            assert (window['blue'][0] + 5. < D['wavelength_b_f' + key]
+                    < window['blue'][1] - 5.)
+            assert (window['red'][0] + 5. < D['wavelength_r_f' + key]
+                    < window['red'][1] - 5.)
+
+def test_reference_features_do_not_depend_on_the_sampling():
+    D = make_reference_spectra('7', N_spectra=1)[0]
+    assert 0.2 < D['depth_f7'] < 0.7 and D['pEW_f7'] > 0.
+    assert -20. < D['velocity_f7'] < 0.
+    #The noiseless line is measured on a 0.01 angstrom grid.
+    native = analyse_native([D])[0]
+    assert abs(native['pEW_f7'] / D['pEW_f7'] - 1.) < 0.005
+
+def test_engine_agrees_with_itself():
+    list_D = analyse_native([D for key in feature_keys
+                             for D in make_reference_spectra(key, 2)])
+    validation = validate_engine(list_D, 21)
+    assert validation['max_abs'].max() == 0.
+    assert check_validation(validation) == []
+
+def test_differences_beyond_tolerance_are_reported():
+    list_reference = make_reference_spectra('6')
+    list_D = [dict(D) for D in list_reference]
+    list_D[0]['pEW_f6'] *= 1.5
+    list_D[1]['velocity_f6'] = np.nan
+    failures = check_validation(compare_features(list_D, list_reference,
+                                                 keys=['6']))
+    tolerance = validation_tolerances['pEW']['max_rel']
+    assert failures == ['pEW_f6: max_rel = 0.5 > ' + str(tolerance),
+                        'velocity_f6: N_mismatch = 1 > 0']
+
+def test_uncovered_feature_is_a_mismatch():
+    D = make_reference_spectra('9', N_spectra=1)[0]
+    short = dict(D, wavelength_corr=D['wavelength_corr'][:4000],
+                 flux_normalized=D['flux_normalized'][:4000])
+    native = Batch_Features([short['wavelength_corr']],
+                            [short['flux_normalized']],
+                            deredshift_and_normalize=False).run_analysis()
+    assert np.isnan(native[0]['pEW_f9'])
+    validation = compare_features(native, [D], keys=['9'])
+    assert validation.loc['pEW_f9', 'N_mismatch'] == 1
+
+def test_analyse_spectra_matches_the_reference():
+    pytest.importorskip('tardis.tardistools.compute_features')
+    from batch_features import analyse_tardistools
+    assert check_validation(validate_reference(analyse_tardistools)) == []
+    assert check_validation(validate_reference(
+      analyse_native, analyse_tardistools)) == []
+
+@pytest.mark.parametrize('key', ['6', '7'])
+def test_batched_uncertainties_match_the_scatter_of_the_features(key):
+    #The true uncertainty is the scatter of the features measured on
+    #independent noisy copies of the same spectrum.
+    D = make_reference_spectra(key, N_spectra=1)[0]
+    wavelength = D['wavelength_corr']
+    rng = np.random.RandomState(1)
+    copies = D['flux_normalized'][None, :] + 0.02 * rng.standard_normal(
+      (400, len(wavelength)))
+    out = compute_feature_block(wavelength, copies, smooth_block(copies, 21),
+                                key)
+
+    #Each estimate only sees one copy.
+    ratios = []
+    for i in range(5):
+        D_copy = Batch_Uncertainty(
+          {'wavelength_corr': wavelength, 'flux_normalized': copies[i]},
+          smoothing_window=21, N_MC_runs=500, seed=i,
+          features=[key]).run_uncertainties()
+        ratios.append([D_copy[var + '_unc_f' + key] / np.std(out[var])
+                       for var in ['pEW', 'velocity', 'depth']])
+    assert np.all(np.median(ratios, axis=0) > 0.7)
+    assert np.all(np.median(ratios, axis=0) < 1.4)
+
+def test_batched_uncertainties_are_reproducible():
+    D = make_reference_spectra('7', N_spectra=1, noise=0.02)[0]
+    list_D = [Batch_Uncertainty(dict(D), N_MC_runs=200, seed=3,
+                                features=['7']).run_uncertainties()
+              for i in range(2)]
+    assert list_D[0]['pEW_unc_f7'] == list_D[1]['pEW_unc_f7']
+    assert list_D[0]['pEW_unc_f7'] > 0.
+
+def test_batched_uncertainties_match_compute_uncertainty():
+    pytest.importorskip('tardis.tardistools.compute_features')
+    for key in feature_keys:
+        validation = validate_uncertainties(
+          make_reference_spectra(key, N_spectra=3, noise=0.02), keys=[key])
+        assert check_validation(validation, uncertainty_tolerances) == []
+
+def test_adaptive_runs_stop_early_near_the_full_result():
+    for key in ['6', '7']:
+        D = make_reference_spectra(key, N_spectra=1, noise=0.02)[0]
+        full = Batch_Uncertainty(dict(D), N_MC_runs=3000, seed=0,
+                                 features=[key]).run_uncertainties()
+        adaptive = Batch_Uncertainty(
+          dict(D), N_MC_runs=3000, seed=1, features=[key], chunk_size=100,
+          rtol=0.03).run_uncertainties()
+        assert adaptive['N_MC_runs_f' + key] < 3000
+        for var in ['pEW', 'velocity', 'depth']:
+            name = var + '_unc_f' + key
+            assert abs(adaptive[name] / full[name] - 1.) < 0.1
@@ -0,0 +1,91 @@
+import cPickle
+import os
+import threading
+
+import numpy as np
+import pytest
+
+import cached_loader
+from cached_loader import Cached_Loader, Frozen_Dict, freeze, prefetch
+
+def test_freeze_nested_objects():
+    D = freeze({'flux': np.ones(3), 'runs': [{'pEW': 1.}, (np.ones(2),)],
+                'pair': (np.zeros(2), {'a': 1})})
+    assert isinstance(D, Frozen_Dict)
+    assert isinstance(D['runs'][0], Frozen_Dict)
+    assert isinstance(D['pair'][1], Frozen_Dict)
+    for array in [D['flux'], D['runs'][1][0], D['pair'][0]]:
+        with pytest.raises(ValueError):
+            array[0] = 2.
+    with pytest.raises(TypeError):
+        D['runs'][0]['pEW'] = 2.
+    for method in ['clear', 'popitem']:
+        with pytest.raises(TypeError):
+            getattr(D, method)()
+    with pytest.raises(TypeError):
+        D.update({'a': 1})
+    with pytest.raises(TypeError):
+        del D['flux']
+
+def test_frozen_dict_copies_and_pickles():
+    D = freeze({'a': 1})
+    copy = dict(D)
+    copy['a'] = 2
+    assert D['a'] == 1
+    assert cPickle.loads(cPickle.dumps(D, protocol=2)) == D
+
+def write_pickle(fpath, obj):
+    with open(str(fpath), 'wb') as out:
+        cPickle.dump(obj, out, protocol=2)
+
+def test_files_are_read_once_until_they_change(tmpdir):
+    loader = Cached_Loader()
+    fpath = tmpdir.join('run.pkl')
+    write_pickle(fpath, {'value': 1})
+    D = loader.load(str(fpath))
+    assert loader.load(str(fpath)) is D
+    assert (loader.N_hits, loader.N_misses) == (1, 1)
+
+    write_pickle(fpath, {'value': 2, 'other': 3})
+    os.utime(str(fpath), (0., 0.))
+    assert loader.load(str(fpath))['value'] == 2
+    assert loader.get_stats()['N_items'] == 1
+
+def test_least_recently_used_files_are_evicted(tmpdir):
+    loader = Cached_Loader(max_items=2)
+    fpaths = [str(tmpdir.join(str(i) + '.pkl')) for i in range(3)]
+    for i, fpath in enumerate(fpaths):
+        write_pickle(fpath, i)
+    loader.load(fpaths[0])
+    loader.load(fpaths[1])
+    loader.load(fpaths[0])
+    loader.load(fpaths[2])
+    assert loader.N_evictions == 1
+    assert [key[0] for key in loader.entries.keys()] == [fpaths[0], fpaths[2]]
+
+def test_prefetch_keeps_order_and_reads_once(tmpdir):
+    fpaths = [str(tmpdir.join(str(i) + '.pkl')) for i in range(4)]
+    for i, fpath in enumerate(fpaths):
+        write_pickle(fpath, i)
+    calls = []
+    def loader(fpath):
+        calls.append(fpath)
+        return cached_loader.read_pickle(fpath)
+    spectra = prefetch(fpaths + fpaths[:2], loader, N_threads=3)
+    assert list(spectra) == [0, 1, 2, 3, 0, 1]
+    assert list(spectra[1:3]) == [1, 2] and len(spectra) == 6
+    assert sorted(calls) == sorted(fpaths)
+
+def test_prefetch_raises_loader_errors_on_access(tmpdir):
+    spectra = prefetch([str(tmpdir.join('missing.pkl'))])
+    with pytest.raises(EnvironmentError):
+        spectra[0]
+
+def test_prefetch_threads_exit_on_join(tmpdir):
+    fpath = str(tmpdir.join('run.pkl'))
+    write_pickle(fpath, 1)
+    threads = set(threading.enumerate())
+    spectra = prefetch([fpath] * 3, cached_loader.read_pickle, N_threads=2)
+    spectra.join()
+    assert list(spectra) == [1, 1, 1]
+    assert set(threading.enumerate()) <= threads
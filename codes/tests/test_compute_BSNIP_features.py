@@ -0,0 +1,33 @@
+import multiprocessing
+
+import pytest
+
+from compute_BSNIP_features import BSNIP_Database
+from spectra_store import Lazy_Spectra
+
+def test_workers_are_terminated_when_the_run_fails(BSNIP_run_fp,
+                                                   monkeypatch):
+    def write_part(self, i_shard, part):
+        raise IOError('disk full')
+    monkeypatch.setattr(BSNIP_Database, 'write_part', write_part)
+    with pytest.raises(IOError):
+        BSNIP_Database(filename='failed', workers=2, shard_size=2,
+                       engine='native', batch=True)
+    assert multiprocessing.active_children() == []
+
+def test_cold_run_reads_each_spectrum_once(BSNIP_run_fp, monkeypatch):
+    reads = []
+    getitem = Lazy_Spectra.__getitem__
+    def count_reads(self, key):
+        reads.append(key)
+        return getitem(self, key)
+    monkeypatch.setattr(Lazy_Spectra, '__getitem__', count_reads)
+    run = BSNIP_Database(filename='cold', engine='native', batch=True)
+    assert len(run.df) == 10
+    assert sorted(reads) == sorted(run.df.index)
+
+    #A second run takes every spectrum from the result cache.
+    del reads[:]
+    run = BSNIP_Database(filename='warm', engine='native', batch=True)
+    assert run.result_cache.N_hits == 10
+    assert sorted(reads) == sorted(run.df.index)
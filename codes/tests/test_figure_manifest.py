@@ -0,0 +1,107 @@
+import os
+
+import pytest
+
+import figure_manifest
+from figure_manifest import Managed_Figure, locked_manifest, read_manifest
+
+class Dummy_Figure(Managed_Figure):
+
+    figure_parameters = ['lm']
+
+    def __init__(self, input_fp, lm='downbranch', show_fig=False,
+                 save_fig=True, force=False):
+        self.input_fp = input_fp
+        self.lm = lm
+        self.show_fig = show_fig
+        self.save_fig = save_fig
+        self.force = force
+
+    def get_inputs(self):
+        return [self.input_fp]
+
+    def get_fig_fpath(self, extension):
+        return './../OUTPUT_FILES/FIGURES/Fig_' + self.lm + '.' + extension
+
+    def render(self):
+        with open(self.get_fig_fpath('pdf'), 'w') as out:
+            out.write('figure')
+        self.record_figure()
+
+@pytest.fixture
+def input_fp(tmpdir, monkeypatch):
+    tmpdir.mkdir('OUTPUT_FILES').mkdir('FIGURES')
+    monkeypatch.chdir(str(tmpdir.mkdir('codes')))
+    input_fp = tmpdir.mkdir('input')
+    input_fp.join('a.npy').write('a')
+    set_mtime(str(input_fp.join('a.npy')), 1000.)
+    return str(input_fp)
+
+def set_mtime(fpath, mtime):
+    os.utime(fpath, (mtime, mtime))
+
+def test_saved_figures_are_up_to_date(input_fp):
+    figure = Dummy_Figure(input_fp)
+    assert not figure.is_up_to_date() and not figure.skipped
+    figure.render()
+    assert Dummy_Figure(input_fp).is_up_to_date()
+    assert read_manifest(figure_manifest.manifest_fpath).keys() == [
+      os.path.abspath(figure.get_fig_fpath('pdf'))]
+
+def test_changed_inputs_render_the_figure_again(input_fp):
+    Dummy_Figure(input_fp).render()
+
+    #A file added to an input directory, even if older than the figure.
+    new_fp = os.path.join(input_fp, 'b.npy')
+    with open(new_fp, 'w') as out:
+        out.write('b')
+    set_mtime(new_fp, 1000.)
+    assert not Dummy_Figure(input_fp).is_up_to_date()
+    Dummy_Figure(input_fp).render()
+    assert Dummy_Figure(input_fp).is_up_to_date()
+
+    #An input modified after the figure was saved.
+    set_mtime(new_fp, os.path.getmtime(
+      Dummy_Figure(input_fp).get_fig_fpath('pdf')) + 10.)
+    assert not Dummy_Figure(input_fp).is_up_to_date()
+
+def test_parameters_and_options_are_checked(input_fp):
+    Dummy_Figure(input_fp).render()
+    assert not Dummy_Figure(input_fp, lm='macroatom').is_up_to_date()
+    for kwargs in [{'force': True}, {'show_fig': True}, {'save_fig': False}]:
+        assert not Dummy_Figure(input_fp, **kwargs).is_up_to_date()
+
+    #A manifest entry made with other parameters is not a match.
+    with locked_manifest() as manifest:
+        for fig_fpath in manifest:
+            manifest[fig_fpath] = 'other key'
+    assert not Dummy_Figure(input_fp).is_up_to_date()
+
+def test_deleted_figures_are_rendered_again(input_fp):
+    figure = Dummy_Figure(input_fp)
+    figure.render()
+    os.remove(figure.get_fig_fpath('pdf'))
+    assert not Dummy_Figure(input_fp).is_up_to_date()
+
+def test_helper_sources_are_inputs(input_fp, monkeypatch):
+    signatures, key = Dummy_Figure(input_fp).get_manifest_key()
+    fpaths = [fpath for (fpath, mtime, size) in signatures]
+    codes_fp = os.path.dirname(os.path.abspath(figure_manifest.__file__))
+    for module in ['plot_setup', 'tardis_products', 'cached_loader',
+                   'BSNIP_columns']:
+        assert os.path.join(codes_fp, module + '.py') in fpaths
+    assert os.path.abspath(__file__.replace('.pyc', '.py')) in fpaths
+
+    #Editing a helper changes the key.
+    helper_fp = os.path.join(input_fp, 'helper.py')
+    with open(helper_fp, 'w') as out:
+        out.write('x = 1\n')
+    set_mtime(helper_fp, 1000.)
+    monkeypatch.setattr(figure_manifest, 'get_source_fpaths',
+                        lambda modules: [helper_fp])
+    Dummy_Figure(input_fp).render()
+    assert Dummy_Figure(input_fp).is_up_to_date()
+    with open(helper_fp, 'w') as out:
+        out.write('x = 10\n')
+    set_mtime(helper_fp, 1000.)
+    assert not Dummy_Figure(input_fp).is_up_to_date()
@@ -0,0 +1,99 @@
+import os
+import cPickle
+
+import numpy as np
+import pytest
+
+import model_search
+from model_search import compute_distances, find_model_files, Model_Search
+
+def make_flux(wavelength, seed):
+    rng = np.random.RandomState(seed)
+    flux = 1. + 0.2 * np.sin(wavelength / rng.uniform(150., 400.))
+    for i in range(3):
+        flux -= rng.uniform(0.1, 0.4) * np.exp(
+          -0.5 * ((wavelength - rng.uniform(4000., 8000.)) / 60.)**2.)
+    return flux
+
+def test_scaled_copy_ranks_first():
+    wavelength = np.linspace(4000., 9000., 500)
+    observed = make_flux(wavelength, 0)
+    models = np.array([make_flux(wavelength, seed) for seed in range(1, 8)]
+                      + [3.7 * observed])
+    for metric in ['chi2', 'correlation']:
+        distance, scale, N_pixels = compute_distances(models, observed,
+                                                      metric)
+        assert np.argmin(distance) == 7
+        np.testing.assert_allclose(distance[7], 0., atol=1.e-10)
+        assert (distance[:7] > 1.e-4).all()
+    #The scale brings the model to the observed flux over its mean.
+    np.testing.assert_allclose(scale[7], 1. / 3.7 / np.mean(observed))
+    assert (N_pixels == 500).all()
+
+def test_partial_models_are_masked():
+    wavelength = np.linspace(4000., 9000., 500)
+    observed = make_flux(wavelength, 0)
+    observed[:20] = np.nan
+    partial, short = 2. * observed, 2. * observed
+    partial[400:] = np.nan
+    short[100:] = np.nan
+    models = np.array([make_flux(wavelength, 1), partial, short])
+    distance, scale, N_pixels = compute_distances(models, observed,
+                                                  min_coverage=0.5)
+    assert list(N_pixels) == [480, 380, 80]
+    np.testing.assert_allclose(distance[1], 0., atol=1.e-10)
+    assert distance[0] > 0. and np.isinf(distance[2])
+    with pytest.raises(ValueError):
+        compute_distances(models, observed, metric='L1')
+
+def write_model(fpath, wavelength, flux):
+    if not os.path.isdir(os.path.dirname(fpath)):
+        os.makedirs(os.path.dirname(fpath))
+    with open(fpath, 'wb') as out:
+        cPickle.dump({'wavelength_raw': wavelength, 'flux_raw': flux}, out,
+                     protocol=cPickle.HIGHEST_PROTOCOL)
+
+@pytest.fixture
+def tardis_fp(tmpdir):
+    tardis_fp = str(tmpdir) + '/tardis/'
+    wavelength = np.linspace(3000., 10000., 3000)
+    for i in range(4):
+        write_model(tardis_fp + '11fe_L-grid/model_' + str(i) + '.pkl',
+                    wavelength, make_flux(wavelength, i))
+    write_model(tardis_fp + 'other_grid/model_0.pkl', wavelength,
+                make_flux(wavelength, 0))
+    #Other products under the grids have no spectrum.
+    with open(tardis_fp + '11fe_L-grid/log.pkl', 'wb') as out:
+        cPickle.dump({'t_inner': 10000.}, out)
+    return tardis_fp
+
+def test_model_search(tmpdir, tardis_fp, monkeypatch):
+    calls = []
+    def write_spectrum_matrix(fpath, spectra, grid, N=None, **kwargs):
+        calls.append(N)
+        return original(fpath, spectra, grid, N=N, **kwargs)
+    original = model_search.write_spectrum_matrix
+    monkeypatch.setattr(model_search, 'write_spectrum_matrix',
+                        write_spectrum_matrix)
+
+    assert len(find_model_files(tardis_fp)) == 5
+    fpath = str(tmpdir) + '/model_matrix/'
+    search = Model_Search(tardis_fp, fpath=fpath)
+    assert calls == [4]
+    assert list(search.metadata['name']) == ['model_' + str(i)
+                                             for i in range(4)]
+
+    wavelength = np.linspace(3500., 9500., 1200)
+    ranking = search.rank((wavelength, 0.5 * make_flux(wavelength, 2)),
+                          4000., 9000.)
+    assert ranking['name'][0] == 'model_2'
+    assert ranking['distance'][0] < 1.e-4 < ranking['distance'][1]
+    assert len(search.rank((wavelength, make_flux(wavelength, 2)),
+                           grids=['none'])) == 0
+
+    #The matrix is only built again when a model changes.
+    Model_Search(tardis_fp, fpath=fpath)
+    assert calls == [4]
+    os.remove(tardis_fp + '11fe_L-grid/model_3.pkl')
+    assert len(Model_Search(tardis_fp, fpath=fpath).metadata) == 3
+    assert calls == [4, 3]
@@ -0,0 +1,31 @@
+import pytest
+
+from plot_setup import get_parser, parse_args
+
+@pytest.fixture
+def display(monkeypatch):
+    monkeypatch.setenv('DISPLAY', ':0')
+
+def get_kwargs(argv, **defaults):
+    return parse_args(get_parser('test', **defaults), argv).figure_kwargs
+
+def test_scripts_keep_their_defaults(display):
+    assert get_kwargs([]) == {'show_fig': True, 'save_fig': False,
+                              'force': False}
+    assert get_kwargs([], show_fig=False, save_fig=True) == {
+      'show_fig': False, 'save_fig': True, 'force': False}
+    assert get_kwargs(['--no-show', '--save', '--force']) == {
+      'show_fig': False, 'save_fig': True, 'force': True}
+    assert get_kwargs(['--no-save'], save_fig=True)['save_fig'] is False
+
+def test_batch_mode_saves_without_showing(display):
+    assert get_kwargs(['--batch']) == {'show_fig': False, 'save_fig': True,
+                                       'force': False}
+    assert get_kwargs(['--batch', '--no-save'])['save_fig'] is False
+
+def test_no_display_runs_in_batch_mode(monkeypatch):
+    monkeypatch.setattr('sys.platform', 'linux2')
+    monkeypatch.delenv('DISPLAY', raising=False)
+    monkeypatch.delenv('WAYLAND_DISPLAY', raising=False)
+    assert get_kwargs([]) == {'show_fig': False, 'save_fig': True,
+                              'force': False}
@@ -0,0 +1,55 @@
+from StringIO import StringIO
+
+import progress_reporter
+from progress_reporter import Progress_Reporter, format_duration
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.
+    def time(self):
+        return self.now
+
+def make_reporter(monkeypatch, **kwargs):
+    clock = Clock()
+    monkeypatch.setattr(progress_reporter.time, 'time', clock.time)
+    stream = StringIO()
+    return Progress_Reporter(10, stream=stream, **kwargs), clock, stream
+
+def test_reports_are_throttled(monkeypatch):
+    progress, clock, stream = make_reporter(monkeypatch, batch=True,
+                                            interval=30.)
+    for i in range(6):
+        clock.now += 10.
+        progress.update(10.)
+    #Reports at 30s and 60s only.
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 2
+    assert lines[0].startswith('    -PROGRESS: 3/10 spectra (30.0%)')
+    progress.finish()
+    assert len(stream.getvalue().splitlines()) == 3
+
+def test_status_has_rate_eta_and_failures(monkeypatch):
+    progress, clock, stream = make_reporter(monkeypatch, batch=True,
+                                            interval=1.e9, alpha=0.5)
+    for latency, failed in [(2., False), (4., True), (None, False),
+                            (6., True)]:
+        clock.now += 5.
+        progress.update(latency, failed=failed)
+    #4 items in 20s, so the 6 remaining ones take 30s.
+    assert progress.get_status() == (
+      '4/10 spectra (40.0%), 0.20 spectra/s, latency 4.50s, ETA 0m30s,'
+      ' 2 failed')
+    assert stream.getvalue() == ''
+
+def test_terminal_mode_overwrites_one_line(monkeypatch):
+    progress, clock, stream = make_reporter(monkeypatch, batch=False,
+                                            interval=0.)
+    clock.now += 1.
+    progress.update(1.)
+    progress.finish()
+    assert stream.getvalue().startswith('\r    -PROGRESS: 1/10')
+    assert stream.getvalue().count('\n') == 1
+
+def test_format_duration():
+    assert format_duration(59.6) == '1m00s'
+    assert format_duration(3725.) == '1h02m'
@@ -0,0 +1,83 @@
+import cPickle
+
+import numpy as np
+import pytest
+
+from ragged_array import Ragged_Array
+
+def make_rows():
+    rng = np.random.RandomState(0)
+    return [rng.normal(size=N) for N in [5, 0, 17, 1, 40, 3]]
+
+def test_append_and_index():
+    rows = make_rows()
+    ragged = Ragged_Array.from_arrays(rows + [None, np.nan])
+    assert len(ragged) == 8
+    for i, row in enumerate(rows):
+        np.testing.assert_array_equal(ragged[i], row)
+    assert np.isnan(ragged[6]) and np.isnan(ragged[-1])
+    assert list(ragged.lengths) == [5, 0, 17, 1, 40, 3, 0, 0]
+    assert list(ragged.mask) == [False] * 6 + [True] * 2
+    assert len(ragged.data) == ragged.offsets[-1] == 66
+    with pytest.raises(IndexError):
+        ragged[8]
+
+def test_rows_are_views_of_the_buffer():
+    ragged = Ragged_Array.from_arrays(make_rows())
+    row = ragged[2]
+    assert np.may_share_memory(row, ragged.data)
+    row[0] = 100.
+    assert ragged[2][0] == 100.
+
+def test_views_survive_growth():
+    ragged = Ragged_Array(dtype=np.float64)
+    ragged.append(np.arange(3.))
+    view = ragged[0]
+    for i in range(100):
+        ragged.append(np.ones(50))
+    np.testing.assert_array_equal(view, np.arange(3.))
+    np.testing.assert_array_equal(ragged[0], np.arange(3.))
+    assert len(ragged) == 101
+
+def test_dtype_from_first_row():
+    ragged = Ragged_Array.from_arrays([None, np.arange(3, dtype=np.int32)])
+    assert ragged.dtype == np.int32
+    assert Ragged_Array.from_arrays([[1., 2.]], dtype=np.float32).dtype == (
+      np.float32)
+
+def test_concatenate():
+    rows = make_rows()
+    ragged = Ragged_Array.concatenate(
+      [Ragged_Array.from_arrays(rows[:2]),
+       Ragged_Array.from_arrays(rows[2:] + [None])])
+    assert len(ragged) == len(rows) + 1
+    for i, row in enumerate(rows):
+        np.testing.assert_array_equal(ragged[i], row)
+    assert np.isnan(ragged[len(rows)])
+
+def test_save_load_and_pickle(tmpdir):
+    rows = make_rows() + [None]
+    ragged = Ragged_Array.from_arrays(rows)
+    fpath = str(tmpdir.join('flux'))
+    ragged.save(fpath)
+    for loaded in [Ragged_Array.load(fpath), Ragged_Array.load(fpath, None),
+                   cPickle.loads(cPickle.dumps(ragged, protocol=2))]:
+        assert len(loaded) == len(rows)
+        for i, row in enumerate(rows[:-1]):
+            np.testing.assert_array_equal(loaded[i], row)
+        assert np.isnan(loaded[len(rows) - 1])
+    assert isinstance(Ragged_Array.load(fpath).data, np.memmap)
+
+def test_empty(tmpdir):
+    ragged = Ragged_Array(dtype=np.float64)
+    assert len(ragged) == 0 and len(ragged.data) == 0
+    fpath = str(tmpdir.join('empty'))
+    ragged.save(fpath)
+    assert len(Ragged_Array.load(fpath)) == 0
+    assert len(ragged.to_object_array()) == 0
+
+def test_to_object_array():
+    rows = make_rows()
+    values = Ragged_Array.from_arrays(rows).to_object_array()
+    assert values.dtype == object and len(values) == len(rows)
+    np.testing.assert_array_equal(values[4], rows[4])
@@ -0,0 +1,121 @@
+import os
+import types
+
+import numpy as np
+
+import result_cache
+from result_cache import Result_Cache, compute_code_version
+
+version_0, version_1 = '0123456789ab', 'ba9876543210'
+
+def make_cache(tmpdir, max_bytes=2.e9):
+    return Result_Cache(str(tmpdir.join('cache')) + '/', version_1,
+                        max_bytes=max_bytes)
+
+def make_spectrum(tmpdir, name='sn1994d-19940310-ui.flm'):
+    fpath = tmpdir.join(name)
+    fpath.write('4000. 1.\n4001. 1.\n')
+    return str(fpath)
+
+def test_put_and_get(tmpdir):
+    cache = make_cache(tmpdir)
+    key = cache.make_key(make_spectrum(tmpdir), ID='sn1994d-1')
+    assert key not in cache
+    assert cache.get(key) is None
+    cache.put(key, {'pEW_f7': 1.5})
+    assert key in cache
+    assert cache.get(key) == {'pEW_f7': 1.5}
+    assert (cache.N_hits, cache.N_misses) == (1, 1)
+
+def test_key_depends_on_file_and_parameters(tmpdir):
+    cache = make_cache(tmpdir)
+    fpath = make_spectrum(tmpdir)
+    key = cache.make_key(fpath, ID='a', smoothing_window=21)
+    assert key == cache.make_key(fpath, smoothing_window=21, ID='a')
+    assert key != cache.make_key(fpath, ID='b', smoothing_window=21)
+    assert key != cache.make_key(fpath, ID='a', smoothing_window=51)
+    assert key != cache.make_key(make_spectrum(tmpdir, 'other.flm'), ID='a',
+                                 smoothing_window=21)
+
+    #A rewritten file is a new entry, even with the same size.
+    with open(fpath, 'w') as out:
+        out.write('4000. 2.\n4001. 2.\n')
+    os.utime(fpath, (0., 0.))
+    assert key != cache.make_key(fpath, ID='a', smoothing_window=21)
+
+def test_evict_removes_least_recently_used(tmpdir):
+    cache = make_cache(tmpdir)
+    fpath = make_spectrum(tmpdir)
+    keys = [cache.make_key(fpath, i=i) for i in range(4)]
+    for i, key in enumerate(keys):
+        cache.put(key, {'value': np.zeros(100)})
+        os.utime(cache.get_path(key), (1000. + i, 1000. + i))
+    #Reading an entry marks it as recently used.
+    cache.get(keys[0])
+
+    size = os.path.getsize(cache.get_path(keys[0]))
+    cache.max_bytes = 2 * size
+    assert cache.evict() == 2
+    assert [key in cache for key in keys] == [True, False, False, True]
+
+def test_entries_removed_by_another_process_are_skipped(tmpdir, monkeypatch):
+    cache = make_cache(tmpdir, max_bytes=0.)
+    fpath = make_spectrum(tmpdir)
+    keys = [cache.make_key(fpath, i=i) for i in range(3)]
+    for key in keys:
+        cache.put(key, {'value': 1.})
+    entries = cache.list_entries()
+    os.remove(cache.get_path(keys[1]))
+
+    #The entry disappears between listing it and removing it.
+    monkeypatch.setattr(cache, 'list_entries', lambda: entries)
+    assert cache.evict() == 2
+    assert not any([key in cache for key in keys])
+
+    #Or between listing the directory and reading its size.
+    cache.put(keys[0], {'value': 1.})
+    stat = os.stat
+    def stat_removed(fpath):
+        if fpath == cache.get_path(keys[0]):
+            os.remove(fpath)
+        return stat(fpath)
+    monkeypatch.setattr(os, 'stat', stat_removed)
+    assert Result_Cache.list_entries(cache) == []
+
+def test_get_entry_removed_after_reading(tmpdir, monkeypatch):
+    cache = make_cache(tmpdir)
+    key = cache.make_key(make_spectrum(tmpdir))
+    cache.put(key, {'value': 1.})
+    def utime_removed(fpath, times):
+        raise OSError(2, 'No such file or directory', fpath)
+    monkeypatch.setattr(os, 'utime', utime_removed)
+    assert cache.get(key) == {'value': 1.}
+
+def test_prune_only_removes_other_versions(tmpdir):
+    cache_fp = tmpdir.mkdir('cache')
+    fpath = make_spectrum(tmpdir)
+    for version in [version_0, version_1]:
+        cache = Result_Cache(str(cache_fp) + '/', version)
+        cache.put(cache.make_key(fpath), {})
+    #Files and directories which were not created by the cache are kept.
+    cache_fp.mkdir('notes').join('README').write('kept')
+    cache_fp.join('0123456789ac').write('kept')
+    assert cache.prune() == 1
+    assert sorted(os.listdir(str(cache_fp))) == [
+      '0123456789ac', version_1, 'notes']
+
+def test_code_version_covers_functions(tmpdir):
+    module_fp = tmpdir.join('analysis_module.py')
+    module_fp.write('x = 1\n')
+    module = types.ModuleType('analysis_module')
+    module.__file__ = str(module_fp)
+    version = compute_code_version([module, make_cache])
+    assert version == compute_code_version([module, make_cache])
+    assert version != compute_code_version([module, test_put_and_get])
+    module_fp.write('x = 2\n')
+    assert version != compute_code_version([module, make_cache])
+
+def test_analysis_version():
+    version = result_cache.get_analysis_version([compute_code_version])
+    assert result_cache.version_pattern.match(version)
+    assert version != result_cache.get_analysis_version([make_cache])
@@ -0,0 +1,82 @@
+import os
+
+import numpy as np
+
+from spectra_store import (Lazy_Spectra, Spectra_Store,
+                           parse_spectrum_filename)
+
+def write_spectrum(fpath, N, scale=1.):
+    wavelength = np.linspace(3500., 9000., N)
+    np.savetxt(fpath, np.column_stack((wavelength, scale * np.ones(N))))
+    return wavelength
+
+def make_spectra(tmpdir):
+    spectra_fp = tmpdir.mkdir('spectra')
+    write_spectrum(str(spectra_fp.join('sn1994d-19940310.142-ui.flm')), 10)
+    write_spectrum(str(spectra_fp.join('sn2005bl-20050416.000-ui.flm')), 25)
+    return str(spectra_fp) + '/', str(tmpdir.join('store')) + '/'
+
+def test_parse_spectrum_filename():
+    assert parse_spectrum_filename('sn1994d-19940310.142-ui.flm') == (
+      'SN1994D', '19940310.142')
+    assert parse_spectrum_filename('sn2002bo-ui-20020310.1.flm\n') == (
+      'SN2002BO', '20020310.100')
+
+def test_store_matches_text_files(tmpdir):
+    spectra_fp, store_fp = make_spectra(tmpdir)
+    store = Spectra_Store(spectra_fp, store_fp).get_spectra()
+    assert store.keys == ['SN1994D|19940310.142', 'SN2005BL|20050416.000']
+    filenames = {'SN1994D|19940310.142': 'sn1994d-19940310.142-ui.flm',
+                 'SN2005BL|20050416.000': 'sn2005bl-20050416.000-ui.flm'}
+    from_store = Lazy_Spectra(spectra_fp, filenames, store=store)
+    from_files = Lazy_Spectra(spectra_fp, filenames)
+    for ID in filenames:
+        assert from_store.get_N_pixels(ID) == from_files.get_N_pixels(ID)
+        for a, b in zip(from_store[ID], from_files[ID]):
+            np.testing.assert_array_equal(a, b)
+
+def test_store_is_ingested_again_when_files_change(tmpdir):
+    spectra_fp, store_fp = make_spectra(tmpdir)
+    Spectra_Store(spectra_fp, store_fp).get_spectra()
+    assert Spectra_Store(spectra_fp, store_fp).is_valid()
+
+    fpath = spectra_fp + 'sn1994d-19940310.142-ui.flm'
+    write_spectrum(fpath, 12, scale=2.)
+    os.utime(fpath, (0., 0.))
+    store = Spectra_Store(spectra_fp, store_fp)
+    assert not store.is_valid()
+    wavelength, flux = store.get_spectra()[0]
+    assert len(wavelength) == 12 and flux[0] == 2.
+
+def test_lazy_spectra_keeps_a_bounded_number(tmpdir, monkeypatch):
+    spectra_fp, store_fp = make_spectra(tmpdir)
+    filenames = {0: 'sn1994d-19940310.142-ui.flm',
+                 1: 'sn2005bl-20050416.000-ui.flm',
+                 2: 'sn1994d-19940310.142-ui.flm'}
+    spectra = Lazy_Spectra(spectra_fp, filenames, max_loaded=2)
+    reads = []
+    import spectra_store
+    read_spectrum_file = spectra_store.read_spectrum_file
+    monkeypatch.setattr(spectra_store, 'read_spectrum_file',
+                        lambda fpath: reads.append(fpath)
+                        or read_spectrum_file(fpath))
+    for key in [0, 1, 0, 2, 1, 0]:
+        spectra[key]
+        assert len(spectra.loaded) <= 2
+    #Reading 2 drops 1 (0 was requested more recently), then reading 1 drops
+    #0 and reading 0 drops 2. Only the second request of 0 is not read.
+    assert len(reads) == 5
+    assert list(spectra.loaded.keys()) == [1, 0]
+
+def test_rows_sharing_an_ID_keep_their_own_file(tmpdir):
+    spectra_fp, store_fp = make_spectra(tmpdir)
+    write_spectrum(spectra_fp + 'sn1994d-ui-19940310.142.flm', 30)
+    assert parse_spectrum_filename('sn1994d-ui-19940310.142.flm') == (
+      parse_spectrum_filename('sn1994d-19940310.142-ui.flm'))
+    filenames = {0: 'sn1994d-19940310.142-ui.flm',
+                 1: 'sn1994d-ui-19940310.142.flm'}
+    store = Spectra_Store(spectra_fp, store_fp).get_spectra()
+    for spectra in [Lazy_Spectra(spectra_fp, filenames),
+                    Lazy_Spectra(spectra_fp, filenames, store=store)]:
+        assert [len(spectra[0][0]), len(spectra[1][0])] == [10, 30]
+        assert [spectra.get_N_pixels(0), spectra.get_N_pixels(1)] == [10, 30]
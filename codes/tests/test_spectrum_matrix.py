@@ -0,0 +1,152 @@
+import numpy as np
+import pytest
+
+from spectrum_matrix import (make_grid, get_bin_edges, rebin_flux,
+                             write_spectrum_matrix, Spectrum_Matrix)
+
+def make_spectrum(w_min=3300., w_max=9700., N=2000, seed=0):
+    rng = np.random.RandomState(seed)
+    wavelength = np.sort(rng.uniform(w_min, w_max, N))
+    flux = 1. + 0.3 * np.sin(wavelength / 200.) + rng.normal(0., 0.05, N)
+    return wavelength, flux
+
+def integrate(wavelength, flux, w_min, w_max):
+    """Integral of a spectrum taken as constant over each pixel's bin."""
+    edges = get_bin_edges(wavelength)
+    overlap = np.clip(np.minimum(edges[1:], w_max)
+                      - np.maximum(edges[:-1], w_min), 0., None)
+    return np.sum(flux * overlap)
+
+def test_grid_edges():
+    grid = make_grid(3000., 3010., 2.)
+    np.testing.assert_allclose(grid, [3001., 3003., 3005., 3007., 3009.])
+    np.testing.assert_allclose(get_bin_edges(grid), np.arange(3000., 3011.,
+                                                              2.))
+
+def test_rebin_conserves_flux():
+    wavelength, flux = make_spectrum()
+    grid = make_grid(4000., 9000., 5.)
+    flux_out, coverage = rebin_flux(wavelength, flux, grid)
+    assert coverage.all()
+    edges = get_bin_edges(grid)
+    for w_min, w_max in [(4000., 9000.), (4000., 4005.), (6215., 7340.)]:
+        cols = (grid > w_min) & (grid < w_max)
+        np.testing.assert_allclose(np.sum(flux_out[cols] * np.diff(edges)[
+          cols]), integrate(wavelength, flux, w_min, w_max), rtol=1.e-10)
+
+def test_rebin_is_independent_of_the_input_order():
+    wavelength, flux = make_spectrum()
+    grid = make_grid(4000., 9000., 5.)
+    order = np.random.RandomState(1).permutation(len(wavelength))
+    np.testing.assert_allclose(rebin_flux(wavelength[order], flux[order],
+                                          grid)[0],
+                               rebin_flux(wavelength, flux, grid)[0])
+
+def test_rebin_of_a_constant_is_unchanged():
+    wavelength = np.linspace(3000., 10000., 777)
+    grid = make_grid(3500., 9500., 3.)
+    flux_out, coverage = rebin_flux(wavelength, 2.5 * np.ones(777), grid)
+    assert coverage.all()
+    np.testing.assert_allclose(flux_out, 2.5, rtol=1.e-12)
+
+def test_coverage_at_the_ends_of_the_spectrum():
+    wavelength, flux = make_spectrum(4001., 8999.)
+    edges_in = get_bin_edges(wavelength)
+    grid = make_grid(3000., 10000., 2.)
+    edges_out = get_bin_edges(grid)
+    flux_out, coverage = rebin_flux(wavelength, flux, grid)
+    inside = ((edges_out[:-1] >= edges_in[0])
+              & (edges_out[1:] <= edges_in[-1]))
+    np.testing.assert_array_equal(coverage, inside)
+    assert np.isnan(flux_out[~coverage]).all()
+    assert np.isfinite(flux_out[coverage]).all()
+
+    #Partially covered bins are kept when min_coverage allows it.
+    coverage_half = rebin_flux(wavelength, flux, grid, min_coverage=0.5)[1]
+    assert coverage_half.sum() >= coverage.sum()
+    assert coverage_half.sum() <= coverage.sum() + 2
+
+def test_gaps_are_not_covered():
+    wavelength = np.linspace(3000., 10000., 3501)
+    flux = np.ones(3501)
+    gap = (wavelength > 6000.) & (wavelength < 6100.)
+    flux[gap] = np.nan
+    grid = make_grid(3500., 9500., 10.)
+    flux_out, coverage = rebin_flux(wavelength, flux, grid)
+    assert not coverage[(grid > 6000.) & (grid < 6100.)].any()
+    assert coverage[(grid < 5980.) | (grid > 6120.)].all()
+    np.testing.assert_allclose(flux_out[coverage], 1.)
+
+def write_matrix(fpath, spectra, grid):
+    write_spectrum_matrix(fpath, iter(spectra), grid, N=len(spectra))
+    return Spectrum_Matrix(fpath)
+
+def make_metadata(name):
+    return {'name': name, 'source': 'test', 'SNID': None, 'phase': None,
+            'path': None}
+
+@pytest.fixture
+def matrix(tmpdir):
+    grid = make_grid(3000., 10000., 10.)
+    wavelength = np.linspace(3000., 10000., 1401)
+    spectra = [
+      (make_metadata('flat'), wavelength, np.ones(1401)),
+      (make_metadata('double'), wavelength, 2. * np.ones(1401)),
+      (make_metadata('slope'), wavelength, wavelength / 5000.),
+      (make_metadata('red'), wavelength[wavelength > 6000.],
+       3. * np.ones(np.sum(wavelength > 6000.)))]
+    return write_matrix(str(tmpdir) + '/matrix/', spectra, grid)
+
+def test_matrix_layout(matrix):
+    assert len(matrix) == 4
+    assert list(matrix.metadata['name']) == ['flat', 'double', 'slope',
+                                             'red']
+    assert list(matrix.select(name='slope')) == [2]
+    assert list(matrix.select(source='test')) == [0, 1, 2, 3]
+    assert matrix.flux.dtype == np.float32
+    assert np.isnan(matrix.get_flux([3])[0, matrix.wavelength < 5990.]).all()
+    assert matrix.metadata['N_covered'][3] == np.sum(
+      matrix.coverage[3, :])
+
+def test_window_mean(matrix):
+    mean = matrix.window_mean(4000., 5000.)
+    np.testing.assert_allclose(mean[:2], [1., 2.], rtol=1.e-6)
+    #Mean of a linear flux is its value at the centre of the window.
+    np.testing.assert_allclose(mean[2], 4500. / 5000., rtol=1.e-6)
+    assert np.isnan(mean[3])
+
+    #Pixels not covered are ignored rather than counted as zero.
+    np.testing.assert_allclose(matrix.window_mean(5000., 8000., rows=[3]),
+                               [3.], rtol=1.e-6)
+    np.testing.assert_allclose(matrix.window_mean(4000., 5000., rows=[1, 0]),
+                               [2., 1.], rtol=1.e-6)
+
+def test_difference(matrix):
+    #Flat spectra are identical once normalized.
+    np.testing.assert_allclose(matrix.difference([0], [1]), 0., atol=1.e-6)
+    np.testing.assert_allclose(matrix.difference([0], [1],
+                                                 normalization=None), -1.,
+                               rtol=1.e-6)
+
+    #A single row is broadcast against several.
+    difference = matrix.difference([0, 1, 2], [0])
+    assert difference.shape == (3, len(matrix.wavelength))
+    np.testing.assert_allclose(difference[:2], 0., atol=1.e-6)
+    expected = (matrix.wavelength / 5000.
+                / matrix.window_mean(4000., 9000., rows=[2])[0] - 1.)
+    np.testing.assert_allclose(difference[2], expected, atol=1.e-6)
+
+    #Not covered pixels stay nan.
+    difference = matrix.difference([3], [0], normalization=(6000., 9000.))
+    assert np.isnan(difference[0, matrix.wavelength < 5990.]).all()
+    np.testing.assert_allclose(difference[0, matrix.wavelength > 6010.], 0.,
+                               atol=1.e-6)
+
+def test_N_has_to_match(tmpdir):
+    grid = make_grid(4000., 5000., 10.)
+    wavelength, flux = make_spectrum()
+    spectra = [(make_metadata(str(i)), wavelength, flux) for i in range(3)]
+    with pytest.raises(ValueError):
+        write_spectrum_matrix(str(tmpdir) + '/a/', iter(spectra), grid, N=2)
+    with pytest.raises(ValueError):
+        write_spectrum_matrix(str(tmpdir) + '/b/', iter(spectra), grid, N=4)
@@ -0,0 +1,46 @@
+import json
+
+import numpy as np
+
+import stage_timing
+from stage_timing import Stage_Timer
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.
+    def time(self):
+        return self.now
+
+def test_report_lists_stages_and_latency_percentiles(tmpdir, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(stage_timing.time, 'time', clock.time)
+    timer = Stage_Timer()
+    with timer.stage('read') as record:
+        clock.now += 2.
+        record['rows'] = 5
+    with timer.stage('compute'):
+        clock.now += 3.
+    latencies = np.arange(1., 101.)
+    timer.add_latencies('compute', latencies, wall_time=10., N_items=200)
+    timer.add_latencies('empty', [])
+    timer.print_summary()
+
+    fpath = str(tmpdir.join('timing.json'))
+    timer.write_report(fpath)
+    with open(fpath) as inp:
+        report = json.load(inp)
+    assert report['total_wall_s'] == 5.
+    assert [stage['stage'] for stage in report['stages']] == [
+      'read', 'compute']
+    assert [stage['wall_s'] for stage in report['stages']] == [2., 3.]
+    assert report['stages'][0]['rows'] == 5
+    for stage in report['stages']:
+        assert stage['cpu_s'] >= 0. and stage['peak_rss_MB'] > 0.
+
+    summary = report['latencies']['compute']
+    assert summary['N'] == 100
+    assert summary['p50_s'] == 50.5 and summary['max_s'] == 100.
+    assert np.isclose(summary['p90_s'], 90.1)
+    assert np.isclose(summary['p99_s'], 99.01)
+    assert summary['throughput_per_s'] == 20.
+    assert report['latencies']['empty'] == {'N': 0}
@@ -0,0 +1,99 @@
+import os
+
+import pytest
+
+from tardis_catalog import Tardis_Catalog, parse_run_name
+
+def add_run(tardis_fp, grid, name, complete=True):
+    run_fp = tardis_fp.join(grid, name).ensure(dir=True)
+    if complete:
+        run_fp.join(name + '.pkl').write('')
+
+@pytest.fixture
+def tardis_fp(tmpdir):
+    tardis_fp = tmpdir.mkdir('tardis')
+    for lm in ['downbranch', 'macroatom']:
+        for L in ['8.942', '9.544']:
+            add_run(tardis_fp, '11fe_L-grid',
+                    'loglum-' + L + '_line_interaction-' + lm)
+    for X_Ti in ['0.5', '0.50', '2.00']:
+        add_run(tardis_fp, '11fe_Ti-grid', 'TiCrs-' + X_Ti
+                + '_loglum-9.544_line_interaction-downbranch')
+    add_run(tardis_fp, '11fe_Ti-grid',
+            'loglum-9.544_line_interaction-downbranch')
+    add_run(tardis_fp, '05bl_default_L-scaled',
+            'velocity_start-8100_loglum-8.617_line_interaction-downbranch'
+            '_time_explosion-12.0')
+    return tardis_fp
+
+def make_catalog(tmpdir, tardis_fp, **kwargs):
+    return Tardis_Catalog(str(tardis_fp),
+                          index_fpath=str(tmpdir.join('index.json')), **kwargs)
+
+def test_parse_run_name():
+    assert parse_run_name('TiCrs-0.5_loglum-9.544_line_interaction-'
+                          'macroatom') == {
+      'TiCrs': 0.5, 'loglum': 9.544, 'line_interaction': 'macroatom'}
+
+def test_find(tmpdir, tardis_fp):
+    catalog = make_catalog(tmpdir, tardis_fp)
+    assert len(catalog.runs) == 9
+    assert len(catalog.find(grid='11fe_L-grid', lm='macroatom')) == 2
+    run, = catalog.find(event='05bl', v=8100, L='8.617', texp=12.)
+    assert run['path'] == os.path.join(
+      '05bl_default_L-scaled', run['name'], run['name'] + '.pkl')
+    assert catalog.find(grid='11fe_L-grid', L='8.94') == []
+    with pytest.raises(ValueError):
+        catalog.find(X=1.)
+
+def test_get_prefers_the_run_with_exactly_the_given_parameters(
+  tmpdir, tardis_fp):
+    catalog = make_catalog(tmpdir, tardis_fp)
+    #Both the run with and without TiCrs match L and lm.
+    assert len(catalog.find(grid='11fe_Ti-grid', L='9.544',
+                            lm='downbranch')) == 4
+    assert catalog.get(grid='11fe_Ti-grid', L='9.544', lm='downbranch') == (
+      str(tardis_fp.join('11fe_Ti-grid',
+                         'loglum-9.544_line_interaction-downbranch',
+                         'loglum-9.544_line_interaction-downbranch.pkl')))
+
+    #'0.5' and '0.50' are the same number, but only one is written as given.
+    path = catalog.get(grid='11fe_Ti-grid', X_Ti='0.50', L='9.544',
+                       lm='downbranch')
+    assert os.path.basename(path).startswith('TiCrs-0.50_')
+    with pytest.raises(ValueError) as error:
+        catalog.get(grid='11fe_Ti-grid', X_Ti=0.5, L='9.544',
+                    lm='downbranch')
+    assert str(error.value).startswith('2 runs match')
+
+def test_require_reports_every_missing_run(tmpdir, tardis_fp):
+    catalog = make_catalog(tmpdir, tardis_fp)
+    observed_fp = tmpdir.join('observed.pkl')
+    observed_fp.write('')
+    paths = catalog.require([{'grid': '11fe_L-grid', 'L': '8.942',
+                              'lm': 'downbranch'}, str(observed_fp)])
+    assert paths[1] == str(observed_fp)
+    with pytest.raises(ValueError) as error:
+        catalog.require([{'grid': '11fe_L-grid', 'L': '1.000', 'lm': 'x'},
+                         str(tmpdir.join('missing.pkl'))])
+    assert '0 runs match' in str(error.value)
+    assert 'Missing file' in str(error.value)
+
+def test_index_is_updated_when_grids_change(tmpdir, tardis_fp):
+    make_catalog(tmpdir, tardis_fp)
+    add_run(tardis_fp, '05bl_L-grid', 'loglum-8.617_line_interaction-'
+            'downbranch', complete=False)
+    catalog = make_catalog(tmpdir, tardis_fp)
+    assert catalog.find(event='05bl', L='8.617', lm='downbranch') == (
+      catalog.find(grid='05bl_default_L-scaled'))
+
+    #Runs finished later are found, although the grid itself is unchanged.
+    tardis_fp.join('05bl_L-grid', 'loglum-8.617_line_interaction-downbranch',
+                   'loglum-8.617_line_interaction-downbranch.pkl').write('')
+    catalog = make_catalog(tmpdir, tardis_fp)
+    assert len(catalog.find(grid='05bl_L-grid')) == 1
+
+    tardis_fp.join('11fe_L-grid').remove()
+    catalog = make_catalog(tmpdir, tardis_fp)
+    assert catalog.find(grid='11fe_L-grid') == []
+    assert len(make_catalog(tmpdir, tardis_fp, rescan=True).runs) == 6
@@ -0,0 +1,115 @@
+import cPickle
+import os
+
+import numpy as np
+from astropy import units as u
+
+import cached_loader
+import tardis_products
+from tardis_products import Products_Store, Run_Products, extract_products
+
+def make_run(scale):
+    return {
+      'wavelength_corr': np.linspace(3000., 9000., 50),
+      'flux_normalized': scale * np.ones(50),
+      't_rad': np.linspace(12000., 8000., 10) * u.K,
+      'v_inner': np.linspace(1.e9, 2.e9, 10) * u.cm / u.s,
+      't_inner': 11000. * u.K, 'time_explosion': 12. * u.day,
+      'luminosity_requested': 3.5e42 * u.erg / u.s,
+      'pEW_f7': 100. * scale, 'pEW_unc_f7': 2., 'pEW_flag_f7': 0,
+      'wavelength_region_f7': np.linspace(5800., 6500., 20),
+      'element': 'Ti', 'other_array': np.arange(5.), 'other_scalar': 1.}
+
+def write_runs(tardis_fp):
+    fpaths = []
+    for i, L in enumerate(['8.942', '9.544']):
+        name = 'loglum-' + L + '_line_interaction-downbranch'
+        run_fp = tardis_fp.join('11fe_L-grid', name).ensure(dir=True)
+        with open(str(run_fp.join(name + '.pkl')), 'wb') as out:
+            cPickle.dump(make_run(i + 1.), out, protocol=2)
+        fpaths.append(str(run_fp.join(name + '.pkl')))
+    return fpaths
+
+def make_store(tmpdir, monkeypatch):
+    #The catalog index is written to ./../OUTPUT_FILES/.
+    tmpdir.mkdir('OUTPUT_FILES')
+    monkeypatch.chdir(str(tmpdir.mkdir('codes')))
+    tardis_fp = tmpdir.mkdir('tardis')
+    fpaths = write_runs(tardis_fp)
+    store_fp = str(tmpdir.join('products')) + '/'
+    extract_products(str(tardis_fp), store_fp)
+    cached_loader.loader.clear()
+    return Products_Store(str(tardis_fp), store_fp), fpaths
+
+def test_only_the_slim_fields_are_extracted(tmpdir, monkeypatch):
+    store, fpaths = make_store(tmpdir, monkeypatch)
+    row = store.scalars.iloc[0]
+    assert sorted(row['array_fields']) == [
+      'flux_normalized', 't_rad', 'v_inner', 'wavelength_corr']
+    assert sorted(row['scalar_fields']) == [
+      'luminosity_requested', 'pEW_f7', 'pEW_flag_f7', 'pEW_unc_f7',
+      't_inner', 'time_explosion']
+    stored = [fname for root, dirs, fnames in os.walk(str(tmpdir.join(
+      'products', 'arrays'))) for fname in fnames]
+    assert sorted(stored) == sorted(
+      [os.path.basename(fpath)[:-4] + '.' + field + '.npy'
+       for fpath in fpaths for field in row['array_fields']])
+
+def test_run_products_behave_like_the_run(tmpdir, monkeypatch):
+    store, fpaths = make_store(tmpdir, monkeypatch)
+    run = store.load(fpaths[1])
+    assert isinstance(run, Run_Products)
+    D = make_run(2.)
+
+    #Keys and membership are answered without reading the .pkl file.
+    assert sorted(run.keys()) == sorted(D.keys())
+    assert 'wavelength_region_f7' in run and 'not_a_field' not in run
+    assert run.get('not_a_field', 'default') == 'default'
+    for field in ['wavelength_corr', 'flux_normalized', 't_rad', 'v_inner',
+                  't_inner', 'time_explosion', 'luminosity_requested',
+                  'pEW_f7', 'pEW_flag_f7']:
+        assert np.all(run[field] == D[field])
+    assert run['t_rad'].unit == u.K
+    assert run.D is None
+
+    #Other fields are read from the .pkl file, once.
+    np.testing.assert_array_equal(run['wavelength_region_f7'],
+                                  D['wavelength_region_f7'])
+    assert run['element'] == 'Ti' and run.D is not None
+
+def test_changed_runs_are_read_from_their_pkl(tmpdir, monkeypatch):
+    store, fpaths = make_store(tmpdir, monkeypatch)
+    os.utime(fpaths[0], (0., 0.))
+    D = store.load(fpaths[0])
+    assert isinstance(D, dict) and D['pEW_f7'] == 100.
+
+def test_runs_are_shared_by_the_stores_of_the_process(tmpdir, monkeypatch):
+    store, fpaths = make_store(tmpdir, monkeypatch)
+    run = store.load(fpaths[0]).load_store_fields()
+    assert sorted(run.values.keys()) == sorted(
+      list(run.row['array_fields']) + list(run.row['scalar_fields']))
+    assert run.D is None
+    other = Products_Store(store.path_tardis_output, store.store_fp)
+    assert other.load(fpaths[0]) is run
+
+def test_extracted_again_runs_replace_their_entry(tmpdir, monkeypatch):
+    monkeypatch.setattr(tardis_products, 'run_products', {})
+    store, fpaths = make_store(tmpdir, monkeypatch)
+    run = store.load(fpaths[0])
+    os.utime(fpaths[0], (1.e9, 1.e9))
+    extract_products(store.path_tardis_output, store.store_fp)
+    cached_loader.loader.clear()
+    store = Products_Store(store.path_tardis_output, store.store_fp)
+    new_run = store.load(fpaths[0])
+    assert isinstance(new_run, Run_Products) and new_run is not run
+    assert store.load(fpaths[0]) is new_run
+    assert len(tardis_products.run_products) == 1
+
+def test_prefetched_runs_are_loaded_once(tmpdir, monkeypatch):
+    monkeypatch.setattr(tardis_products, 'run_products', {})
+    store, fpaths = make_store(tmpdir, monkeypatch)
+    runs = cached_loader.prefetch(fpaths * 20, store.load, N_threads=8)
+    runs.join()
+    for i, fpath in enumerate(fpaths * 20):
+        assert runs[i] is runs[i % len(fpaths)]
+    assert len(tardis_products.run_products) == len(fpaths)
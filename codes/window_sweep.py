@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pandas as pd
+
+def compute_window_sweep(D, smoothing_windows, compute_uncertainties=None):
+    """Compute the features of a spectrum for several smoothing windows.
+
+    Parameters
+    ----------
+    D : ~dict
+        Dictionary returned by 'Analyse_Spectra'. Its 'wavelength_corr' and
+        'flux_normalized' (de-redshifted and normalized) arrays are shared
+        by all the windows, so that this is only done once per spectrum.
+    smoothing_windows : ~list
+        Savitzky-Golay windows, in pixels.
+    compute_uncertainties : ~function
+        Called as compute_uncertainties(D, smoothing_window) to add the
+        uncertainties to the features of each window. Default is None, in
+        which case uncertainties are not computed.
+
+    Returns
+    -------
+    Dictionary with the scalar quantities (e.g. 'pEW_f7', 'pEW_unc_f7')
+    computed for each window.
+    """
+    #Imported here, so that compute_BSNIP_features can run without tardis.
+    import tardis.tardistools.compute_features as cp
+    sweep = {}
+    for smoothing_window in smoothing_windows:
+        D_window = cp.Analyse_Spectra(
+          wavelength=D['wavelength_corr'], flux=D['flux_normalized'],
+          redshift=0., extinction=0., smoothing_window=smoothing_window,
+          deredshift_and_normalize=False).run_analysis()
+        if compute_uncertainties is not None:
+            D_window = compute_uncertainties(D_window, smoothing_window)
+        sweep[smoothing_window] = dict(
+          (key, value) for key, value in D_window.items()
+          if not isinstance(value, np.ndarray))
+    return sweep
+
+def make_sweep_table(list_ID, list_sweep):
+    """Tidy table with one row per (ID, window), from the output of
+    'compute_window_sweep' for each ID.
+    """
+    rows, index_ID, index_window = [], [], []
+    for ID, sweep in zip(list_ID, list_sweep):
+        for smoothing_window in sorted(sweep.keys()):
+            rows.append(sweep[smoothing_window])
+            index_ID.append(ID)
+            index_window.append(smoothing_window)
+    return pd.DataFrame(rows, index=pd.MultiIndex.from_arrays(
+      [index_ID, index_window], names=['ID', 'window']))